@@ -1,9 +1,13 @@
 #pragma once
 
+#include <algorithm>
+#include <cstdint>
 #include <fstream>
 #include <unordered_map>
 #include <boost/filesystem.hpp>
 #include <iostream>
+#include <sstream>
+#include <vector>
 
 
 std::unordered_map<std::string, std::string> ConfigReader(std::string config_file)
@@ -30,6 +34,112 @@ std::unordered_map<std::string, std::string> ConfigReader(std::string config_fil
     return data;
 }
 
+// Reads config `config_id` from a manifest written by `psweep/manifest.py`:
+// a header line `#manifest\t<version>\t<row width>`, a line of tab-separated keys,
+// then one row per config of exactly <row width> bytes, tab-separated and padded with spaces.
+// Tries row number `config_id` first (grid sweeps), then the index `<manifest>.idx`
+// (hashed ids, see `psweep/manifest.py`), then scans the rows the index does not cover.
+// Returns an empty map if the manifest does not exist or does not hold `config_id`.
+std::unordered_map<std::string, std::string> ManifestReader(std::string const& manifest_file, std::string const& config_id)
+{
+    std::unordered_map<std::string, std::string> data;
+    std::ifstream fin(manifest_file, std::ios::binary);
+    if (!fin)
+        return data;
+
+    std::string line, tag;
+    int version = 0;
+    long width = 0;
+    std::getline(fin, line);
+    std::istringstream header(line);
+    header >> tag >> version >> width;
+    if (tag != "#manifest" || version != 1 || width <= 0)
+        throw std::runtime_error("'" + manifest_file + "' is not a version 1 manifest");
+
+    // Keys, and where the rows start.
+    std::vector<std::string> keys;
+    std::getline(fin, line);
+    std::istringstream key_fields(line);
+    std::string key;
+    while (std::getline(key_fields, key, '\t'))
+        keys.push_back(key);
+    long const rows_start = fin.tellg();
+
+    fin.seekg(0, std::ios::end);
+    long const n_rows = (long(fin.tellg()) - rows_start) / width;
+
+    std::string row(width, ' ');
+    auto read_row = [&](long i) -> bool
+    {
+        fin.clear();
+        fin.seekg(rows_start + i * width);
+        fin.read(&row[0], width);
+        if (!fin)
+            return false;
+
+        data.clear();
+        std::string value;
+        std::istringstream fields(row.substr(0, row.find_last_not_of(" \n") + 1));
+        for (auto const& k : keys)
+        {
+            std::getline(fields, value, '\t');
+            data[k] = value;
+        }
+        return data["CONFIG_ID"] == config_id;
+    };
+
+    // Grid sweeps give row i the config id i.
+    bool const is_index = !config_id.empty() && config_id.find_first_not_of("0123456789") == std::string::npos;
+    if (is_index && config_id.size() < 18 && std::stol(config_id) < n_rows && read_row(std::stol(config_id)))
+    {
+        std::cout << "reading config " << config_id << " from manifest:\t" << manifest_file << std::endl;
+        return data;
+    }
+
+    // Open addressing hash table from config id to row number plus one (little-endian int64), see `psweep/manifest.py`.
+    long scan_from = 0;
+    std::ifstream fidx(manifest_file + ".idx", std::ios::binary);
+    char magic[8];
+    int64_t n_slots = 0, n_indexed = 0;
+    if (fidx.read(magic, 8) && std::string(magic, 8) == "#mfidx1\n"
+        && fidx.read(reinterpret_cast<char*>(&n_slots), 8) && fidx.read(reinterpret_cast<char*>(&n_indexed), 8)
+        && n_slots > 0)
+    {
+        // 64 bit FNV-1a, the same as `id_hash`
+        uint64_t h = 0xcbf29ce484222325ULL;
+        for (unsigned char c : config_id)
+            h = (h ^ c) * 0x100000001b3ULL;
+
+        int64_t slot = 0;
+        uint64_t i = h % uint64_t(n_slots);
+        for (int64_t probe = 0; probe < n_slots; ++probe)
+        {
+            fidx.seekg(24 + i * 8);
+            if (!fidx.read(reinterpret_cast<char*>(&slot), 8) || slot == 0)
+                break;
+            if (slot - 1 < n_rows && read_row(slot - 1))
+            {
+                std::cout << "reading config " << config_id << " from manifest:\t" << manifest_file << std::endl;
+                return data;
+            }
+            i = (i + 1) % uint64_t(n_slots);
+        }
+        scan_from = std::min(long(n_indexed), n_rows);
+    }
+
+    for (long i = scan_from; i < n_rows; ++i)
+    {
+        if (read_row(i))
+        {
+            std::cout << "reading config " << config_id << " from manifest:\t" << manifest_file << std::endl;
+            return data;
+        }
+    }
+
+    data.clear();
+    return data;
+}
+
 // saves metadata of this network, including some parameters from `hh.h`
 void save_metadata(std::unordered_map<std::string, std::string> config)
 {
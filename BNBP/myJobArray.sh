@@ -0,0 +1,12 @@
+#!/bin/bash
+#SBATCH --nodes=1
+#SBATCH --mem-per-cpu=1g
+#SBATCH --cpus-per-task=8
+#SBATCH --time=20:00:00
+#SBATCH --account=forger1
+#SBATCH --partition=standard
+#SBATCH --mail-type=NONE
+# usage: sbatch --array=0-<n-1> myJobArray.sh <mapping file> <run ID>
+# line $SLURM_ARRAY_TASK_ID (0-indexed) of the mapping file lists the config IDs for this task.
+# they are fed to a single trainer in worker mode, so the dataset is only read once per task
+sed -n "$((SLURM_ARRAY_TASK_ID + 1))p" $1 | tr ' ' '\n' | srun ./hh_psweep ${SLURM_CPUS_PER_TASK:-8} --worker $2
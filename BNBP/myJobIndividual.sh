@@ -6,7 +6,6 @@
 #SBATCH --account=forger1
 #SBATCH --partition=standard
 #SBATCH --mail-type=NONE
-for (( c=$1; c<=$2; c++ ))
-do
-	srun ./hh_psweep 8 $c $3
-done
+# usage: sbatch myJobIndividual.sh <first config ID> <last config ID> <run ID>
+# the configs are fed to a single trainer in worker mode, so the dataset is only read once
+seq $1 $2 | srun ./hh_psweep 8 --worker $3
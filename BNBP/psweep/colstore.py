@@ -0,0 +1,377 @@
+"""columnar on-disk format for the psweep results table, replacing the pickled dataframe
+
+a table is a directory, `data_{run_ID}.cols/` by default, with one `.npy` file per
+column and a `meta.json` describing them. columns are typed from `TYPE_MAP` (or
+from the dataframe, for columns it does not know), and stored in one of two encodings:
+ - `'plain'` : the values as they are, in `c{i}.npy` for the `i`-th column. strings as fixed-width bytes
+ - `'dict'` : the distinct values in `c{i}.values.npy`, and a small unsigned integer code
+   per row in `c{i}.npy`. used for columns with at most `DICT_MAX_VALUES` distinct values,
+   which covers the hyperparameters of a grid: a float64 column shrinks to one byte per row
+
+every `.npy` is memory mapped when read, so only the columns (and row ranges) that
+a command asks for are ever paged in.
+
+## predicate pushdown
+`Table.read` takes filters `(col, op, value)` with `op` one of `FILTER_OPS`. on a
+`'dict'` column, the filter is evaluated on the distinct values only, and rows are
+matched by code. `'plain'` numeric columns carry a zone map (min and max of every
+`ZONE_ROWS` rows) in `meta.json`, so zones that cannot match are skipped without
+being read. float `'=='` and `'in'` compare within `FLOAT_ATOL`, like `plot_psweep.fcomp`.
+
+## usage
+    python -m psweep.colstore convert DATAFRAME_PICKLE <flags>
+    python -m psweep.colstore info TABLE
+"""
+
+import os
+import json
+import shutil
+from typing import *
+
+import numpy as np
+import pandas as pd
+
+from psweep.psweep import *
+
+
+TABLE_EXT : str = '.cols'
+META_FILE : str = 'meta.json'
+FORMAT_VERSION : int = 1
+
+# columns with at most this many distinct values are dictionary encoded
+DICT_MAX_VALUES : int = 65536
+
+# rows per zone of the zone maps
+ZONE_ROWS : int = 65536
+
+FLOAT_ATOL : float = 1e-5
+
+FILTER_OPS : Tuple[str, ...] = ('==', '!=', '<', '<=', '>', '>=', 'in')
+
+Filter = Tuple[str, str, Any]
+
+
+def is_table(path : str) -> bool:
+	"""whether `path` is a table written by `write_table`"""
+	return os.path.isfile(os.path.join(path, META_FILE))
+
+
+def _column_dtype(col : str, values : pd.Series, typemap : Dict[str, type]) -> np.dtype:
+	kind = typemap.get(col)
+	if kind is int:
+		return np.dtype(np.int64)
+	if kind is float:
+		return np.dtype(np.float64)
+	if kind is str or values.dtype == object:
+		width = max(1, int(values.astype(str).str.len().max())) if len(values) else 1
+		return np.dtype('S%d' % width)
+	return values.dtype
+
+
+def _code_dtype(n : int) -> np.dtype:
+	for dt in (np.uint8, np.uint16, np.uint32):
+		if n <= np.iinfo(dt).max + 1:
+			return np.dtype(dt)
+	return np.dtype(np.uint64)
+
+
+def _zone_map(arr : np.ndarray) -> Optional[List[List[float]]]:
+	"""`[min, max]` of every `ZONE_ROWS` rows of a numeric column, ignoring NaN"""
+	if arr.dtype.kind not in 'iuf' or len(arr) == 0:
+		return None
+	zones = []
+	for start in range(0, len(arr), ZONE_ROWS):
+		chunk = arr[start : start + ZONE_ROWS]
+		if arr.dtype.kind == 'f':
+			chunk = chunk[~np.isnan(chunk)]
+		if len(chunk) == 0:
+			zones.append([None, None])
+		else:
+			zones.append([chunk.min().item(), chunk.max().item()])
+	return zones
+
+
+def write_table(
+		df : pd.DataFrame,
+		path : str,
+		typemap : Dict[str, type] = TYPE_MAP,
+		dict_max_values : int = DICT_MAX_VALUES,
+	) -> None:
+	"""writes `df` as a table in the directory `path`, replacing any table there
+
+	the table is written next to `path` first and moved in place, so readers never see half of it
+	"""
+	tmp = path.rstrip('/') + '.tmp'
+	if os.path.isdir(tmp):
+		shutil.rmtree(tmp)
+	os.makedirs(tmp)
+
+	meta : Dict[str, Any] = {
+		'version' : FORMAT_VERSION,
+		'n_rows' : len(df),
+		'columns' : dict(),
+	}
+	for i, col in enumerate(df.columns):
+		values = df[col]
+		dtype = _column_dtype(col, values, typemap)
+		if dtype.kind == 'S':
+			arr = values.astype(str).str.encode('utf-8').to_numpy().astype(dtype)
+		else:
+			arr = values.to_numpy().astype(dtype)
+
+		fname = 'c%d' % i
+		info : Dict[str, Any] = { 'file' : fname, 'dtype' : dtype.str }
+
+		# NaNs are one distinct value (numpy >= 1.21)
+		uniq, codes = np.unique(arr, return_inverse = True)
+		codes = codes.reshape(-1)
+
+		if len(uniq) <= dict_max_values and len(uniq) < len(arr):
+			info['encoding'] = 'dict'
+			np.save(os.path.join(tmp, fname + '.values.npy'), uniq)
+			np.save(os.path.join(tmp, fname + '.npy'), codes.astype(_code_dtype(len(uniq))))
+		else:
+			info['encoding'] = 'plain'
+			info['zones'] = _zone_map(arr)
+			np.save(os.path.join(tmp, fname + '.npy'), arr)
+
+		meta['columns'][col] = info
+
+	with open(os.path.join(tmp, META_FILE), 'w') as fout:
+		json.dump(meta, fout, indent = '\t')
+
+	# swap in the new table
+	if os.path.isdir(path):
+		old = path.rstrip('/') + '.old'
+		if os.path.isdir(old):
+			shutil.rmtree(old)
+		os.rename(path, old)
+		os.rename(tmp, path)
+		shutil.rmtree(old)
+	else:
+		os.rename(tmp, path)
+
+
+def match(values : np.ndarray, op : str, value : Any) -> np.ndarray:
+	"""boolean mask of `values` matching `op value`"""
+	is_float = values.dtype.kind == 'f'
+	if values.dtype.kind == 'S':
+		value = [ str(v).encode('utf-8') for v in value ] if op == 'in' else str(value).encode('utf-8')
+
+	if op == 'in':
+		value = list(value)
+		if is_float:
+			return np.isclose(values[:, None], np.asarray(value, dtype = float)[None, :], rtol = 0, atol = FLOAT_ATOL).any(axis = 1)
+		return np.isin(values, value)
+	if op == '==':
+		return np.isclose(values, value, rtol = 0, atol = FLOAT_ATOL) if is_float else values == value
+	if op == '!=':
+		return ~np.isclose(values, value, rtol = 0, atol = FLOAT_ATOL) if is_float else values != value
+	if op == '<':
+		return values < value
+	if op == '<=':
+		return values <= value
+	if op == '>':
+		return values > value
+	if op == '>=':
+		return values >= value
+	raise ValueError('unknown filter op %s, expected one of %s' % (op, str(FILTER_OPS)))
+
+
+def _zone_may_match(zone : List[Any], op : str, value : Any) -> bool:
+	lo, hi = zone
+	if lo is None:
+		# only NaN, which matches nothing but '!='
+		return op == '!='
+	if op == '==':
+		return lo - FLOAT_ATOL <= value <= hi + FLOAT_ATOL
+	if op == 'in':
+		return any(lo - FLOAT_ATOL <= v <= hi + FLOAT_ATOL for v in value)
+	if op == '<':
+		return lo < value
+	if op == '<=':
+		return lo <= value
+	if op == '>':
+		return hi > value
+	if op == '>=':
+		return hi >= value
+	return True
+
+
+def parse_filter(expr : str) -> Filter:
+	"""parses `'KEY<op>VALUE'` (e.g. `'N_LAYER_1>=100'`, or `'LF_OUT in 0.1;0.2'`) into a filter"""
+	if ' in ' in expr:
+		col, _, rest = expr.partition(' in ')
+		return (col.strip(), 'in', [ _parse_value(v) for v in rest.split(';') ])
+	for op in ('==', '!=', '<=', '>=', '<', '>'):
+		if op in expr:
+			col, _, rest = expr.partition(op)
+			return (col.strip(), op, _parse_value(rest))
+	raise ValueError('cannot parse filter %s, expected KEY<op>VALUE with op one of %s' % (expr, str(FILTER_OPS)))
+
+
+def _parse_value(s : str) -> Any:
+	s = s.strip()
+	for kind in (int, float):
+		try:
+			return kind(s)
+		except ValueError:
+			pass
+	return s
+
+
+class Table(object):
+	"""a table written by `write_table`, opened lazily
+
+	### Parameters:
+	 - `path : str`
+	   the table directory
+	"""
+
+	def __init__(self, path : str):
+		self.path = path
+		with open(os.path.join(path, META_FILE), 'r') as fin:
+			self.meta = json.load(fin)
+		if self.meta['version'] != FORMAT_VERSION:
+			raise ValueError('%s has format version %s, expected %d' % (path, str(self.meta['version']), FORMAT_VERSION))
+		self._mmaps : Dict[str, np.ndarray] = dict()
+
+	def __len__(self) -> int:
+		return self.meta['n_rows']
+
+	@property
+	def columns(self) -> List[str]:
+		return list(self.meta['columns'])
+
+	def _load(self, fname : str) -> np.ndarray:
+		if fname not in self._mmaps:
+			self._mmaps[fname] = np.load(os.path.join(self.path, fname + '.npy'), mmap_mode = 'r')
+		return self._mmaps[fname]
+
+	def column(self, col : str, rows : Union[slice, np.ndarray] = slice(None)) -> np.ndarray:
+		"""decoded values of `col` at `rows`"""
+		info = self.meta['columns'][col]
+		data = self._load(info['file'])[rows]
+		if info['encoding'] == 'dict':
+			data = self._load(info['file'] + '.values')[data]
+		return np.asarray(data)
+
+	def mask(self, filters : Sequence[Filter], rows : slice = slice(None)) -> np.ndarray:
+		"""boolean mask of the rows in `rows` that match all of `filters`"""
+		start, stop, _ = rows.indices(len(self))
+		out = np.ones(max(0, stop - start), dtype = bool)
+		for col, op, value in filters:
+			info = self.meta['columns'][col]
+			if info['encoding'] == 'dict':
+				# evaluate on the distinct values, then match rows by code
+				hits = np.flatnonzero(match(self._load(info['file'] + '.values'), op, value))
+				codes = self._load(info['file'])
+				for z0 in range(start, stop, ZONE_ROWS):
+					z1 = min(z0 + ZONE_ROWS, stop)
+					sel = out[z0 - start : z1 - start]
+					if sel.any():
+						sel &= np.isin(codes[z0 : z1], hits)
+				continue
+
+			data = self._load(info['file'])
+			zones = info.get('zones')
+			# zones are aligned to multiples of `ZONE_ROWS`
+			for z in range(start // ZONE_ROWS, -(-stop // ZONE_ROWS)):
+				z0, z1 = max(z * ZONE_ROWS, start), min((z + 1) * ZONE_ROWS, stop)
+				sel = out[z0 - start : z1 - start]
+				if not sel.any():
+					continue
+				if zones is not None and not _zone_may_match(zones[z], op, value):
+					sel[:] = False
+					continue
+				sel &= match(np.asarray(data[z0 : z1]), op, value)
+		return out
+
+	def read(
+			self,
+			columns : Optional[Sequence[str]] = None,
+			filters : Sequence[Filter] = (),
+			rows : slice = slice(None),
+		) -> pd.DataFrame:
+		"""reads `columns` (all if `None`) of the rows in `rows` that match all of `filters`
+
+		### Parameters:
+		 - `columns : Optional[Sequence[str]]`
+		   (defaults to `None`)
+		 - `filters : Sequence[Filter]`
+		   `(col, op, value)` with `op` one of `FILTER_OPS`, see the module docstring
+		   (defaults to `()`)
+		 - `rows : slice`
+		   range of rows to consider, before filtering
+		   (defaults to `slice(None)`)
+
+		### Returns:
+		 - `pd.DataFrame`
+		   indexed by row number in the table
+		"""
+		if columns is None:
+			columns = self.columns
+		missing = [ c for c in list(columns) + [ f[0] for f in filters ] if c not in self.meta['columns'] ]
+		if missing:
+			raise KeyError('%s has no columns %s' % (self.path, str(missing)))
+
+		start, stop, _ = rows.indices(len(self))
+		if filters:
+			idx = start + np.flatnonzero(self.mask(filters, slice(start, stop)))
+		else:
+			idx = slice(start, stop)
+
+		out = dict()
+		for col in columns:
+			data = self.column(col, idx)
+			if data.dtype.kind == 'S':
+				data = np.char.decode(data, 'utf-8').astype(object)
+			out[col] = data
+		index = np.arange(start, stop) if isinstance(idx, slice) else idx
+		return pd.DataFrame(out, index = index, columns = list(columns))
+
+
+def load_table(
+		path : str,
+		columns : Optional[Sequence[str]] = None,
+		filters : Sequence[Filter] = (),
+		rows : slice = slice(None),
+	) -> pd.DataFrame:
+	"""`Table(path).read(...)`"""
+	return Table(path).read(columns, filters, rows)
+
+
+def table_path(file_save : str) -> str:
+	"""the table directory for a `read_and_save` target, which may still be named like a pickle"""
+	if file_save.endswith('.df'):
+		return file_save[:-len('.df')] + TABLE_EXT
+	return file_save
+
+
+def convert(filename : str, path : Optional[str] = None) -> str:
+	"""converts a pickled dataframe (`data_{run_ID}.df`) to a table, returns the table path"""
+	if path is None:
+		path = table_path(filename)
+	write_table(pd.read_pickle(filename), path)
+	print('> wrote %s' % path)
+	return path
+
+
+def info(path : str) -> None:
+	"""prints the columns of a table, their type, encoding and size on disk"""
+	table = Table(path)
+	print('%s:\t%d rows' % (path, len(table)))
+	for col, c in table.meta['columns'].items():
+		size = sum(
+			os.path.getsize(os.path.join(path, f))
+			for f in os.listdir(path) if f.split('.')[0] == c['file']
+		)
+		print('\t%-20s\t%-6s\t%-6s\t%8d bytes' % (col, c['dtype'], c['encoding'], size))
+
+
+if __name__ == '__main__':
+	import fire
+	fire.Fire({
+		'convert' : convert,
+		'info' : info,
+	})
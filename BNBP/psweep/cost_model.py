@@ -0,0 +1,206 @@
+"""predicts how long `hh_psweep` takes for a config, and packs configs into jobs of equal length
+
+## model
+runtime is dominated by integrating the HH neurons together with the partials
+needed for backprop. per time step and training sample, the output layer
+carries `N_LAYER_2 * N_LAYER_1 * N_LAYER_0` partials for `W1` and the hidden
+layer `N_LAYER_1 * N_LAYER_0`. the features are:
+ - `work` : `SIM_STEPS * N_LAYER_0 * N_LAYER_1 * (N_LAYER_2 + 1)` per training sample, times
+   `NUM_SNIFFS * MAX_EPOCHS * BATCH_SIZE` training samples, plus the forward passes of the
+   `EVAL_SAMPLES` test samples
+ - `samples` : number of samples, each of which reads its spike train from disk
+ - `1` : fixed cost of a run (reading the config, setting up the network, saving results)
+
+the predicted runtime is `coefs . features` in seconds. the prior `PRIOR_COEFS` is
+only a rough guess. `CostModel.fit` refines it from the runtimes of finished runs:
+the time between the trainer writing `config.txt` and `DONE.txt`.
+
+## packing
+`pack_lpt` sorts configs by predicted runtime, longest first, and gives each one
+to the job with the least work so far. the longest job is then within 4/3 of
+the best possible (Graham's bound), which brings the makespan of a sweep close
+to the total work divided by the number of jobs running at once.
+"""
+
+import os
+import math
+import heapq
+from typing import *
+
+import numpy as np
+
+from psweep.result_cache import read_config_strings
+
+
+# test samples the trainer evaluates at the end of a run (`EvaluateNetwork(..., 100)`)
+EVAL_SAMPLES : int = 100
+
+# seconds per unit of `work`, per sample, and per run
+PRIOR_COEFS : Tuple[float, float, float] = (1e-9, 0.01, 60.0)
+
+# `--time` limits handed out to jobs, in minutes. a job gets the smallest one
+# that covers its predicted runtime times the safety factor
+TIME_BUCKETS : Tuple[int, ...] = (15, 30, 60, 120, 240, 480, 720, 1200)
+
+
+def features(config : Dict[str, Any]) -> np.ndarray:
+	"""`(work, samples, 1)` for a config, see the module docstring"""
+	n0, n1, n2 = (float(config['N_LAYER_%d' % i]) for i in range(3))
+	sim_steps = float(config['SIM_STEPS'])
+	n_train = float(config['NUM_SNIFFS']) * float(config['MAX_EPOCHS']) * float(config['BATCH_SIZE'])
+
+	work = sim_steps * n0 * n1 * (n_train * (n2 + 1) + EVAL_SAMPLES)
+	return np.array([ work, n_train + EVAL_SAMPLES, 1.0 ])
+
+
+def observed_runtime(dirname : str) -> Optional[float]:
+	"""seconds from the trainer writing `config.txt` to writing `DONE.txt`, `None` if the run is not finished"""
+	try:
+		return os.path.getmtime(os.path.join(dirname, 'DONE.txt')) - os.path.getmtime(os.path.join(dirname, 'config.txt'))
+	except OSError:
+		return None
+
+
+def read_observations(
+		datadir : str = '../../psweep_data/',
+		pattern : Optional[str] = None,
+		max_runs : Optional[int] = None,
+	) -> List[Tuple[Dict[str, str], float]]:
+	"""`(config, runtime)` of the finished runs in `datadir`
+
+	### Parameters:
+	 - `datadir : str`
+	   (defaults to `'../../psweep_data/'`)
+	 - `pattern : Optional[str]`
+	   only look at directories starting with this
+	   (defaults to `None`)
+	 - `max_runs : Optional[int]`
+	   only use the most recently finished runs, since the cluster might have changed
+	   (defaults to `None`)
+	"""
+	seen : Set[str] = set()
+	found : List[Tuple[float, Dict[str, str], float]] = []
+
+	for name in os.listdir(datadir):
+		if pattern is not None and not name.startswith(pattern):
+			continue
+
+		# runs linked from the result cache would be counted twice
+		dirname = os.path.realpath(os.path.join(datadir, name))
+		if dirname in seen:
+			continue
+		seen.add(dirname)
+
+		runtime = observed_runtime(dirname)
+		if runtime is None or runtime <= 0:
+			continue
+		try:
+			config = read_config_strings(os.path.join(dirname, 'config.txt'))
+			features(config)
+		except (OSError, KeyError, ValueError):
+			continue
+
+		found.append((os.path.getmtime(os.path.join(dirname, 'DONE.txt')), config, runtime))
+
+	found.sort(key = lambda x : x[0], reverse = True)
+	if max_runs is not None:
+		found = found[:max_runs]
+
+	return [ (config, runtime) for _, config, runtime in found ]
+
+
+class CostModel(object):
+	"""linear runtime model on `features`, see the module docstring
+
+	### Parameters:
+	 - `coefs : Sequence[float]`
+	   seconds per unit of each feature
+	   (defaults to `PRIOR_COEFS`)
+	"""
+
+	def __init__(self, coefs : Sequence[float] = PRIOR_COEFS):
+		self.coefs = np.array(coefs, dtype = float)
+		self.n_observed : int = 0
+
+	def predict(self, config : Dict[str, Any]) -> float:
+		"""predicted runtime of `config`, in seconds"""
+		return float(features(config) @ self.coefs)
+
+	def fit(self, observations : Sequence[Tuple[Dict[str, Any], float]]) -> 'CostModel':
+		"""refines the coefficients from `(config, runtime)` pairs, returns `self`
+
+		coefficients are kept non-negative: a feature that would get a negative
+		coefficient is dropped and the rest refitted. with fewer observations than
+		features, the prior is only rescaled to match the observed total
+		"""
+		if not observations:
+			return self
+
+		X = np.array([ features(config) for config, _ in observations ])
+		y = np.array([ runtime for _, runtime in observations ], dtype = float)
+		self.n_observed = len(y)
+
+		if len(y) < X.shape[1]:
+			self.coefs = self.coefs * (y.sum() / (X @ self.coefs).sum())
+			return self
+
+		# relative error matters, not absolute: weight every run by its runtime
+		w = 1.0 / y
+		active = list(range(X.shape[1]))
+		coefs = np.zeros(X.shape[1])
+		while active:
+			sol, *_ = np.linalg.lstsq(X[:, active] * w[:, None], y * w, rcond = None)
+			if (sol >= 0).all():
+				coefs[:] = 0.0
+				coefs[active] = sol
+				break
+			active.pop(int(np.argmin(sol)))
+
+		if coefs.any():
+			self.coefs = coefs
+		return self
+
+
+def load_model(
+		datadir : str = '../../psweep_data/',
+		pattern : Optional[str] = None,
+		max_runs : Optional[int] = 1000,
+	) -> CostModel:
+	"""the prior, refined from the finished runs in `datadir`"""
+	model = CostModel().fit(read_observations(datadir, pattern, max_runs))
+	print('> cost model:\tfitted on %d runs, coefs %s' % (model.n_observed, str(model.coefs)))
+	return model
+
+
+def pack_lpt(costs : Dict[str, float], n_bins : int) -> List[List[str]]:
+	"""longest processing time first: packs items into `n_bins` bins of roughly equal total cost
+
+	empty bins are dropped. within a bin, items are ordered longest first
+	"""
+	bins : List[List[str]] = [ [] for _ in range(n_bins) ]
+	heap : List[Tuple[float, int]] = [ (0.0, k) for k in range(n_bins) ]
+
+	for item in sorted(costs, key = lambda x : costs[x], reverse = True):
+		load, k = heapq.heappop(heap)
+		bins[k].append(item)
+		heapq.heappush(heap, (load + costs[item], k))
+
+	return [ b for b in bins if b ]
+
+
+def time_limit(
+		seconds : float,
+		safety : float = 1.5,
+		buckets : Sequence[int] = TIME_BUCKETS,
+	) -> int:
+	"""smallest of `buckets` (minutes) that covers `seconds * safety`. the largest bucket if none does"""
+	minutes = math.ceil(seconds * safety / 60.0)
+	for b in sorted(buckets):
+		if b >= minutes:
+			return b
+	return max(buckets)
+
+
+def format_minutes(minutes : int) -> str:
+	"""as `HH:MM:SS`, for `sbatch --time`"""
+	return '%02d:%02d:00' % (minutes // 60, minutes % 60)
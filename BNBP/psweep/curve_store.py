@@ -0,0 +1,263 @@
+"""every run's learning curve in one place: a ragged-array store next to the results table
+
+`psweep_load` collapses `loss.txt` to a few scalars, and anything that needs the full
+curves (plots, culling, comparing runs) had to parse every run directory again. the
+store keeps them together, in a directory (`data_{run_ID}.curves/` by default):
+ - `loss.f32` : the losses of all runs, as float32, one run after another, row by row
+ - `labels.i16` : the labels of all runs (`labels.txt`), as int16, in the same layout
+ - `index.npy` : one record per run, see `INDEX_DTYPE`: the run's directory name
+   (`{run_ID}_ID{n}`, unique across runs unlike `CONFIG_ID`), where its values start
+   in both files, and the number of rows (batches) and values per row
+
+the two data files are append only, and memory mapped when read. a run that is read
+again gets its curve appended, and its record points to the new one. the old one
+stays as garbage until `compact`. the index is replaced atomically after the data
+is written, so readers never see a record pointing past the end of a file.
+
+## usage
+    python -m psweep.curve_store info STORE
+    python -m psweep.curve_store compact STORE
+"""
+
+import os
+from typing import *
+
+import numpy as np
+
+from psweep.psweep import *
+
+
+CURVES_EXT : str = '.curves'
+LOSS_FILE : str = 'loss.f32'
+LABELS_FILE : str = 'labels.i16'
+INDEX_FILE : str = 'index.npy'
+
+LOSS_DTYPE = np.float32
+LABELS_DTYPE = np.int16
+
+# width of a directory name in the index
+KEY_WIDTH : int = 64
+
+# `psweep_load` compacts a store when more than this fraction of it is garbage
+COMPACT_GARBAGE : float = 0.5
+
+INDEX_DTYPE = np.dtype([
+	('key', 'S%d' % KEY_WIDTH),
+	('loss_start', np.int64),
+	('labels_start', np.int64),
+	('n_rows', np.int32),
+	('width', np.int32),
+	('n_label_rows', np.int32),
+	('label_width', np.int32),
+])
+
+
+def run_key(directory : str) -> str:
+	"""`{run_ID}_ID{n}` from a run directory"""
+	return os.path.basename(directory.rstrip('/'))
+
+
+def curves_path(file_save : str) -> str:
+	"""the store that goes with a results table (or pickle) `file_save`"""
+	return os.path.splitext(file_save.rstrip('/'))[0] + CURVES_EXT
+
+
+class CurveStore(object):
+	"""a curve store directory, created if needed
+
+	### Parameters:
+	 - `path : str`
+	"""
+
+	def __init__(self, path : str):
+		self.path = path
+		os.makedirs(path, exist_ok = True)
+		index_file = os.path.join(path, INDEX_FILE)
+		if os.path.isfile(index_file):
+			self.index = np.load(index_file)
+		else:
+			self.index = np.zeros(0, dtype = INDEX_DTYPE)
+		self._rows : Dict[str, int] = { k.decode('utf-8') : i for i, k in enumerate(self.index['key']) }
+		self._maps : Dict[str, np.ndarray] = dict()
+
+	def __len__(self) -> int:
+		return len(self.index)
+
+	def __contains__(self, key : str) -> bool:
+		return run_key(key) in self._rows
+
+	def keys(self) -> List[str]:
+		return list(self._rows)
+
+	def _file(self, fname : str) -> str:
+		return os.path.join(self.path, fname)
+
+	def _map(self, fname : str, dtype : Any) -> np.ndarray:
+		"""memory map of a data file, remapped when it has grown"""
+		size = os.path.getsize(self._file(fname)) if os.path.isfile(self._file(fname)) else 0
+		n = size // np.dtype(dtype).itemsize
+		m = self._maps.get(fname)
+		if m is None or len(m) < n:
+			m = np.memmap(self._file(fname), dtype = dtype, mode = 'r', shape = (n,)) if n else np.zeros(0, dtype = dtype)
+			self._maps[fname] = m
+		return m
+
+	# * writing
+
+	def append(self, curves : Iterable[Tuple[str, Optional[np.ndarray], Optional[np.ndarray]]]) -> int:
+		"""adds `(directory, loss, labels)` curves (2d arrays, rows are batches, `None` if missing),
+		replacing the ones stored for those runs. returns the number of runs added
+		"""
+		records = []
+		self._maps.clear()
+		with open(self._file(LOSS_FILE), 'ab') as f_loss, open(self._file(LABELS_FILE), 'ab') as f_labels:
+			loss_pos = f_loss.tell() // np.dtype(LOSS_DTYPE).itemsize
+			labels_pos = f_labels.tell() // np.dtype(LABELS_DTYPE).itemsize
+			for directory, loss, labels in curves:
+				key = run_key(directory)
+				if len(key.encode('utf-8')) > KEY_WIDTH:
+					raise ValueError('directory name %s is longer than %d bytes' % (key, KEY_WIDTH))
+				loss = np.zeros((0, 0)) if loss is None else loss
+				labels = np.zeros((0, 0)) if labels is None else labels
+
+				f_loss.write(np.ascontiguousarray(loss, dtype = LOSS_DTYPE).tobytes())
+				f_labels.write(np.ascontiguousarray(labels, dtype = LABELS_DTYPE).tobytes())
+				records.append((key, loss_pos, labels_pos, loss.shape[0], loss.shape[1], labels.shape[0], labels.shape[1]))
+				loss_pos += loss.size
+				labels_pos += labels.size
+
+		if records:
+			self._update_index(np.array(records, dtype = INDEX_DTYPE))
+		return len(records)
+
+	def _update_index(self, records : np.ndarray) -> None:
+		# later records of the same run win
+		new = { k.decode('utf-8') : r for k, r in zip(records['key'], records) }
+		index = self.index.copy()
+		extra = []
+		for key, r in new.items():
+			if key in self._rows:
+				index[self._rows[key]] = r
+			else:
+				extra.append(r)
+		if extra:
+			index = np.concatenate([ index, np.array(extra, dtype = INDEX_DTYPE) ])
+		self._write_index(index)
+
+	def _write_index(self, index : np.ndarray) -> None:
+		tmp = self._file(INDEX_FILE + '.tmp.npy')
+		np.save(tmp, index)
+		os.replace(tmp, self._file(INDEX_FILE))
+		self.index = index
+		self._rows = { k.decode('utf-8') : i for i, k in enumerate(index['key']) }
+
+	def retain(self, directories : Iterable[str]) -> int:
+		"""drops the runs that are not in `directories` from the index, returns how many were dropped"""
+		keep = { run_key(d) for d in directories }
+		mask = np.array([ k in keep for k in self._rows ], dtype = bool)
+		n_dropped = int((~mask).sum())
+		if n_dropped:
+			self._write_index(self.index[mask])
+		return n_dropped
+
+	def garbage(self) -> float:
+		"""fraction of the loss file no run points to anymore"""
+		total = len(self._map(LOSS_FILE, LOSS_DTYPE))
+		used = int((self.index['n_rows'].astype(np.int64) * self.index['width']).sum())
+		return 1.0 - used / total if total else 0.0
+
+	def compact(self) -> None:
+		"""rewrites the data files with only the curves the index points to"""
+		loss, labels = self._map(LOSS_FILE, LOSS_DTYPE), self._map(LABELS_FILE, LABELS_DTYPE)
+		index = self.index.copy()
+		tmp_loss, tmp_labels = self._file(LOSS_FILE + '.tmp'), self._file(LABELS_FILE + '.tmp')
+		with open(tmp_loss, 'wb') as f_loss, open(tmp_labels, 'wb') as f_labels:
+			loss_pos, labels_pos = 0, 0
+			for r in index:
+				n = int(r['n_rows']) * int(r['width'])
+				f_loss.write(np.asarray(loss[r['loss_start'] : r['loss_start'] + n]).tobytes())
+				r['loss_start'] = loss_pos
+				loss_pos += n
+
+				n = int(r['n_label_rows']) * int(r['label_width'])
+				f_labels.write(np.asarray(labels[r['labels_start'] : r['labels_start'] + n]).tobytes())
+				r['labels_start'] = labels_pos
+				labels_pos += n
+
+		self._maps.clear()
+		# unlike `append`, this moves curves that the index points to, so nothing should read the store meanwhile
+		os.replace(tmp_loss, self._file(LOSS_FILE))
+		os.replace(tmp_labels, self._file(LABELS_FILE))
+		self._write_index(index)
+
+	# * reading
+
+	def _record(self, key : str) -> np.void:
+		return self.index[self._rows[run_key(key)]]
+
+	def loss(self, key : str) -> np.ndarray:
+		"""the `(n_batches, batch_size)` loss curve of a run, as a view into the store"""
+		r = self._record(key)
+		n = int(r['n_rows']) * int(r['width'])
+		return self._map(LOSS_FILE, LOSS_DTYPE)[r['loss_start'] : r['loss_start'] + n].reshape(int(r['n_rows']), int(r['width']))
+
+	def labels(self, key : str) -> np.ndarray:
+		"""the `(n_batches, batch_size)` labels of a run, as a view into the store"""
+		r = self._record(key)
+		n = int(r['n_label_rows']) * int(r['label_width'])
+		return self._map(LABELS_FILE, LABELS_DTYPE)[r['labels_start'] : r['labels_start'] + n].reshape(int(r['n_label_rows']), int(r['label_width']))
+
+	def mean_curve(self, key : str) -> np.ndarray:
+		"""loss averaged over each batch"""
+		return self.loss(key).mean(axis = 1)
+
+	def batch_means(self, keys : Optional[Sequence[str]] = None) -> Tuple[List[str], np.ndarray, np.ndarray]:
+		"""loss averaged over each batch, for many runs at once
+
+		### Returns:
+		 - `Tuple[List[str], np.ndarray, np.ndarray]`
+		   the runs, the batch means of all of them back to back, and the offset of each run's
+		   first batch in there (with the total at the end), so run `i` is `means[offsets[i] : offsets[i + 1]]`
+		"""
+		idx = self.index if keys is None else self.index[[ self._rows[run_key(k)] for k in keys ]]
+		loss = self._map(LOSS_FILE, LOSS_DTYPE)
+		offsets = np.concatenate([ [ 0 ], np.cumsum(idx['n_rows'], dtype = np.int64) ])
+		means = np.empty(offsets[-1], dtype = np.float64)
+		for i, r in enumerate(idx):
+			n = int(r['n_rows']) * int(r['width'])
+			if n:
+				means[offsets[i] : offsets[i + 1]] = loss[r['loss_start'] : r['loss_start'] + n].reshape(int(r['n_rows']), -1).mean(axis = 1)
+		return ([ k.decode('utf-8') for k in idx['key'] ], means, offsets)
+
+	def final_losses(self, last_n : int = 5, keys : Optional[Sequence[str]] = None) -> Dict[str, float]:
+		"""average loss over the `last_n` batches of every run, like `psweep_load.loss_metrics`"""
+		names, means, offsets = self.batch_means(keys)
+		out = dict()
+		for i, k in enumerate(names):
+			curve = means[max(offsets[i], offsets[i + 1] - last_n) : offsets[i + 1]]
+			out[k] = float(curve.mean()) if len(curve) else float('nan')
+		return out
+
+
+def info(path : str) -> None:
+	"""prints the number of runs and curves in a store, and how much of it is garbage"""
+	store = CurveStore(path)
+	print('%s:\t%d runs, %d batches, %.0f%% garbage' % (
+		path, len(store), int(store.index['n_rows'].sum()), 100 * store.garbage(),
+	))
+
+
+def compact(path : str) -> None:
+	"""drops the curves no run points to anymore, see `CurveStore.compact`"""
+	store = CurveStore(path)
+	before = store.garbage()
+	store.compact()
+	print('> %s: compacted, was %.0f%% garbage' % (path, 100 * before))
+
+
+if __name__ == '__main__':
+	import fire
+	fire.Fire({
+		'info' : info,
+		'compact' : compact,
+	})
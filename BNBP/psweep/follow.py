@@ -0,0 +1,351 @@
+"""follows a running sweep: keeps its results table current as runs progress and finish
+
+instead of running `psweep_load.read_and_save` again and again by hand, `follow`
+polls the data directory every `interval` seconds and only reads what is new:
+ - run directories that appeared since the last poll (one listing of `datadir`)
+ - the rows appended to `loss.txt` by runs that are still going, from where the last
+   poll stopped. only complete lines are consumed, like `halving.LossTail`
+ - `percent0.txt` of runs whose `DONE.txt` has appeared. finished runs are not looked at again
+
+so a poll costs about the size of the new data, not of the whole sweep. runs in
+progress are in the table with their metrics so far, `DONE` at 0 and `N_BATCHES`
+the number of batches they have written. polling, rather than the inotify
+watcher of `psweep/watcher.py`, since `loss.txt` is written on other nodes.
+
+every `snapshot_interval` seconds (and on exit), the table is written to
+`file_save` as a results table (see `psweep/colstore.py`), which `plot_psweep`
+opens without reading the runs. finished runs also go to the ingestion manifest,
+the curve store and the registry, just as `read_and_save` would put them there,
+so a later `read_and_save` does not read them again.
+
+## usage
+    python -m psweep.follow RUN_ID <flags>
+"""
+
+import os
+import time
+import glob
+from typing import *
+
+import numpy as np
+import pandas as pd
+
+from psweep.psweep import *
+from psweep.psweep_load import (
+	read_config, read_percent, loss_metrics, parse_loss_bytes, parse_loss_file, _read_folder,
+	ingest_key, read_ingest_manifest, write_ingest_manifest, registry_row, INGEST_EXT,
+)
+from psweep.result_cache import is_retired
+from psweep.registry import Registry
+from psweep.colstore import write_table, TABLE_EXT
+from psweep.curve_store import CurveStore, curves_path
+
+
+DONE_FILE : str = 'DONE.txt'
+
+
+class LiveLoss(object):
+	"""the metrics of a `loss.txt` that is still being written, from the rows appended since the last `poll`
+
+	keeps the first `first_n` and the last `max(last_n, slope_n)` rows, which is all
+	that `psweep_load.loss_metrics` looks at, and every row only if `keep_rows`
+	(for the curve store).
+
+	a run that is retired and re-run into the same directory (see `result_cache.clear_run_dir`)
+	starts a new `loss.txt`. when the file is replaced or shrinks, everything read so far is dropped
+	and the new file is read from the start
+	"""
+
+	def __init__(self, filename : str, first_n : int = 5, last_n : int = 5, slope_n : int = 20, keep_rows : bool = False):
+		self.filename = filename
+		self.first_n, self.last_n, self.slope_n = first_n, last_n, slope_n
+		self.keep_rows = keep_rows
+		self._reset(None)
+
+	def _reset(self, ino : Optional[int]) -> None:
+		self._ino : Optional[int] = ino
+		self._offset : int = 0
+		self.n_rows : int = 0
+		self.head : Optional[np.ndarray] = None
+		self.tail : Optional[np.ndarray] = None
+		self.any_nan : bool = False
+		self.broken : bool = False
+		self.chunks : Optional[List[np.ndarray]] = [] if self.keep_rows else None
+
+	def poll(self) -> int:
+		"""reads any new complete rows, returns how many"""
+		try:
+			with open(self.filename, 'rb') as fin:
+				st = os.fstat(fin.fileno())
+				if st.st_ino != self._ino or st.st_size < self._offset:
+					self._reset(st.st_ino)
+				fin.seek(self._offset)
+				chunk = fin.read()
+		except OSError:
+			return 0
+
+		end = chunk.rfind(b'\n')
+		if end < 0:
+			return 0
+		self._offset += end + 1
+
+		rows = parse_loss_bytes(chunk[:end + 1])
+		if rows is None or (self.tail is not None and rows.shape[1] != self.tail.shape[1]):
+			# not in the trainer's format, like `parse_loss_file` the whole curve is lost
+			self.broken = True
+			return 0
+
+		self.n_rows += len(rows)
+		self.any_nan = self.any_nan or not np.isfinite(rows).all()
+		if self.head is None or len(self.head) < self.first_n:
+			self.head = rows[:self.first_n] if self.head is None else np.vstack([ self.head, rows ])[:self.first_n]
+		keep = max(self.last_n, self.slope_n)
+		self.tail = rows[-keep:] if self.tail is None else np.vstack([ self.tail, rows ])[-keep:]
+		if self.chunks is not None:
+			self.chunks.append(rows)
+		return len(rows)
+
+	def metrics(self) -> Dict[str, float]:
+		"""`psweep_load.loss_metrics` of every row read so far"""
+		if self.broken or self.tail is None:
+			return loss_metrics(None)
+		out = loss_metrics(self.tail, last_n = self.last_n, slope_n = self.slope_n)
+		with np.errstate(divide = 'ignore', invalid = 'ignore'):
+			out['rel'] = out['abs'] / float(np.average(self.head))
+		out['nan'] = 1.0 if self.any_nan else 0.0
+		return out
+
+	def curve(self) -> Optional[np.ndarray]:
+		"""every row read so far, if kept"""
+		if self.broken or not self.chunks:
+			return None
+		return np.vstack(self.chunks)
+
+
+class Follower(object):
+	"""keeps the results table of the runs matching `run_ID` in memory, see the module docstring
+
+	### Parameters:
+	 - `run_ID : str`
+	 - `datadir : str`
+	   (defaults to `'../../../psweep_data/'`)
+	 - `file_save : Optional[str]`
+	   results table for the snapshots. if `None`, `'data_{run_ID}.cols'`
+	   (defaults to `None`)
+	 - `registry : bool`
+	   record finished runs in the registry of `datadir`
+	   (defaults to `True`)
+	 - `curves : bool`
+	   add the curves of finished runs to the curve store of `file_save`
+	   (defaults to `True`)
+	"""
+
+	def __init__(
+			self,
+			run_ID : str = '',
+			datadir : str = '../../../psweep_data/',
+			file_save : Optional[str] = None,
+			registry : bool = True,
+			curves : bool = True,
+		):
+		self.run_ID = run_ID
+		self.datadir = datadir
+		self.file_save = file_save if file_save is not None else f'data_{run_ID}' + TABLE_EXT
+		self.ingest_file = self.file_save.rstrip('/') + INGEST_EXT
+		self.registry = Registry(datadir) if registry else None
+		self.store = CurveStore(curves_path(self.file_save)) if curves else None
+
+		# finished runs: `(ingest_key, row)`, like the ingestion manifest
+		self.done : Dict[str, Tuple[Any, Dict[str, Any]]] = dict()
+		# runs in progress: config, and the loss read so far
+		self.active : Dict[str, Tuple[Dict[str, Any], LiveLoss]] = dict()
+		self._seen : Set[str] = set()
+		self._new_done : List[str] = []
+		self.changed : bool = False
+
+		# runs `read_and_save` (or an earlier `follow`) already read are not read again
+		self._known = read_ingest_manifest(self.ingest_file)
+
+	def _discover(self) -> List[str]:
+		"""run directories that appeared since the last call, without retired runs (they never finish)"""
+		new = []
+		for x in glob.glob(self.datadir + self.run_ID + '_*'):
+			d = x + '/'
+			if d not in self._seen and os.path.isdir(x) and not is_retired(x):
+				new.append(d)
+		return sorted(new)
+
+	def _finish(
+			self, 
+			d : str, 
+			row : Dict[str, Any], 
+			n_batches : float, 
+			loss : Optional[np.ndarray], 
+			labels : Optional[np.ndarray], 
+			key : Any,
+		) -> None:
+		row = dict(row, DONE = 1, N_BATCHES = n_batches)
+		self.done[d] = (key, row)
+		self._new_done.append(d)
+		if self.store is not None:
+			self.store.append([ (d, loss, labels) ])
+		self.changed = True
+
+	def poll(self) -> Tuple[int, int, int]:
+		"""one round of reading, returns the number of runs found and finished, and of loss rows read"""
+		n_found, n_done, n_rows = 0, 0, 0
+
+		# * new directories
+		for d in self._discover():
+			if not os.path.isfile(d + 'config.txt'):
+				# not started yet, look again next time
+				continue
+			self._seen.add(d)
+			n_found += 1
+
+			if os.path.isfile(d + DONE_FILE):
+				key = ingest_key(d)
+				if d in self._known and self._known[d][0] == key and (self.store is None or d in self.store):
+					n_batches = len(self.store.loss(d)) if self.store is not None else float('nan')
+					self.done[d] = (key, dict(self._known[d][1], DONE = 1, N_BATCHES = n_batches))
+					self.changed = True
+				else:
+					row, loss, labels = _read_folder(d, curves = self.store is not None)
+					self._finish(d, row, float('nan') if loss is None else len(loss), loss, labels, key)
+				n_done += 1
+			else:
+				self.active[d] = (read_config(d + 'config.txt'), LiveLoss(d + 'loss.txt', keep_rows = self.store is not None))
+
+		# * runs in progress
+		for d in list(self.active):
+			config, live = self.active[d]
+			# `DONE.txt` is checked before reading, so the rows read are all the run wrote
+			finished = os.path.isfile(d + DONE_FILE)
+			key = ingest_key(d) if finished else None
+			n = live.poll()
+			if n:
+				n_rows += n
+				self.changed = True
+			if not finished:
+				continue
+
+			del self.active[d]
+			row = dict(config)
+			row.update(self._metrics_row(live, finished = True, directory = d))
+			del row['DONE'], row['N_BATCHES']
+			labels = parse_loss_file(d + 'labels.txt') if self.store is not None else None
+			self._finish(d, row, live.n_rows, live.curve(), labels, key)
+			n_done += 1
+
+		return (n_found, n_done, n_rows)
+
+	def _metrics_row(self, live : LiveLoss, finished : bool, directory : str) -> Dict[str, Any]:
+		metrics = live.metrics()
+		row : Dict[str, Any] = dict()
+		for c, mode in LOSS_TYPES.items():
+			if mode == 'test':
+				if ENABLE_TESTING_DATA:
+					row[c] = read_percent(directory + 'percent0.txt') if finished else float('nan')
+			else:
+				row[c] = metrics[mode]
+		row['DONE'] = int(finished)
+		row['N_BATCHES'] = live.n_rows
+		return row
+
+	def table(self) -> pd.DataFrame:
+		"""finished runs and runs in progress, in directory order"""
+		rows = { d : row for d, (_, row) in self.done.items() }
+		for d, (config, live) in self.active.items():
+			rows[d] = dict(config, **self._metrics_row(live, finished = False, directory = d))
+		return pd.DataFrame([ rows[d] for d in sorted(rows) ])
+
+	def snapshot(self) -> None:
+		"""writes the table, and hands the runs finished since the last snapshot to the manifest and registry"""
+		write_table(self.table(), self.file_save)
+
+		manifest = dict(self._known)
+		manifest.update({ d : (key, { k : v for k, v in row.items() if k not in ('DONE', 'N_BATCHES') }) for d, (key, row) in self.done.items() })
+		write_ingest_manifest(self.ingest_file, manifest)
+
+		if self.registry is not None and self._new_done:
+			self.registry.record_runs(registry_row(d, self.done[d][1]) for d in self._new_done)
+		self._new_done = []
+		self.changed = False
+
+
+def follow(
+		run_ID : str = '',
+		datadir : str = '../../../psweep_data/',
+		file_save : Optional[str] = None,
+		interval : float = 5.0,
+		snapshot_interval : float = 60.0,
+		max_idle : Optional[float] = None,
+		registry : bool = True,
+		curves : bool = True,
+	) -> pd.DataFrame:
+	"""follows the runs matching `run_ID` until interrupted or idle for `max_idle` seconds, see the module docstring
+
+	### Parameters:
+	 - `run_ID : str`
+	   follows run folders matching `{run_ID}_{n}`
+	   (defaults to `''`)
+	 - `datadir : str`
+	   (defaults to `'../../../psweep_data/'`)
+	 - `file_save : Optional[str]`
+	   results table the snapshots are written to. if `None`, `'data_{run_ID}.cols'`
+	   (defaults to `None`)
+	 - `interval : float`
+	   seconds between polls
+	   (defaults to `5.0`)
+	 - `snapshot_interval : float`
+	   seconds between snapshots, if anything changed
+	   (defaults to `60.0`)
+	 - `max_idle : Optional[float]`
+	   stop once no run has made progress for this many seconds (runs that died without `DONE.txt` never finish).
+	   `None` to follow until interrupted
+	   (defaults to `None`)
+	 - `registry : bool`
+	   record finished runs in the registry of `datadir`
+	   (defaults to `True`)
+	 - `curves : bool`
+	   add the curves of finished runs to the curve store
+	   (defaults to `True`)
+
+	### Returns:
+	 - `pd.DataFrame`
+	   the table when following stopped
+	"""
+	follower = Follower(run_ID, datadir, file_save, registry, curves)
+	last_snapshot = time.monotonic()
+	last_change = time.monotonic()
+	try:
+		while True:
+			n_found, n_done, n_rows = follower.poll()
+			now = time.monotonic()
+			if n_found or n_done or n_rows:
+				last_change = now
+			if n_found or n_done:
+				print('> %s\tfound %d, finished %d\t(%d done, %d in progress)' % (
+					time.strftime('%H:%M:%S'), n_found, n_done, len(follower.done), len(follower.active),
+				))
+
+			if follower.changed and now - last_snapshot >= snapshot_interval:
+				follower.snapshot()
+				last_snapshot = now
+
+			if max_idle is not None and now - last_change >= max_idle:
+				break
+			time.sleep(interval)
+	except KeyboardInterrupt:
+		pass
+
+	if follower.changed:
+		follower.snapshot()
+	print('> %d done, %d in progress, saved to %s' % (len(follower.done), len(follower.active), follower.file_save))
+	return follower.table()
+
+
+if __name__ == '__main__':
+	import fire
+	# the returned table is for callers from python, not for printing
+	fire.Fire(follow, serialize = lambda _ : None)
@@ -3,10 +3,13 @@
 should only take a `run_ID` - passing range data thru command line not reccomended, you should modify psweep.py
 """
 
+import os
 import sys
 from typing import *
 from copy import deepcopy
 from itertools import product
+from hashlib import md5
+from multiprocessing import Pool
 
 if __name__ == '__main__':
 	sys.path.insert(0, "..")
@@ -37,6 +40,44 @@ def collapse_dict(
     return tuple(output)
 
 
+def canonical_value(val : Any, kind : type) -> t_Val:
+    """
+    casts `val` with `kind` for `config_hash`
+
+    ints go thru float, since optimizers might propose `100.0`, and files might hold `'100.0'`.
+    keys with an int default may still be swept over non-integral values (`LEARNING_RATE`
+    is read with `stof` by the trainer), so those are kept as floats instead of truncated
+    """
+    if kind is int:
+        x = float(val)
+        return int(x) if x.is_integer() else x
+    return kind(val)
+
+
+def config_hash(
+        data : Dict[str, Any],
+        default_data : cn_Dict = CONSTS_DEFAULT,
+        default_order : Sequence[t_Key] = CONSTS_DEFAULT_KEYS,
+        typemap : Dict[str, type] = TYPE_MAP,
+    ) -> str:
+    """
+    canonical hash of a config, independent of `RUN_ID`, `CONFIG_ID` and `DIRNAME`
+
+    missing keys are filled in from `default_data`, and values are cast with `typemap`,
+    so a config dict from python and one read back from a `config.txt` as strings hash the same
+    """
+
+    c = { **default_data, **data }
+
+    canonical = tuple(
+        (k, canonical_value(c[k], typemap[k]))
+        for k in default_order
+        if k not in CONSTS_DEFAULT_KEYS_META
+    )
+
+    return md5(repr(canonical).encode('utf-8')).hexdigest()
+
+
 
 
 def generate_and_add_ID(
@@ -119,6 +160,50 @@ def dict_cartesian_product(*args : List[List[Dict[t_Key,t_Val]]]):
 
 
 
+def count_combos(data : cn_Dict_R = CONSTS_RANGES) -> int:
+    """number of points in the grid spanned by `data`"""
+    n = 1
+    for k in data:
+        n *= len(data[k])
+    return n
+
+
+def iter_index_combos(
+        data : cn_Dict_R = CONSTS_RANGES,
+        default_data : cn_Dict = CONSTS_DEFAULT,
+    ) -> Iterator[Dict[t_Key, t_Val]]:
+    """
+    lazily yields every point of the grid spanned by `data`, merged with `default_data` and given a `CONFIG_ID`
+
+    only one combo is held in memory at a time. the order (and so the IDs) matches
+    `dict_cartesian_product`: the first key of `data` varies fastest
+    """
+    keys = list(data)
+    values = [ list(data[k]) for k in keys ]
+
+    # `product` varies its last argument fastest, so feed it the keys in reverse
+    for i, vals in enumerate(product(*reversed(values))):
+        c = { **default_data, **dict(zip(reversed(keys), vals)) }
+        generate_and_add_ID(c, i)
+        yield c
+
+
+def combo_at(
+        data : cn_Dict_R,
+        i : int,
+        default_data : cn_Dict = CONSTS_DEFAULT,
+    ) -> Dict[t_Key, t_Val]:
+    """the `i`-th combo of `iter_index_combos`, without generating the ones before it"""
+    c = dict(default_data)
+    rem = i
+    for k in data:
+        vals = data[k]
+        rem, digit = divmod(rem, len(vals))
+        c[k] = vals[digit]
+    generate_and_add_ID(c, i)
+    return c
+
+
 def generate_all_index_combos(
         data : cn_Dict_R = CONSTS_RANGES,
         default_data : cn_Dict = CONSTS_DEFAULT,
@@ -127,64 +212,54 @@ def generate_all_index_combos(
     """
     generates a list of dicts,
     each dict representing a unique set of constants
-    
-    REVIEW : this whole function is probably not implemented in the cleanest or most efficient way
+
+    holds the whole grid in memory -- use `iter_index_combos` or `save_combos_parallel` for large grids
     """
 
     print('generating configs:')
+    combos = list(iter_index_combos(data, default_data))
+    print('  > done!')
 
+    return combos
 
-    print('  > splitting arrays')
-    # first, split the ranges dict by key
-    # then split each possible value in the range into a separate dict
-    data_split = [
-        [
-            { k : v }
-            for v in data[k]
-        ]
-        for k in data
-    ]
-
-    print('  > product')
-    # generate all combos of values
-    combos = dict_cartesian_product(*data_split)
-
-    
-    print('  > merge with default, get ID')
-    combos_updated = []
-
-    i = 0
-    for c in combos:
-        # update with data from default dict
-        c = {**default_data, **c}
-
-        # give each one a unique ID
-        generate_and_add_ID(c, i)
-        
-        combos_updated.append(c)
-        i += 1
-
-    print('  > done!')
 
-    return combos_updated
+def config_filename(
+        c : Dict[t_Key, t_Val],
+        run_ID : str,
+        directory : str,
+    ) -> str:
+    """sets `RUN_ID` and `DIRNAME` of the combo, returns the path of its config file"""
+    c['RUN_ID'] = run_ID
+    fname = '%s_ID%s' % (c['RUN_ID'], c['CONFIG_ID'])
+    c['DIRNAME'] = fname
+    return directory + fname + '.txt'
 
 
 def save_all_combos(
         run_ID : str,
-        combos : List[Dict[t_Key, Union[None, t_Val]]],
+        combos : Iterable[Dict[t_Key, Union[None, t_Val]]],
         default_data : cn_Dict = CONSTS_DEFAULT,
         default_order : Sequence[t_Key] = CONSTS_DEFAULT_KEYS,
         directory : str = 'config/'
-    ):
+    ) -> int:
+    """writes one config file per combo. `combos` can be a generator. returns the number written"""
 
     print('saving configs:')
-    print(len(combos))
+    n = write_combos(run_ID, combos, default_data, default_order, directory)
+    print(n)
+    return n
+
+
+def write_combos(
+        run_ID : str,
+        combos : Iterable[Dict[t_Key, Union[None, t_Val]]],
+        default_data : cn_Dict = CONSTS_DEFAULT,
+        default_order : Sequence[t_Key] = CONSTS_DEFAULT_KEYS,
+        directory : str = 'config/'
+    ) -> int:
+    n = 0
     for c in combos:
-        # create filename
-        c['RUN_ID'] = run_ID
-        fname = '%s_ID%s' % (c['RUN_ID'], c['CONFIG_ID'])
-        c['DIRNAME'] = fname
-        fname = directory + fname + '.txt'
+        fname = config_filename(c, run_ID, directory)
 
         # print('\t' + fname)
         
@@ -194,24 +269,173 @@ def save_all_combos(
                 dict_to_string(c, default_data, default_order),
                 file = fout,
             )
+        n += 1
 
+    return n
 
 
+def grid_row_width(
+        run_ID : str,
+        data : cn_Dict_R,
+        default_data : cn_Dict = CONSTS_DEFAULT,
+        default_order : Sequence[t_Key] = CONSTS_DEFAULT_KEYS,
+    ) -> int:
+    """manifest row width that fits every point of the grid spanned by `data`"""
+    n_digits = len(str(max(count_combos(data) - 1, 0)))
+    widths = {
+        k : max(len(str(v)) for v in data[k]) if k in data else len(str(default_data[k]))
+        for k in default_order
+    }
+    widths['RUN_ID'] = len(run_ID)
+    widths['CONFIG_ID'] = n_digits
+    widths['DIRNAME'] = len('%s_ID' % run_ID) + n_digits
+    # values, tabs between them, and the newline
+    return sum(widths.values()) + len(default_order)
 
 
+def _save_shard(args : Tuple[str, cn_Dict_R, cn_Dict, Sequence[t_Key], str, bool, Optional[Tuple[str, int, int]], int, int]) -> int:
+    """worker for `save_combos_parallel`: writes combos `start` to `stop`"""
+    from psweep.manifest import write_rows
 
-def main(run_ID : str, data : Dict[t_Key, Iterable[t_Val]] = CONSTS_RANGES):
-    combos = generate_all_index_combos(
-        data = data,
-        default_data = CONSTS_DEFAULT,
-        default_order = CONSTS_DEFAULT_KEYS,
-    )
+    run_ID, data, default_data, default_order, directory, txt, manifest, start, stop = args
+    n = 0
 
-    save_all_combos(
+    def combos() -> Iterator[Dict[t_Key, t_Val]]:
+        for i in range(start, stop):
+            c = combo_at(data, i, default_data)
+            config_filename(c, run_ID, directory)
+            yield c
+
+    if manifest is not None:
+        filename, width, header_len = manifest
+        n = write_rows(filename, combos(), default_order, width, header_len, start)
+
+    if txt:
+        n = write_combos(run_ID, combos(), default_data, default_order, directory)
+
+    return n
+
+
+def save_combos_parallel(
+        run_ID : str,
+        data : cn_Dict_R = CONSTS_RANGES,
+        default_data : cn_Dict = CONSTS_DEFAULT,
+        default_order : Sequence[t_Key] = CONSTS_DEFAULT_KEYS,
+        directory : str = 'config/',
+        n_procs : Optional[int] = None,
+        shard_size : int = 10000,
+        manifest : bool = True,
+        txt : bool = False,
+        registry : Optional['Registry'] = None,
+    ) -> int:
+    """
+    writes every point of the grid spanned by `data` to the run's manifest (and/or config text files), in parallel
+
+    the grid is split into shards of `shard_size` consecutive IDs, and every process
+    computes its combos straight from their IDs (see `combo_at`), so memory stays flat
+    no matter how large the grid is. IDs are the same as `generate_all_index_combos`
+
+    ### Parameters:
+     - `run_ID : str`
+     - `data : cn_Dict_R`
+       ranges to sweep
+       (defaults to `CONSTS_RANGES`)
+     - `directory : str`
+       (defaults to `'config/'`)
+     - `n_procs : Optional[int]`
+       number of writer processes. if `None`, one per core
+       (defaults to `None`)
+     - `shard_size : int`
+       (defaults to `10000`)
+     - `manifest : bool`
+       write `{directory}{run_ID}.manifest`, see `psweep/manifest.py`
+       (defaults to `True`)
+     - `txt : bool`
+       also write one `{directory}{run_ID}_ID{n}.txt` per config, the same files as `save_all_combos`
+       (defaults to `False`)
+     - `registry : Optional[Registry]`
+       if given, every config is registered in it as `'created'`, see `psweep/registry.py`
+       (defaults to `None`)
+
+    ### Returns:
+     - `int`
+       number of configs written
+    """
+    from psweep.manifest import manifest_path, create_manifest
+
+    n = count_combos(data)
+    n_procs = n_procs or os.cpu_count() or 1
+    print('saving %d configs to %s, %d processes' % (n, directory, n_procs))
+
+    manifest_info = None
+    if manifest:
+        filename = manifest_path(run_ID, directory)
+        width = grid_row_width(run_ID, data, default_data, default_order)
+        manifest_info = (filename, width, create_manifest(filename, default_order, width, n))
+
+    shards = [
+        (run_ID, data, default_data, default_order, directory, txt, manifest_info, start, min(start + shard_size, n))
+        for start in range(0, n, shard_size)
+    ]
+
+    n_written = 0
+    with Pool(n_procs) as pool:
+        for k in pool.imap_unordered(_save_shard, shards):
+            n_written += k
+            print('  > %d / %d' % (n_written, n), end = '\r')
+    print()
+
+    if registry is not None:
+        print('  > registered %d new configs' % registry.add_configs(run_ID, iter_index_combos(data, default_data), default_data))
+
+    return n_written
+
+
+def main(
+        run_ID : str, 
+        data : Dict[t_Key, Iterable[t_Val]] = CONSTS_RANGES,
+        n_procs : Optional[int] = None,
+        shard_size : int = 10000,
+        txt : bool = False,
+        sample : Optional[str] = None,
+        n_samples : int = 1000,
+        seed : Optional[int] = 0,
+        registry : bool = True,
+        datadir : str = '../../../psweep_data/',
+    ):
+    """
+    writes the grid spanned by `data`, or with `sample` (one of `'sobol'`, `'halton'`, `'lhs'`),
+    `n_samples` space-filling samples of its ranges -- run again to add more, see `psweep/sampling.py`.
+    with `registry`, the configs are also registered in the registry of `datadir`
+    """
+    reg = None
+    if registry:
+        from psweep.registry import Registry
+        reg = Registry(datadir)
+
+    if sample is not None:
+        from psweep.sampling import save_samples
+
+        save_samples(
+            run_ID = run_ID,
+            n = n_samples,
+            method = sample,
+            ranges = { k : list(v) for k, v in data.items() },
+            seed = seed,
+            txt = txt,
+            registry = reg,
+        )
+        return
+
+    save_combos_parallel(
         run_ID = run_ID,
-        combos = combos,
+        data = { k : list(v) for k, v in data.items() },
         default_data = CONSTS_DEFAULT,
         default_order = CONSTS_DEFAULT_KEYS,
+        n_procs = n_procs,
+        shard_size = shard_size,
+        txt = txt,
+        registry = reg,
     )
 
 
@@ -0,0 +1,100 @@
+"""asynchronous successive halving (ASHA) on the loss that running jobs stream to `loss.txt`
+
+the trainer appends one comma-terminated row per mini-batch to `loss.txt`.
+a run has `MAX_EPOCHS * NUM_SNIFFS` rows in total. rungs are given as fractions
+of that, for example `[0.1, 0.3]`. when a run reaches a rung, the average loss
+over its last few rows is compared against every other run that reached the
+same rung: if it is not within the best `1 / eta` of them, the run is stopped
+and its slot goes to a new candidate.
+"""
+
+import math
+from typing import *
+
+import numpy as np
+
+
+class LossTail(object):
+	"""incrementally reads the rows of a `loss.txt` that is still being written
+
+	only complete (newline-terminated) rows are consumed, so a row that is
+	half-written when polled is picked up in full on the next poll
+	"""
+
+	def __init__(self, filename : str):
+		self.filename = filename
+		self._offset : int = 0
+		# mean loss of each row read so far
+		self.row_means : List[float] = []
+
+	def poll(self) -> int:
+		"""reads any new rows, returns the total number of rows read so far"""
+		try:
+			with open(self.filename, 'rb') as fin:
+				fin.seek(self._offset)
+				chunk = fin.read()
+		except OSError:
+			return len(self.row_means)
+
+		end = chunk.rfind(b'\n')
+		if end < 0:
+			return len(self.row_means)
+		self._offset += end + 1
+
+		for line in chunk[:end].split(b'\n'):
+			vals = [ float(x) for x in line.split(b',') if x.strip() ]
+			self.row_means.append(float(np.mean(vals)) if vals else float('nan'))
+
+		return len(self.row_means)
+
+	def recent_loss(self, window : int = 5) -> float:
+		"""average of the last `window` row means"""
+		if not self.row_means:
+			return float('nan')
+		return float(np.mean(self.row_means[-window:]))
+
+
+def total_rows(config : Dict[str, Any]) -> int:
+	"""number of rows the trainer writes to `loss.txt` for a full run of `config`"""
+	return int(config['MAX_EPOCHS']) * int(config['NUM_SNIFFS'])
+
+
+def rung_rows(config : Dict[str, Any], rungs : Sequence[float]) -> List[int]:
+	"""row counts at which the rungs (fractions of a full run) are reached"""
+	n = total_rows(config)
+	return [ max(1, int(math.ceil(r * n))) for r in sorted(rungs) if r < 1.0 ]
+
+
+class RungTracker(object):
+	"""keeps the losses recorded at each rung, and decides which runs to stop
+
+	### Parameters:
+	 - `n_rungs : int`
+	 - `eta : float`
+	   only the best `1 / eta` of runs at a rung continue
+	   (defaults to `3.0`)
+	 - `min_peers : Optional[int]`
+	   runs are never stopped at a rung until this many runs have reached it.
+	   if `None`, set to `ceil(eta)`
+	   (defaults to `None`)
+	"""
+
+	def __init__(self, n_rungs : int, eta : float = 3.0, min_peers : Optional[int] = None):
+		self.eta = eta
+		self.min_peers = int(math.ceil(eta)) if min_peers is None else min_peers
+		self.recorded : List[List[float]] = [ [] for _ in range(n_rungs) ]
+
+	def report(self, rung : int, loss : float) -> bool:
+		"""records `loss` at `rung`, returns whether the run should continue
+
+		diverged runs (NaN loss) are always stopped
+		"""
+		if math.isnan(loss):
+			return False
+
+		self.recorded[rung].append(loss)
+		if len(self.recorded[rung]) < self.min_peers:
+			return True
+
+		cutoff = np.percentile(self.recorded[rung], 100.0 / self.eta)
+		return loss <= cutoff
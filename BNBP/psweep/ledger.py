@@ -0,0 +1,106 @@
+"""append-only ledger of a running sweep, for resuming after the driver process dies
+
+every line is a json object with an `event` field:
+ - `ask` : a candidate was handed to an evaluation. `uid`, `params`
+ - `job` : a config was submitted to slurm. `cfg_ID`, `job_id`
+ - `tell` : the result of a candidate was told to the optimizer. `uid`, `loss`
+ - `checkpoint` : the optimizer state was saved. `told`, the number of `tell` lines before
+   it, which are part of the saved state
+
+the dump is moved into place before its `checkpoint` line is written, so a crash in
+between leaves a dump that knows more results than the last `checkpoint` line says.
+the dump carries its own count for this (see `sweep_nevergrad.save_checkpoint`).
+
+on resume, `replay()` gives the candidates that were asked but never told (in flight
+when the process died), and the results told after the checkpoint (which the
+saved optimizer state does not know about yet).
+"""
+
+import os
+import json
+from typing import *
+
+
+class SweepLedger(object):
+	"""reads and appends to the ledger file at `filename`"""
+
+	def __init__(self, filename : str):
+		self.filename = filename
+		# number of `tell` lines in the ledger
+		self.n_told : int = sum(entry['event'] == 'tell' for entry in self._entries())
+
+	def _entries(self) -> Iterator[Dict[str, Any]]:
+		if not os.path.isfile(self.filename):
+			return
+		with open(self.filename, 'r') as fin:
+			for line in fin:
+				try:
+					yield json.loads(line)
+				except ValueError:
+					# the last line might be cut off if we died while writing it
+					continue
+
+	def _append(self, **entry) -> None:
+		with open(self.filename, 'a') as fout:
+			print(json.dumps(entry), file = fout)
+			fout.flush()
+			os.fsync(fout.fileno())
+
+	def asked(self, uid : str, params : Dict[str, Any]) -> None:
+		self._append(event = 'ask', uid = uid, params = params)
+
+	def submitted(self, job_ids : Dict[str, str]) -> None:
+		for cfg_ID, job_id in job_ids.items():
+			self._append(event = 'job', cfg_ID = cfg_ID, job_id = job_id)
+
+	def told(self, uid : str, loss : float) -> None:
+		self._append(event = 'tell', uid = uid, loss = loss)
+		self.n_told += 1
+
+	def checkpointed(self, n_told : int) -> None:
+		"""marks a checkpoint holding the first `n_told` results"""
+		self._append(event = 'checkpoint', told = n_told)
+
+	def replay(self, n_known : Optional[int] = None) -> Tuple[Dict[str, Dict[str, Any]], List[Tuple[Dict[str, Any], float]], Dict[str, str], int]:
+		"""reads the whole ledger
+
+		### Parameters:
+		 - `n_known : Optional[int]`
+		   number of results the optimizer being resumed already knows, as saved with its dump.
+		   if `None`, the count of the last checkpoint line
+		   (defaults to `None`)
+
+		### Returns:
+		 - `Dict[str, Dict[str, Any]]`
+		   params of every candidate asked but never told, by uid
+		 - `List[Tuple[Dict[str, Any], float]]`
+		   `(params, loss)` of every result the optimizer does not know yet
+		 - `Dict[str, str]`
+		   slurm job id of every submitted config, by config ID
+		 - `int`
+		   number of candidates asked in total, counted against the budget
+		"""
+		asked : Dict[str, Dict[str, Any]] = dict()
+		pending : Dict[str, Dict[str, Any]] = dict()
+		# `(params, loss)` of every result, `None` if it was not asked in this ledger
+		told : List[Optional[Tuple[Dict[str, Any], float]]] = []
+		n_checkpoint = 0
+		job_ids : Dict[str, str] = dict()
+
+		for entry in self._entries():
+			if entry['event'] == 'ask':
+				asked[entry['uid']] = entry['params']
+				pending[entry['uid']] = entry['params']
+			elif entry['event'] == 'tell':
+				pending.pop(entry['uid'], None)
+				told.append((asked[entry['uid']], entry['loss']) if entry['uid'] in asked else None)
+			elif entry['event'] == 'job':
+				job_ids[entry['cfg_ID']] = entry['job_id']
+			elif entry['event'] == 'checkpoint':
+				# ledgers from before the count was written: everything told so far
+				n_checkpoint = entry.get('told', len(told))
+
+		if n_known is None:
+			n_known = n_checkpoint
+		told_since = [ x for x in told[n_known:] if x is not None ]
+		return (pending, told_since, job_ids, len(asked))
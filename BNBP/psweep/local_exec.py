@@ -0,0 +1,169 @@
+"""runs `hh_psweep` on the local machine, without slurm
+
+every run is pinned to its own disjoint set of cores and gets a matching
+number of openMP threads. at most `len(cores) // threads_per_job` runs are
+active at once, the rest wait in a queue.
+"""
+
+import os
+import queue
+import subprocess
+from concurrent import futures
+from typing import *
+
+from psweep.watcher import CompletionWatcher
+
+
+def core_slots(cores : Optional[Sequence[int]], threads_per_job : int) -> List[Tuple[int, ...]]:
+	"""splits `cores` (every core this process may run on, if `None`) into disjoint slots of `threads_per_job` cores"""
+	if cores is None:
+		cores = sorted(os.sched_getaffinity(0))
+
+	if threads_per_job > len(cores):
+		raise ValueError(
+			'threads_per_job (%d) is larger than the number of cores available (%d)'
+			% (threads_per_job, len(cores))
+		)
+
+	return [
+		tuple(cores[i * threads_per_job : (i + 1) * threads_per_job])
+		for i in range(len(cores) // threads_per_job)
+	]
+
+
+def omp_env(cores : Sequence[int]) -> Dict[str, str]:
+	"""environment for a trainer pinned to `cores`, with one openMP thread per core"""
+	env = dict(os.environ)
+	env['OMP_NUM_THREADS'] = str(len(cores))
+	env['OMP_PLACES'] = '{' + ','.join(str(c) for c in cores) + '}'
+	env['OMP_PROC_BIND'] = 'close'
+	return env
+
+
+class LocalExecutor(object):
+	"""launches `hh_psweep` subprocesses, each pinned to a disjoint core set
+
+	### Parameters:
+	 - `threads_per_job : int`
+	   openMP threads (and cores) given to every run
+	   (defaults to `1`)
+	 - `cores : Optional[Sequence[int]]`
+	   cores to use. if `None`, uses every core this process may run on
+	   (defaults to `None`)
+	 - `executable : str`
+	   path to the trainer
+	   (defaults to `'./hh_psweep'`)
+	 - `data_dir : str`
+	   where the trainer puts the run directories
+	   (defaults to `'../../psweep_data/'`)
+	 - `log_dir : Optional[str]`
+	   stdout/stderr of each run goes to `{log_dir}local-{run_ID}_ID{cfg_ID}.out`.
+	   if `None`, output is discarded
+	   (defaults to `'./'`)
+	 - `watcher : Optional[CompletionWatcher]`
+	   if given, runs that exit without writing `DONE.txt` are marked as failed on it,
+	   so that whoever is waiting on them wakes up right away
+	   (defaults to `None`)
+	"""
+
+	def __init__(
+			self,
+			threads_per_job : int = 1,
+			cores : Optional[Sequence[int]] = None,
+			executable : str = './hh_psweep',
+			data_dir : str = '../../psweep_data/',
+			log_dir : Optional[str] = './',
+			watcher : Optional[CompletionWatcher] = None,
+		):
+		slots = core_slots(cores, threads_per_job)
+
+		self.threads_per_job = threads_per_job
+		self.executable = executable
+		self.data_dir = data_dir
+		self.log_dir = log_dir
+		self.watcher = watcher
+
+		# split the cores into disjoint slots, one slot per concurrent run
+		self.n_slots = len(slots)
+		self._slots : 'queue.Queue[Tuple[int, ...]]' = queue.Queue()
+		for slot in slots:
+			self._slots.put(slot)
+
+		# one thread per slot, not per submitted run
+		self._pool = futures.ThreadPoolExecutor(
+			max_workers = self.n_slots,
+			thread_name_prefix = 'LocalExecutor',
+		)
+
+		# `{run_ID}_ID{cfg_ID}` -> exit code of the trainer
+		self.exit_codes : Dict[str, int] = dict()
+		# `{run_ID}_ID{cfg_ID}` -> running process
+		self.running : Dict[str, subprocess.Popen] = dict()
+		# runs cancelled before they got a slot
+		self._cancelled : Set[str] = set()
+
+	def submit(self, cfg_ID : str, run_ID : str) -> 'futures.Future[int]':
+		"""queues a run, returns a future for its exit code"""
+		return self._pool.submit(self._run, str(cfg_ID), run_ID)
+
+	def cancel(self, cfg_ID : str, run_ID : str) -> None:
+		"""stops a run: terminates it if it is running, otherwise it is skipped once it gets a slot"""
+		name = '%s_ID%s' % (run_ID, cfg_ID)
+		self._cancelled.add(name)
+		proc = self.running.get(name, None)
+		if proc is not None:
+			proc.terminate()
+
+	def shutdown(self, wait : bool = True) -> None:
+		self._pool.shutdown(wait = wait)
+
+	def _run(self, cfg_ID : str, run_ID : str) -> int:
+		name = '%s_ID%s' % (run_ID, cfg_ID)
+		if name in self._cancelled:
+			return -1
+
+		cores = self._slots.get()
+		if name in self._cancelled:
+			self._slots.put(cores)
+			return -1
+
+		try:
+			env = omp_env(cores)
+
+			cmd = [ self.executable, str(self.threads_per_job), cfg_ID, run_ID ]
+			print('CALLING:\t%s\t(cores %s)' % (' '.join(cmd), ','.join(str(c) for c in cores)))
+
+			fout = subprocess.DEVNULL
+			try:
+				if self.log_dir is not None:
+					fout = open(os.path.join(self.log_dir, 'local-%s.out' % name), 'w')
+				proc = subprocess.Popen(cmd, stdout = fout, stderr = subprocess.STDOUT, env = env)
+				# the trainer only starts its openMP threads after reading the config,
+				# so pinning right after launch covers all of them
+				try:
+					os.sched_setaffinity(proc.pid, cores)
+				except ProcessLookupError:
+					pass
+				self.running[name] = proc
+				code = proc.wait()
+			except OSError as e:
+				# such as a missing trainer. nobody looks at the future, so the watcher has to know
+				print('> could not launch %s:\t%r' % (name, e))
+				code = -1
+			finally:
+				self.running.pop(name, None)
+				if fout is not subprocess.DEVNULL:
+					fout.close()
+		finally:
+			self._slots.put(cores)
+
+		self.exit_codes[name] = code
+		if code != 0:
+			print('> run failed:\t%s\texit code %d' % (name, code))
+
+		if self.watcher is not None:
+			dirname = os.path.join(self.data_dir, name)
+			if not os.path.isfile(os.path.join(dirname, 'DONE.txt')):
+				self.watcher.mark(dirname, False)
+
+		return code
@@ -0,0 +1,354 @@
+"""one packed manifest per run ID, instead of one `psweep/config/{RUN_ID}_ID{n}.txt` per config
+
+`{cfg_dir}{RUN_ID}.manifest` is a text file with fixed-width rows, so any row can
+be read with a single seek. all fields are tab-separated:
+ - line 1: `#manifest`, the format version, and the row width in bytes
+ - line 2: the keys
+ - then one row per config: its values, padded with spaces to the row width
+
+every row is exactly `<row width>` bytes, newline included, so row `i` starts at
+`len(header) + i * width`. values are written with `str()`, just like the text files.
+grid sweeps give row `i` the `CONFIG_ID` `i`. the nevergrad sweep appends rows with
+hashed `CONFIG_ID`s, those are found through the index next to the manifest.
+
+## index
+`append_row` keeps `{cfg_dir}{RUN_ID}.manifest.idx`, an open addressing hash table
+from `CONFIG_ID` to row number, so that finding a row takes a few seeks instead of a scan:
+ - a header of 24 bytes: `INDEX_MAGIC`, the number of slots, and the number of rows indexed
+ - then the slots, each a little-endian `int64`: the row number plus one, `0` if empty
+
+a `CONFIG_ID` goes to slot `id_hash(cfg_ID) % n_slots`, or the next free one after it.
+the table is rebuilt with twice the slots when it gets half full. rows past the number
+indexed (such as a row appended by a process that died before indexing it) are scanned.
+
+## locking
+`append_row` and `sampling.save_samples` read the rows already there before adding theirs,
+so they hold `manifest_lock`: an exclusive `flock` on `{cfg_dir}{RUN_ID}.manifest.lock`,
+which serializes them across driver processes (and threads). the lock is on a file of its
+own, so that readers never see a manifest that is being created.
+
+the trainer reads the manifest through `ManifestReader` in `configer.h`, and falls
+back to the text file if there is no manifest or the config is not in it.
+"""
+
+import os
+import glob
+import struct
+import threading
+from contextlib import contextmanager
+from typing import *
+
+try:
+	import fcntl
+except ImportError:
+	# not on windows, appends are then only serialized within one process
+	fcntl = None
+
+from psweep.result_cache import read_config_strings
+
+
+MANIFEST_VERSION : int = 1
+MANIFEST_EXT : str = '.manifest'
+# row width per key for manifests that grow by appending, where the values are not known up front.
+# `str()` of a float is at most 24 characters
+APPEND_FIELD_WIDTH : int = 32
+
+INDEX_EXT : str = '.idx'
+INDEX_MAGIC : bytes = b'#mfidx1\n'
+_INDEX_HEADER = struct.Struct('<8sqq')
+_SLOT = struct.Struct('<q')
+MIN_INDEX_SLOTS : int = 1024
+
+LOCK_EXT : str = '.lock'
+
+# serializes appends from the threads of one process, see `manifest_lock`
+_APPEND_LOCK = threading.Lock()
+
+
+def manifest_path(run_ID : str, cfg_dir : str = 'psweep/config/') -> str:
+	return cfg_dir + run_ID + MANIFEST_EXT
+
+
+def index_path(filename : str) -> str:
+	return filename + INDEX_EXT
+
+
+@contextmanager
+def manifest_lock(filename : str) -> Iterator[None]:
+	"""holds the lock of the manifest `filename` for a read-then-append, see the module docstring"""
+	with _APPEND_LOCK:
+		if fcntl is None:
+			yield
+			return
+		fd = os.open(filename + LOCK_EXT, os.O_RDWR | os.O_CREAT, 0o644)
+		try:
+			fcntl.flock(fd, fcntl.LOCK_EX)
+			yield
+		finally:
+			# closing releases the lock
+			os.close(fd)
+
+
+def id_hash(cfg_ID : str) -> int:
+	"""64 bit FNV-1a of `cfg_ID`, the same as in `configer.h`"""
+	h = 0xcbf29ce484222325
+	for b in cfg_ID.encode('utf-8'):
+		h = ((h ^ b) * 0x100000001b3) & 0xffffffffffffffff
+	return h
+
+
+def write_index(filename : str, cfg_IDs : Sequence[str]) -> None:
+	"""(re)builds the index of the manifest `filename` from the `CONFIG_ID`s of its rows, in row order"""
+	n_slots = MIN_INDEX_SLOTS
+	while 2 * (len(cfg_IDs) + 1) > n_slots:
+		n_slots *= 2
+
+	slots = [ 0 ] * n_slots
+	for row, cfg_ID in enumerate(cfg_IDs):
+		i = id_hash(cfg_ID) % n_slots
+		while slots[i]:
+			i = (i + 1) % n_slots
+		slots[i] = row + 1
+
+	# readers may have the old index open, so it is replaced instead of rewritten
+	tmp = index_path(filename) + '.tmp'
+	with open(tmp, 'wb') as fout:
+		fout.write(_INDEX_HEADER.pack(INDEX_MAGIC, n_slots, len(cfg_IDs)))
+		fout.write(struct.pack('<%dq' % n_slots, *slots))
+	os.replace(tmp, index_path(filename))
+
+
+def update_index(manifest : 'Manifest') -> None:
+	"""adds the rows of `manifest` that are not in its index yet, building the index if there is none"""
+	n_rows = len(manifest)
+	try:
+		fd = os.open(index_path(manifest.filename), os.O_RDWR)
+	except FileNotFoundError:
+		write_index(manifest.filename, manifest.config_ids())
+		return
+
+	try:
+		magic, n_slots, n_indexed = _INDEX_HEADER.unpack(os.pread(fd, _INDEX_HEADER.size, 0))
+		if magic != INDEX_MAGIC or 2 * (n_rows + 1) > n_slots:
+			write_index(manifest.filename, manifest.config_ids())
+			return
+
+		for row in range(n_indexed, n_rows):
+			i = id_hash(manifest.row(row)['CONFIG_ID']) % n_slots
+			while _SLOT.unpack(os.pread(fd, _SLOT.size, _INDEX_HEADER.size + i * _SLOT.size))[0]:
+				i = (i + 1) % n_slots
+			os.pwrite(fd, _SLOT.pack(row + 1), _INDEX_HEADER.size + i * _SLOT.size)
+		os.pwrite(fd, _INDEX_HEADER.pack(INDEX_MAGIC, n_slots, n_rows), 0)
+	finally:
+		os.close(fd)
+
+
+def format_header(keys : Sequence[str], width : int) -> bytes:
+	return ('#manifest\t%d\t%d\n%s\n' % (MANIFEST_VERSION, width, '\t'.join(keys))).encode('utf-8')
+
+
+def format_row(row : Dict[str, Any], keys : Sequence[str], width : int) -> bytes:
+	"""one padded row. raises `ValueError` if it does not fit in `width`"""
+	line = '\t'.join(str(row[k]) for k in keys)
+	if len(line) + 1 > width:
+		raise ValueError('manifest row is %d bytes, but the row width is %d:\n%s' % (len(line) + 1, width, line))
+	return (line.ljust(width - 1) + '\n').encode('utf-8')
+
+
+def create_manifest(
+		filename : str,
+		keys : Sequence[str],
+		width : int,
+		n_rows : int = 0,
+	) -> int:
+	"""writes the header, and makes room for `n_rows` rows to be filled in with `write_rows`
+
+	returns the length of the header, where row 0 starts
+	"""
+	header = format_header(keys, width)
+	with open(filename, 'wb') as fout:
+		fout.write(header)
+		fout.truncate(len(header) + n_rows * width)
+	return len(header)
+
+
+def write_rows(
+		filename : str,
+		rows : Iterable[Dict[str, Any]],
+		keys : Sequence[str],
+		width : int,
+		header_len : int,
+		start : int,
+	) -> int:
+	"""writes consecutive rows starting at row `start` of a manifest from `create_manifest`
+
+	several processes can fill disjoint ranges of the same manifest at once. returns the number of rows written
+	"""
+	buf = b''.join(format_row(r, keys, width) for r in rows)
+	fd = os.open(filename, os.O_WRONLY)
+	try:
+		os.pwrite(fd, buf, header_len + start * width)
+	finally:
+		os.close(fd)
+	return len(buf) // width
+
+
+def append_row(
+		filename : str,
+		row : Dict[str, Any],
+		keys : Sequence[str],
+		width : Optional[int] = None,
+	) -> None:
+	"""appends a row, creating the manifest if needed. rows whose `CONFIG_ID` is already there are skipped
+
+	a new manifest gets rows of `width` bytes, or `APPEND_FIELD_WIDTH` per key if `None`.
+	keeps the index up to date, see the module docstring
+	"""
+	if width is None:
+		width = len(keys) * APPEND_FIELD_WIDTH
+
+	with manifest_lock(filename):
+		if not os.path.isfile(filename):
+			create_manifest(filename, keys, width)
+		else:
+			manifest = Manifest(filename)
+			if manifest.find(str(row['CONFIG_ID'])) is not None:
+				return
+			# keep the row layout of the existing file
+			keys, width = manifest.keys, manifest.width
+
+		data = format_row(row, keys, width)
+		fd = os.open(filename, os.O_WRONLY | os.O_APPEND)
+		try:
+			os.write(fd, data)
+		finally:
+			os.close(fd)
+		# the row goes first, so that an indexed row is always there
+		update_index(Manifest(filename))
+
+
+class Manifest(object):
+	"""random access to the rows of a manifest, see the module docstring
+
+	values are returned as strings, like `read_config_strings`
+	"""
+
+	def __init__(self, filename : str):
+		self.filename = filename
+		with open(filename, 'rb') as fin:
+			first = fin.readline().decode('utf-8').rstrip('\n').split('\t')
+			if first[0] != '#manifest' or int(first[1]) != MANIFEST_VERSION:
+				raise ValueError('not a version %d manifest: %s' % (MANIFEST_VERSION, filename))
+			self.width = int(first[2])
+			self.keys = fin.readline().decode('utf-8').rstrip('\n').split('\t')
+			self.header_len = fin.tell()
+
+	def __len__(self) -> int:
+		return (os.path.getsize(self.filename) - self.header_len) // self.width
+
+	def _parse(self, raw : bytes) -> List[str]:
+		return raw.decode('utf-8').rstrip(' \n').split('\t')
+
+	def row(self, i : int) -> Dict[str, str]:
+		"""row `i`, with a single read"""
+		if not (0 <= i < len(self)):
+			raise IndexError('row %d of a manifest with %d rows' % (i, len(self)))
+		with open(self.filename, 'rb') as fin:
+			fin.seek(self.header_len + i * self.width)
+			return dict(zip(self.keys, self._parse(fin.read(self.width))))
+
+	def iter_rows(self, chunk_rows : int = 4096, start : int = 0) -> Iterator[Dict[str, str]]:
+		"""every row from row `start` on"""
+		with open(self.filename, 'rb') as fin:
+			fin.seek(self.header_len + start * self.width)
+			while True:
+				chunk = fin.read(chunk_rows * self.width)
+				for k in range(len(chunk) // self.width):
+					yield dict(zip(self.keys, self._parse(chunk[k * self.width : (k + 1) * self.width])))
+				if len(chunk) < chunk_rows * self.width:
+					break
+
+	def config_ids(self) -> List[str]:
+		return [ r['CONFIG_ID'] for r in self.iter_rows() ]
+
+	def _lookup_index(self, cfg_ID : str, n_rows : int) -> Tuple[Optional[int], int]:
+		"""the row of `cfg_ID` from the index, and the number of rows the index covers (`0` if there is none)"""
+		try:
+			fin = open(index_path(self.filename), 'rb')
+		except FileNotFoundError:
+			return (None, 0)
+
+		with fin:
+			magic, n_slots, n_indexed = _INDEX_HEADER.unpack(fin.read(_INDEX_HEADER.size))
+			if magic != INDEX_MAGIC:
+				return (None, 0)
+
+			i = id_hash(cfg_ID) % n_slots
+			for _ in range(n_slots):
+				fin.seek(_INDEX_HEADER.size + i * _SLOT.size)
+				row = _SLOT.unpack(fin.read(_SLOT.size))[0] - 1
+				if row < 0:
+					break
+				if row < n_rows and self.row(row)['CONFIG_ID'] == cfg_ID:
+					return (row, n_indexed)
+				i = (i + 1) % n_slots
+
+		return (None, min(n_indexed, n_rows))
+
+	def find(self, cfg_ID : str) -> Optional[int]:
+		"""row index of `cfg_ID`: tries row `int(cfg_ID)` first (grid sweeps), then the index, then scans the rows it does not cover"""
+		cfg_ID = str(cfg_ID)
+		n_rows = len(self)
+		if cfg_ID.isdigit() and int(cfg_ID) < n_rows:
+			if self.row(int(cfg_ID))['CONFIG_ID'] == cfg_ID:
+				return int(cfg_ID)
+
+		row, start = self._lookup_index(cfg_ID, n_rows)
+		if row is not None:
+			return row
+
+		for i, r in enumerate(self.iter_rows(start = start), start):
+			if r['CONFIG_ID'] == cfg_ID:
+				return i
+		return None
+
+	def config(self, cfg_ID : str) -> Optional[Dict[str, str]]:
+		"""the row of `cfg_ID`, same lookup as `find`"""
+		i = self.find(cfg_ID)
+		return None if i is None else self.row(i)
+
+
+class ConfigStore(object):
+	"""the configs of one run ID: from its manifest if there is one, otherwise from the text files
+
+	### Parameters:
+	 - `run_ID : str`
+	 - `cfg_dir : str`
+	   (defaults to `'psweep/config/'`)
+	"""
+
+	def __init__(self, run_ID : str, cfg_dir : str = 'psweep/config/'):
+		self.run_ID = run_ID
+		self.cfg_dir = cfg_dir
+		filename = manifest_path(run_ID, cfg_dir)
+		self.manifest : Optional[Manifest] = Manifest(filename) if os.path.isfile(filename) else None
+
+	def __len__(self) -> int:
+		if self.manifest is not None:
+			return len(self.manifest)
+		return len(glob.glob(self.cfg_dir + self.run_ID + '_*'))
+
+	def __iter__(self) -> Iterator[Dict[str, str]]:
+		"""every config, in manifest order or by `CONFIG_ID` for text files"""
+		if self.manifest is not None:
+			yield from self.manifest.iter_rows()
+		else:
+			for i in range(len(self)):
+				yield self[i]
+
+	def __getitem__(self, cfg_ID : str) -> Dict[str, str]:
+		if self.manifest is not None:
+			config = self.manifest.config(str(cfg_ID))
+			if config is not None:
+				return config
+		return read_config_strings(self.cfg_dir + '%s_ID%s.txt' % (self.run_ID, cfg_ID))
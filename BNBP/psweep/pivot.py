@@ -0,0 +1,299 @@
+"""pivots psweep results into 2-d images, for the heatmaps of `plot_psweep`
+
+every column used is snapped once to its grid: values within `FLOAT_ATOL` of each
+other (the tolerance of `plot_psweep.fcomp`) are one grid point, and each row gets
+the integer code of its point. an image is then a single group-by over the codes
+of `X` and `Y` (`np.bincount` on `y * len(x_axis) + x`), instead of a scan of the
+table for every cell.
+
+rows that land on the same cell (repeated configs, or keys that are neither `X`, `Y`
+nor fixed by `others`, which get marginalized) are combined with one of `AGGS`.
+
+columns with more than `MAX_GRID_POINTS` distinct values were sampled rather than swept
+on a grid (nevergrad), and are split into `N_BINS` bins instead, see `make_axis`.
+"""
+
+from typing import *
+
+import numpy as np
+import pandas as pd
+
+from psweep.psweep import CONSTS_SWEEP_TYPE
+
+
+FLOAT_ATOL : float = 1e-5
+
+AGGS : Tuple[str, ...] = ('mean', 'max', 'min', 'std', 'count')
+
+# a column with more distinct values than this was not swept on a grid (nevergrad samples),
+# and is split into `N_BINS` bins instead
+MAX_GRID_POINTS : int = 100
+N_BINS : int = 20
+
+# binned with log spaced edges
+LOG_COLS : Tuple[str, ...] = tuple( k for k, t in CONSTS_SWEEP_TYPE.items() if t == 'log' )
+
+
+class Axis(NamedTuple):
+	"""the grid of a column, and where every row of the table is on it"""
+	values : np.ndarray
+	"""grid points (the smallest value of each), or the centers of the bins"""
+	codes : np.ndarray
+	"""index into `values` of every row, `-1` for NaN or off the grid"""
+	edges : Optional[np.ndarray] = None
+	"""bin edges, if the column was binned"""
+
+	@property
+	def binned(self) -> bool:
+		return self.edges is not None
+
+	def locate(self, values : Any, atol : float = FLOAT_ATOL) -> np.ndarray:
+		"""codes of other values on this grid"""
+		values = np.atleast_1d(np.asarray(values))
+		if self.binned:
+			return bin_codes(values, self.edges)
+		return snap_to(values, self.values, atol)
+
+
+def cluster(values : np.ndarray, atol : float = FLOAT_ATOL) -> Tuple[np.ndarray, np.ndarray]:
+	"""snaps `values` to a grid: sorted distinct values, where a gap of more than `atol` starts a new point
+
+	### Returns:
+	 - `Tuple[np.ndarray, np.ndarray]`
+	   the grid (the smallest value of each point), and the code (index into the grid) of
+	   every value. NaN gets code `-1`. non-numeric values are grouped by equality
+	"""
+	codes, uniq = pd.factorize(np.asarray(values), sort = True)
+	uniq = np.asarray(uniq)
+	codes = codes.astype(np.int64)
+	if uniq.dtype.kind != 'f' or len(uniq) == 0:
+		return (uniq, codes)
+
+	starts = np.concatenate([ [ True ], np.diff(uniq) > atol ])
+	point = np.cumsum(starts) - 1
+	valid = codes >= 0
+	codes[valid] = point[codes[valid]]
+	return (uniq[starts], codes)
+
+
+def snap_to(values : np.ndarray, axis : Sequence[Any], atol : float = FLOAT_ATOL) -> np.ndarray:
+	"""code of every value on a given `axis`: its nearest point if that is within `atol`, else `-1`"""
+	values = np.asarray(values)
+	axis = np.asarray(axis)
+	if values.dtype.kind not in 'iuf' or axis.dtype.kind not in 'iuf':
+		lookup = { str(a) : i for i, a in enumerate(axis) }
+		return np.array([ lookup.get(str(v), -1) for v in values ], dtype = np.int64)
+	if len(axis) == 0:
+		return np.full(len(values), -1, dtype = np.int64)
+
+	order = np.argsort(axis)
+	sorted_axis = axis[order].astype(float)
+	pos = np.searchsorted(sorted_axis, values)
+	lo = np.clip(pos - 1, 0, len(axis) - 1)
+	hi = np.clip(pos, 0, len(axis) - 1)
+	nearest = np.where(np.abs(values - sorted_axis[lo]) <= np.abs(values - sorted_axis[hi]), lo, hi)
+	codes = order[nearest].astype(np.int64)
+	codes[~(np.abs(values - sorted_axis[nearest]) <= atol)] = -1
+	return codes
+
+
+def bin_codes(values : np.ndarray, edges : np.ndarray) -> np.ndarray:
+	"""bin of every value, `-1` for NaN or outside of `edges`. the last bin includes its right edge"""
+	values = np.asarray(values, dtype = float)
+	codes = np.searchsorted(edges, values, side = 'right') - 1
+	codes[values == edges[-1]] = len(edges) - 2
+	codes[np.isnan(values) | (codes < 0) | (codes > len(edges) - 2)] = -1
+	return codes.astype(np.int64)
+
+
+def make_axis(
+		values : np.ndarray,
+		atol : float = FLOAT_ATOL,
+		max_points : int = MAX_GRID_POINTS,
+		n_bins : int = N_BINS,
+		log : bool = False,
+	) -> Axis:
+	"""the grid of a column (see `cluster`), or `n_bins` bins if it has more than `max_points` points
+
+	### Parameters:
+	 - `values : np.ndarray`
+	 - `atol : float`
+	   tolerance for float values, 0 to only merge equal values
+	   (defaults to `FLOAT_ATOL`)
+	 - `max_points : int`
+	   (defaults to `MAX_GRID_POINTS`)
+	 - `n_bins : int`
+	   (defaults to `N_BINS`)
+	 - `log : bool`
+	   log spaced bins, if the values are positive
+	   (defaults to `False`)
+	"""
+	points, codes = cluster(values, atol)
+	if len(points) <= max_points or points.dtype.kind not in 'iuf':
+		return Axis(points, codes)
+
+	lo, hi = float(points[0]), float(points[-1])
+	if log and lo > 0:
+		edges = np.geomspace(lo, hi, n_bins + 1)
+		centers = np.sqrt(edges[:-1] * edges[1:])
+	else:
+		edges = np.linspace(lo, hi, n_bins + 1)
+		centers = (edges[:-1] + edges[1:]) / 2
+	return Axis(centers, bin_codes(values, edges), edges)
+
+
+def sweep_axes(
+		df : pd.DataFrame,
+		columns : Optional[Sequence[str]] = None,
+		typemap : Optional[Dict[str, type]] = None,
+		max_points : int = MAX_GRID_POINTS,
+		n_bins : int = N_BINS,
+	) -> Dict[str, Axis]:
+	"""the axis of every column (see `make_axis`), in one pass over the table
+
+	### Parameters:
+	 - `df : pd.DataFrame`
+	 - `columns : Optional[Sequence[str]]`
+	   if `None`, every column
+	   (defaults to `None`)
+	 - `typemap : Optional[Dict[str, type]]`
+	   columns whose type is not `float` here are only merged when equal. if `None`, every float column is merged within `FLOAT_ATOL`
+	   (defaults to `None`)
+	 - `max_points : int`
+	   (defaults to `MAX_GRID_POINTS`)
+	 - `n_bins : int`
+	   (defaults to `N_BINS`)
+	"""
+	axes = dict()
+	for col in (df.columns if columns is None else columns):
+		is_float = typemap is None or typemap.get(col, float) is float
+		axes[col] = make_axis(
+			df[col].to_numpy(),
+			atol = FLOAT_ATOL if is_float else 0.0,
+			max_points = max_points,
+			n_bins = n_bins,
+			log = col in LOG_COLS,
+		)
+	return axes
+
+
+class PivotIndex(object):
+	"""the axes of some columns of a results table, computed once and shared by any number of pivots
+
+	### Parameters:
+	 - `df : pd.DataFrame`
+	 - `columns : Optional[Sequence[str]]`
+	   columns to index. if `None`, every column. others are indexed when first used
+	   (defaults to `None`)
+	 - `axes : Optional[Dict[str, Union[Axis, Sequence[Any]]]]`
+	   axes for some columns, instead of computing them: an `Axis` from `sweep_axes` on
+	   this same table, or a grid (for example from `plot_psweep.compute_ranges`),
+	   whose values off the grid are left out of every image. a grid is ignored for columns
+	   that `make_axis` bins, since `compute_ranges` only gives the centers of their bins
+	   (defaults to `None`)
+	 - `atol : float`
+	   (defaults to `FLOAT_ATOL`)
+	"""
+
+	def __init__(
+			self,
+			df : pd.DataFrame,
+			columns : Optional[Sequence[str]] = None,
+			axes : Optional[Dict[str, Union[Axis, Sequence[Any]]]] = None,
+			atol : float = FLOAT_ATOL,
+		):
+		self.df = df
+		self.atol = atol
+		self.axes : Dict[str, Axis] = dict()
+		for col, axis in (axes or dict()).items():
+			if isinstance(axis, Axis):
+				self.axes[col] = axis
+				continue
+			own = make_axis(df[col].to_numpy(), atol, log = col in LOG_COLS)
+			if own.binned:
+				self.axes[col] = own
+			else:
+				axis = np.asarray(axis)
+				self.axes[col] = Axis(axis, snap_to(df[col].to_numpy(), axis, atol))
+		for col in (df.columns if columns is None else columns):
+			self.axis(col)
+
+	def __len__(self) -> int:
+		return len(self.df)
+
+	def axis(self, col : str) -> Axis:
+		if col not in self.axes:
+			self.axes[col] = make_axis(self.df[col].to_numpy(), self.atol, log = col in LOG_COLS)
+		return self.axes[col]
+
+	def slice_mask(self, others : Optional[Dict[str, Any]] = None) -> np.ndarray:
+		"""rows where every key of `others` is at the grid point (or in the bin) of its value. none, if a value is off the grid"""
+		mask = np.ones(len(self.df), dtype = bool)
+		for k, v in (others or dict()).items():
+			axis = self.axis(k)
+			loc = axis.locate(v, self.atol)[0]
+			if loc < 0:
+				# `-1` is also the code of the rows where `k` is NaN
+				return np.zeros(len(self.df), dtype = bool)
+			mask &= axis.codes == loc
+		return mask
+
+	def pivot(
+			self,
+			X : str,
+			Y : str,
+			value : str,
+			agg : str = 'mean',
+			others : Optional[Dict[str, Any]] = None,
+		) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+		"""`value` on the grid of `X` and `Y`, combined with `agg` over the rows of each cell
+
+		### Parameters:
+		 - `X : str`
+		 - `Y : str`
+		 - `value : str`
+		   column to aggregate. NaN values are left out
+		 - `agg : str`
+		   one of `AGGS`
+		   (defaults to `'mean'`)
+		 - `others : Optional[Dict[str, Any]]`
+		   only rows where these keys have these values. keys not in here are marginalized
+		   (defaults to `None`)
+
+		### Returns:
+		 - `Tuple[np.ndarray, np.ndarray, np.ndarray]`
+		   the `X` grid, the `Y` grid (bin centers, if binned), and the image, of shape `(len(y_axis), len(x_axis))`.
+		   cells without rows are NaN (0 for `'count'`)
+		"""
+		if agg not in AGGS:
+			raise ValueError('unknown aggregation %s, expected one of %s' % (agg, str(AGGS)))
+
+		x_axis, y_axis = self.axis(X), self.axis(Y)
+		nx, ny = len(x_axis.values), len(y_axis.values)
+		v = self.df[value].to_numpy(dtype = float)
+
+		mask = self.slice_mask(others) & (x_axis.codes >= 0) & (y_axis.codes >= 0) & ~np.isnan(v)
+		cell = y_axis.codes[mask] * nx + x_axis.codes[mask]
+		v = v[mask]
+
+		count = np.bincount(cell, minlength = nx * ny).astype(float)
+		if agg == 'count':
+			return (x_axis.values, y_axis.values, count.reshape(ny, nx))
+
+		with np.errstate(invalid = 'ignore', divide = 'ignore'):
+			if agg in ('mean', 'std'):
+				mean = np.bincount(cell, weights = v, minlength = nx * ny) / count
+				if agg == 'mean':
+					img = mean
+				else:
+					sq = np.bincount(cell, weights = v * v, minlength = nx * ny) / count
+					img = np.sqrt(np.clip(sq - mean * mean, 0, None))
+			elif agg == 'max':
+				img = np.full(nx * ny, -np.inf)
+				np.maximum.at(img, cell, v)
+			else:
+				img = np.full(nx * ny, np.inf)
+				np.minimum.at(img, cell, v)
+
+		img[count == 0] = np.nan
+		return (x_axis.values, y_axis.values, img.reshape(ny, nx))
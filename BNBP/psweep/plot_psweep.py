@@ -3,6 +3,8 @@ import sys
 import math
 from typing import *
 from types import FunctionType
+from itertools import combinations
+from multiprocessing import Pool
 
 import numpy as np
 import matplotlib.pyplot as plt
@@ -12,6 +14,10 @@ sys.path.append("..")
 sys.path.append("HH-SGD")
 
 from psweep.psweep import *
+from psweep.colstore import Table, is_table, table_path, parse_filter, match
+from psweep.pivot import PivotIndex, Axis, sweep_axes, MAX_GRID_POINTS, N_BINS
+from psweep.surrogate import Surrogate, N_GRID
+from psweep.query import top
 
 
 def fcomp(a,b,delta = 1e-5):
@@ -23,51 +29,36 @@ def load_pickled(filename = 'data.df'):
 
 
 
-class FloatSet(set):
-	def __init__(self, *args, **kwargs):
-		super().__init__(*args, **kwargs)
-
-	def add_float(self, myfloat : float, delta = 1e-5):
-		if all( (not fcomp(x, myfloat, delta)) for x in self ):
-			self.add(myfloat)
-	
-
 def compute_ranges(
 		df,
 		cols_ignore = REMOVE_COLS + ['CONFIG_ID', 'DIRNAME'] + [ k for k in LOSS_TYPES ],
 		typemap = TYPE_MAP,
+		axes : Optional[Dict[str, Axis]] = None,
 	):
 	"""
 	takes in a dataframe, returns a 2-tuple of dicts:
 	(variable_ranges, consts)
+
+	values of a float column (by `typemap`) within `pivot.FLOAT_ATOL` of each other count as one.
+	columns that were sampled instead of swept on a grid get the centers of their bins, see `pivot.make_axis`.
+	pass `axes` from `pivot.sweep_axes` to reuse them
 	"""
-	
-	# get all unique elements in each column
-	ranges = {}
-	for col in df.columns:
-		if col not in cols_ignore:
-			is_floatCol = isinstance( typemap[col], float)
-			if is_floatCol:
-				ranges[col] = FloatSet()
-			else:
-				ranges[col] = set()
-			
-			for x in df[col]:
-				if is_floatCol:
-					ranges[col].add_float(x)
-				else:
-					ranges[col].add(x)
+	if axes is None:
+		axes = sweep_axes(df, [ col for col in df.columns if col not in cols_ignore ], typemap)
 
 	var_ranges : Dict[str, List[float]] = {}
 	consts : Dict[str, float] = {}
 
-	for k in ranges:
-		if len(ranges[k]) == 1:
+	for k, axis in axes.items():
+		if k in cols_ignore:
+			continue
+		values = axis.values.tolist()
+		if len(values) == 1:
 			# not variable
-			consts[k] = ranges[k].pop()
-		else:
+			consts[k] = values[0]
+		elif len(values) > 1:
 			# variable
-			var_ranges[k] = sorted(list(ranges[k]))
+			var_ranges[k] = values
 
 	return (var_ranges, consts)
 
@@ -90,8 +81,10 @@ def save_sorted_many(df, basepath = ''):
 	with open(basepath + 'test_acc.txt', 'w') as fout:
 		print(df.sort_values('TEST_ACCURACY'), file=fout)
 
-def save_sorted(df : pd.DataFrame, path : str = '', sort_col : str = 'TEST_ACCURACY'):
+def save_sorted(df : pd.DataFrame, path : str = '', sort_col : str = 'TEST_ACCURACY', consts : Optional[Dict[str, Any]] = None):
 	with open(path, 'w') as fout:
+		for k, v in (consts or {}).items():
+			print('# %s = %s' % (k, v), file=fout)
 		print(df.sort_values(sort_col), file=fout)
 
 
@@ -102,63 +95,43 @@ def plot_pair_heatmap(
 		ranges = None,
 		# defaults = None,
 		accuracy_mode = 'LOSS_REL',
+		agg : str = 'mean',
+		index : Optional[PivotIndex] = None,
 	):
+	"""plots `accuracy_mode` on the grid of `X,Y`, see `psweep/pivot.py`
+
+	### Parameters:
+	 - `data : pd.DataFrame`
+	 - `X : str`
+	 - `Y : str`
+	 - `others : Dict[str, float]`
+	   only plot rows where these keys have these values. other keys are marginalized with `agg`
+	 - `ranges : Optional[Dict[str, List[float]]]`
+	   grids for `X` and `Y`. if `None`, the values in `data`, clustered.
+	   ignored for columns that are binned (see `pivot.make_axis`)
+	   (defaults to `None`)
+	 - `accuracy_mode : str`
+	   (defaults to `'LOSS_REL'`)
+	 - `agg : str`
+	   how to combine the rows that land on one cell, one of `pivot.AGGS`
+	   (defaults to `'mean'`)
+	 - `index : Optional[PivotIndex]`
+	   an index of `data` to reuse, instead of building one (`ranges` is then ignored)
+	   (defaults to `None`)
+	"""
 
-	if ranges is None:
-		ranges = compute_ranges(data)[0]
-
-	print(ranges)
-	
-	# if defaults is None:
-	# 	defaults = CONSTS_DEFAULT
-
-
-	# * trimming input dataframe
-
-	# for everything in `others`, delete all dataframe elements that dont match
-	for k in others:
-		data = data.loc[ fcomp(data[k], others[k]) ]
-
-	# dont need config ID or any of the default values
-	del data['CONFIG_ID']
-
-	for ot in others:
-		del data[ot]
-
-	# only need 1 type of loss
-	for lt in LOSS_TYPES:
-		if lt != accuracy_mode:
-			del data[lt]
-	
-	data_im = np.full(
-		( len(ranges[Y]), len(ranges[X]) ),
-		np.nan,
-		dtype=np.float
-	)
-
-	print(data)
+	if index is None:
+		axes = None if ranges is None else { k : ranges[k] for k in (X, Y) if k in ranges }
+		index = PivotIndex(data, columns = [ X, Y ], axes = axes)
 
-	for i,x in enumerate(ranges[X]):
-		for j,y in enumerate(ranges[Y]):
-			temp = data.loc[
-				fcomp(data[X], x)
-				& fcomp(data[Y], y)
-			][accuracy_mode]
+	x_vals, y_vals, data_im = index.pivot(X, Y, accuracy_mode, agg = agg, others = others)
 
-			if temp.empty:
-				data_im[j,i] = np.nan
-			else:
-				data_im[j,i] = temp.to_list()[0]			
-			
 	# * chart stuff
 
-	x_vals = ranges[X]
-	y_vals = ranges[Y]
-
 	fig, ax = plt.subplots()
 	im = ax.imshow(data_im, cmap="inferno")
 	cbar = plt.colorbar(im)
-	cbar.ax.set_ylabel(accuracy_mode, rotation=-90, va="bottom")
+	cbar.ax.set_ylabel(accuracy_mode if agg == 'mean' else '%s (%s)' % (accuracy_mode, agg), rotation=-90, va="bottom")
 
 	# We want to show all ticks...
 	ax.set_xticks(np.arange(len(x_vals)))
@@ -195,22 +168,51 @@ def plot_pair_heatmap(
 
 
 
+def tick_labels(vals, every : int = 5) -> List[str]:
+	"""labels for every `every`-th tick, and the last one"""
+	return [
+		(str(round(v, 2)) if isinstance(v, (int, float)) else str(v)) if (i == len(vals) - 1 or i % every == 0) else ""
+		for i, v in enumerate(vals)
+	]
+
+
+def draw_heatmap(ax, x_vals, y_vals, data_im, X : str, Y : str, vmin = None, vmax = None):
+	"""draws an image from `PivotIndex.pivot` on `ax`, returns the `AxesImage`"""
+	im = ax.imshow(data_im, cmap="inferno", vmin=vmin, vmax=vmax, aspect="auto")
+	ax.set_xticks(np.arange(len(x_vals)))
+	ax.set_yticks(np.arange(len(y_vals)))
+	ax.set_xticklabels(tick_labels(list(x_vals)), rotation=45, ha="right", rotation_mode="anchor")
+	ax.set_yticklabels(tick_labels(list(y_vals)))
+	ax.set_xlabel(X)
+	ax.set_ylabel(Y)
+	return im
+
+
+def render_panel(panel : Tuple[str, str, np.ndarray, np.ndarray, np.ndarray, str, str]) -> str:
+	"""saves one heatmap `(X, Y, x_vals, y_vals, data_im, label, path)` to `path`. runs in the pool of `main_hm_matrix`"""
+	X, Y, x_vals, y_vals, data_im, label, path = panel
+	fig, ax = plt.subplots()
+	im = draw_heatmap(ax, x_vals, y_vals, data_im, X, Y)
+	cbar = fig.colorbar(im, ax=ax)
+	cbar.ax.set_ylabel(label, rotation=-90, va="bottom")
+	fig.tight_layout()
+	fig.savefig(path)
+	plt.close(fig)
+	return path
+
+
+
 def main(argv = sys.argv):
 	if len(argv) > 1:
 		filename = argv[1]
 	else:
-		filename = 'data.df'
+		filename = 'data.cols'
 
 	mode = 'hm'
 	if len(argv) > 2:
 		mode = argv[2]
 
-	df = None
-	if os.path.isfile(filename):
-		df = pd.read_pickle(filename)
-	else:
-		from psweep.psweep_load import read_and_save
-		df = read_and_save(filename)
+	df = dynamic_load(filename, verbose = False)
 
 	mx = 0.0
 	mx_i = 0
@@ -234,36 +236,80 @@ def main(argv = sys.argv):
 		print(compute_ranges(df))
 
 
-def dynamic_load(filename : str, verbose : bool = True):
-	df = None
-	if os.path.isfile(filename):
-		df = pd.read_pickle(filename)
+def dynamic_load(
+		filename : str, 
+		verbose : bool = True, 
+		columns : Optional[Sequence[str]] = None,
+		where : Sequence[str] = (),
+	) -> pd.DataFrame:
+	"""loads a results table (see `psweep/colstore.py`) or a pickled dataframe. if neither exists, reads the runs and saves them to `filename`
+	
+	### Parameters:
+	 - `filename : str`   
+	 - `verbose : bool`   
+	   print the table and the best run
+	   (defaults to `True`)
+	 - `columns : Optional[Sequence[str]]`   
+	   only load these columns (a table reads nothing else from disk). `None` for all
+	   (defaults to `None`)
+	 - `where : Sequence[str]`   
+	   only load rows matching all of these, as `'KEY<op>VALUE'`, see `colstore.parse_filter`
+	   (defaults to `()`)
+	"""
+	# fire passes a single flag as a string
+	if isinstance(where, str):
+		where = [ where ]
+	if isinstance(columns, str):
+		columns = [ columns ]
+	filters = [ parse_filter(w) for w in where ]
+	if not is_table(filename) and not os.path.isfile(filename) and is_table(table_path(filename)):
+		# a name from before the tables, such as `data.df`
+		filename = table_path(filename)
+
+	if is_table(filename):
+		if verbose and columns is not None:
+			columns = list(dict.fromkeys(list(columns) + [ 'TEST_ACCURACY', 'DIRNAME' ]))
+		table = Table(filename)
+		if columns is not None:
+			columns = [ c for c in columns if c in table.columns ]
+		df = table.read(columns, filters).reset_index(drop = True)
 	else:
-		from psweep.psweep_load import read_and_save
-		df = read_and_save(filename)
+		if os.path.isfile(filename):
+			df = pd.read_pickle(filename)
+		else:
+			from psweep.psweep_load import read_and_save
+			df = read_and_save(file_save = filename)
+		for col, op, value in filters:
+			df = df.loc[ match(df[col].to_numpy(), op, value) ]
+		if columns is not None:
+			df = df[[ c for c in columns if c in df.columns ]]
+		df = df.reset_index(drop = True)
 
 	if verbose:
-		# REVIEW: what exactly does this do?
-		mx = 0.0
-		mx_i = 0
-		for i, v in enumerate(df['TEST_ACCURACY']):
-			if v > mx:
-				mx = v 
-				mx_i = i 
-
 		print(df)
-		print(mx, df['DIRNAME'][mx_i])
+		# the best run
+		if len(df) and df['TEST_ACCURACY'].notna().any():
+			mx_i = df['TEST_ACCURACY'].idxmax()
+			print(df['TEST_ACCURACY'][mx_i], df['DIRNAME'][mx_i])
 
 	return df
 
 
-def main_hm(filename : str = 'data.df', X : str = 'LF_OUT', Y : str = 'LF_HIDDEN', accuracy_mode : str = 'TEST_ACCURACY'):
+def main_hm(
+		filename : str = 'data.cols', 
+		X : str = 'LF_OUT', 
+		Y : str = 'LF_HIDDEN', 
+		accuracy_mode : str = 'TEST_ACCURACY',
+		where : Sequence[str] = (),
+		agg : str = 'mean',
+		others : Optional[Dict[str, float]] = None,
+	):
 	"""plots a heatmap of the accuracy (`accuracy_mode`) dependent on `X,Y`
 	
 	# Parameters:
 	 - `filename : str`   
-	   pandas dataframe pickle file to look for. if not found, will try to generate and save it
-	   (defaults to `'data.df'`)
+	   results table (or pandas dataframe pickle file) to look for. if not found, will try to generate and save it
+	   (defaults to `'data.cols'`)
 	 - `X : str`   
 	   X axis variable for the heatmap. make sure that the specified dataframe file actually has this as a variable
 	   (defaults to `'LF_OUT'`)
@@ -273,24 +319,222 @@ def main_hm(filename : str = 'data.df', X : str = 'LF_OUT', Y : str = 'LF_HIDDEN
 	 - `accuracy_mode : str`   
 	   the accuracy measure to plot on the heatmap
 	   (defaults to `'TEST_ACCURACY'`)
+	 - `where : Sequence[str]`   
+	   only plot runs matching all of these, such as `'N_LAYER_1==100'`, see `dynamic_load`
+	   (defaults to `()`)
+	 - `agg : str`   
+	   how to combine runs on the same cell (repeated configs, or differing in keys other than `X,Y`), one of `mean, max, min, std, count`
+	   (defaults to `'mean'`)
+	 - `others : Optional[Dict[str, float]]`   
+	   slice: only plot runs with these values of other keys, such as `"{GNA: 120.0}"`
+	   (defaults to `None`)
 	"""
-	df = dynamic_load(filename)
+	others = dict(others or {})
+	df = dynamic_load(filename, columns = [ X, Y, accuracy_mode ] + list(others), where = where)
 
 	plot_pair_heatmap(
 		data = df, 
 		X = X, Y = Y,
-		others = {},
+		others = others,
 		accuracy_mode = accuracy_mode,
+		agg = agg,
 	)
 
 
-def main_table(filename : str = 'data.df', sort_col : str = 'TEST_ACCURACY', save_path = None):
-	"""outputs a table of the data from the given dataframe, sorted by `sort_col`
+def main_hm_matrix(
+		filename : str = 'data.cols',
+		accuracy_mode : str = 'TEST_ACCURACY',
+		keys : Optional[Sequence[str]] = None,
+		where : Sequence[str] = (),
+		agg : str = 'mean',
+		others : Optional[Dict[str, float]] = None,
+		out_dir : Optional[str] = None,
+		n_procs : Optional[int] = None,
+		show : bool = False,
+	):
+	"""plots the heatmaps of the accuracy (`accuracy_mode`) for every pair of swept keys, as one matrix and one image per pair
+
+	the table is loaded, and its axes (see `pivot.sweep_axes`) computed, once for all pairs.
+	the images are pivoted here, and the per-pair files are rendered in a process pool
+	while the matrix is drawn
+	
+	# Parameters:
+	 - `filename : str`   
+	   results table (or pandas dataframe pickle file) to look for. if not found, will try to generate and save it
+	   (defaults to `'data.cols'`)
+	 - `accuracy_mode : str`   
+	   the accuracy measure to plot on the heatmaps
+	   (defaults to `'TEST_ACCURACY'`)
+	 - `keys : Optional[Sequence[str]]`   
+	   keys to pair up. if `None`, every key that varies across the runs
+	   (defaults to `None`)
+	 - `where : Sequence[str]`   
+	   only plot runs matching all of these, see `dynamic_load`
+	   (defaults to `()`)
+	 - `agg : str`   
+	   how to combine runs on the same cell, see `main_hm`
+	   (defaults to `'mean'`)
+	 - `others : Optional[Dict[str, float]]`   
+	   slice: only plot runs with these values of other keys, see `main_hm`
+	   (defaults to `None`)
+	 - `out_dir : Optional[str]`   
+	   where to save `matrix.png` and `{X}__{Y}.png` for every pair. if `None`,
+	   	`filename.split('.')[:-1] + '_heatmaps'`
+	   (defaults to `None`)
+	 - `n_procs : Optional[int]`   
+	   processes rendering the per-pair images. if `None`, one per cpu
+	   (defaults to `None`)
+	 - `show : bool`   
+	   show the matrix once it is saved
+	   (defaults to `False`)
+	"""
+	others = dict(others or {})
+	if out_dir is None:
+		out_dir = '.'.join(filename.rstrip('/').split('.')[:-1]) + '_heatmaps'
+	os.makedirs(out_dir, exist_ok = True)
+
+	if isinstance(keys, str):
+		keys = [ keys ]
+	candidates = [ k for k in (keys or CONSTS_DEFAULT_KEYS) if k not in CONSTS_DEFAULT_KEYS_META and k not in others ]
+	df = dynamic_load(filename, columns = candidates + [ accuracy_mode ] + list(others), where = where, verbose = False)
+	candidates = [ k for k in candidates if k in df.columns ]
+
+	axes = sweep_axes(df, candidates + list(others), typemap = TYPE_MAP)
+	var_ranges = compute_ranges(df, axes = axes)[0]
+	keys = [ k for k in candidates if k in var_ranges ]
+	if len(keys) < 2:
+		raise ValueError('need at least 2 swept keys for a heatmap matrix, found %s' % str(keys))
+	index = PivotIndex(df, columns = (), axes = axes)
+
+	label = accuracy_mode if agg == 'mean' else '%s (%s)' % (accuracy_mode, agg)
+	panels = [
+		(X, Y, *index.pivot(X, Y, accuracy_mode, agg = agg, others = others), label, os.path.join(out_dir, '%s__%s.png' % (X, Y)))
+		for X, Y in combinations(keys, 2)
+	]
+
+	n_procs = min(n_procs or os.cpu_count() or 1, len(panels))
+	pool = Pool(n_procs) if n_procs > 1 else None
+	rendered = pool.map_async(render_panel, panels) if pool is not None else None
+
+	# * the matrix: pair (keys[i], keys[j]) for i < j in row i, column j - 1, on one color scale
+	images = [ p[4] for p in panels if np.isfinite(p[4]).any() ]
+	vmin = min([ np.nanmin(im) for im in images ], default = None)
+	vmax = max([ np.nanmax(im) for im in images ], default = None)
+
+	n = len(keys) - 1
+	fig, axs = plt.subplots(n, n, figsize = (3 * n + 1, 3 * n), squeeze = False, constrained_layout = True)
+	for ax in axs.ravel():
+		ax.axis('off')
+	im = None
+	for X, Y, x_vals, y_vals, data_im, _, _ in panels:
+		ax = axs[keys.index(X), keys.index(Y) - 1]
+		ax.axis('on')
+		im = draw_heatmap(ax, x_vals, y_vals, data_im, X, Y, vmin = vmin, vmax = vmax)
+	cbar = fig.colorbar(im, ax = axs.ravel().tolist())
+	cbar.ax.set_ylabel(label, rotation=-90, va="bottom")
+	fig.savefig(os.path.join(out_dir, 'matrix.png'))
+
+	if pool is not None:
+		rendered.get()
+		pool.close()
+		pool.join()
+	else:
+		for panel in panels:
+			render_panel(panel)
+
+	print('> saved %d heatmaps and the matrix to %s' % (len(panels), out_dir))
+	if show:
+		plt.show()
+	plt.close(fig)
+
+
+def main_surrogate(
+		filename : str = 'data.cols',
+		X : str = 'LF_OUT',
+		Y : str = 'LF_HIDDEN',
+		accuracy_mode : str = 'TEST_ACCURACY',
+		keys : Optional[Sequence[str]] = None,
+		where : Sequence[str] = (),
+		others : Optional[Dict[str, float]] = None,
+		n_grid : int = N_GRID,
+		save_path : Optional[str] = None,
+		show : bool = True,
+	):
+	"""plots the accuracy (`accuracy_mode`) on a dense grid of `X,Y` predicted by a surrogate fit to all runs,
+	next to its uncertainty, see `psweep/surrogate.py`. for runs that are not on a grid, such as from `sweep_nevergrad`
+	
+	# Parameters:
+	 - `filename : str`   
+	   results table (or pandas dataframe pickle file) to look for. if not found, will try to generate and save it
+	   (defaults to `'data.cols'`)
+	 - `X : str`   
+	   (defaults to `'LF_OUT'`)
+	 - `Y : str`   
+	   (defaults to `'LF_HIDDEN'`)
+	 - `accuracy_mode : str`   
+	   the accuracy measure to fit and plot
+	   (defaults to `'TEST_ACCURACY'`)
+	 - `keys : Optional[Sequence[str]]`   
+	   inputs of the surrogate. if `None`, every key that varies across the runs
+	   (defaults to `None`)
+	 - `where : Sequence[str]`   
+	   only fit to runs matching all of these, see `dynamic_load`
+	   (defaults to `()`)
+	 - `others : Optional[Dict[str, float]]`   
+	   values of the other inputs on the slice. inputs not in here are at the median of the runs
+	   (defaults to `None`)
+	 - `n_grid : int`   
+	   points along each axis
+	   (defaults to `N_GRID`)
+	 - `save_path : Optional[str]`   
+	   if `None`, `filename.split('.')[:-1] + '_surrogate_{X}__{Y}.png'`
+	   (defaults to `None`)
+	 - `show : bool`   
+	   (defaults to `True`)
+	"""
+	if save_path is None:
+		save_path = '.'.join(filename.rstrip('/').split('.')[:-1]) + '_surrogate_%s__%s.png' % (X, Y)
+
+	if isinstance(keys, str):
+		keys = [ keys ]
+	candidates = [ k for k in (keys or CONSTS_DEFAULT_KEYS) if k not in CONSTS_DEFAULT_KEYS_META ]
+	df = dynamic_load(filename, columns = candidates + [ accuracy_mode ], where = where, verbose = False)
+	model = Surrogate(df, accuracy_mode, keys = candidates)
+	for k in (X, Y):
+		if k not in model.keys:
+			raise ValueError('%s does not vary across the runs, varying keys are %s' % (k, str(model.keys)))
+	print('> fit %s over %s: length scale %g, noise %g' % (accuracy_mode, str(model.keys), model.length_scale, model.noise))
+
+	x_vals, y_vals, mean, std = model.slice(X, Y, others, n_grid)
+
+	fig, axs = plt.subplots(1, 2, figsize = (11, 4.5), constrained_layout = True)
+	for ax, data_im, label in ((axs[0], mean, accuracy_mode), (axs[1], std, '%s (std)' % accuracy_mode)):
+		im = draw_heatmap(ax, x_vals, y_vals, data_im, X, Y)
+		cbar = fig.colorbar(im, ax = ax)
+		cbar.ax.set_ylabel(label, rotation=-90, va="bottom")
+		# the runs the surrogate was fit to
+		ax.scatter(
+			model.grid_position(X, model.raw_train[:, model.keys.index(X)], n_grid),
+			model.grid_position(Y, model.raw_train[:, model.keys.index(Y)], n_grid),
+			s = 2, c = 'w', alpha = 0.3,
+		)
+		ax.set_xlim(-0.5, n_grid - 0.5)
+		ax.set_ylim(n_grid - 0.5, -0.5)
+
+	fig.savefig(save_path)
+	print('> saved %s' % save_path)
+	if show:
+		plt.show()
+	plt.close(fig)
+
+
+def main_table(filename : str = 'data.cols', sort_col : str = 'TEST_ACCURACY', save_path = None, where : Sequence[str] = (), drop_consts : bool = False):
+	"""outputs a table of the data from the given dataframe, sorted by `sort_col`. for the best few runs of a large sweep, use `top` (see `psweep/query.py`)
 	
 	# Parameters:
 	 - `filename : str`   
-	   pandas dataframe pickle file to look for. if not found, will try to generate and save it
-	   (defaults to `'data.df'`)
+	   results table (or pandas dataframe pickle file) to look for. if not found, will try to generate and save it
+	   (defaults to `'data.cols'`)
 	 - `sort_col : str`   
 	   [description]
 	   (defaults to `'TEST_ACCURACY'`)
@@ -298,31 +542,56 @@ def main_table(filename : str = 'data.df', sort_col : str = 'TEST_ACCURACY', sav
 	   text file where the table should be saved. if `None`, saves to 
 	   	`filename.split('.')[:-1] + '_' + sort_col + '.txt'`
 	   (defaults to `None`)
+	 - `where : Sequence[str]`   
+	   only list runs matching all of these, see `dynamic_load`
+	   (defaults to `()`)
+	 - `drop_consts : bool`   
+	   leave out the columns that are the same for every run, and list them above the table instead
+	   (defaults to `False`)
 	"""
 	if save_path is None:
-		save_path = filename.split('.')[:-1] + '_' + sort_col + '.txt'
+		save_path = '.'.join(filename.rstrip('/').split('.')[:-1]) + '_' + sort_col + '.txt'
 
-	df : pd.DataFrame = dynamic_load(filename)
-	save_sorted(df, path = save_path, sort_col = sort_col)
+	df : pd.DataFrame = dynamic_load(filename, where = where)
+	consts = None
+	if drop_consts:
+		consts = compute_ranges(df)[1]
+		df = df.drop(columns = list(consts))
+	save_sorted(df, path = save_path, sort_col = sort_col, consts = consts)
 
 
 
-def main_cr(filename : str = 'data.df'):
-	"""prints the ranges for the variables in the dataframe
+def main_cr(filename : str = 'data.cols', max_points : int = MAX_GRID_POINTS, n_bins : int = N_BINS):
+	"""prints the ranges for the variables in the dataframe, and the bins of those not swept on a grid
 	
 	# Parameters:
 	 - `filename : str`   
-	   pandas dataframe pickle file to look for. if not found, will try to generate and save it
-	   (defaults to `'data.df'`)
+	   results table (or pandas dataframe pickle file) to look for. if not found, will try to generate and save it
+	   (defaults to `'data.cols'`)
+	 - `max_points : int`   
+	   a variable with more values than this is binned
+	   (defaults to `MAX_GRID_POINTS`)
+	 - `n_bins : int`   
+	   (defaults to `N_BINS`)
 	"""
-	df : pd.DataFrame = dynamic_load(filename)
-	print(compute_ranges(df))
+	keys = [ k for k in CONSTS_DEFAULT_KEYS if k not in ['CONFIG_ID', 'DIRNAME'] ]
+	df : pd.DataFrame = dynamic_load(filename, columns = keys)
+	axes = sweep_axes(df, [ k for k in keys if k in df.columns ], typemap = TYPE_MAP, max_points = max_points, n_bins = n_bins)
+	print(compute_ranges(df, axes = axes))
+	for k, axis in axes.items():
+		if axis.binned:
+			print('%s: not on a grid, %d bins over [%g, %g]' % (k, len(axis.values), axis.edges[0], axis.edges[-1]))
 
 
 MAIN_FUNCS = {
 	'heatmap' : main_hm,
 	'hm' : main_hm,
+	'heatmap_matrix' : main_hm_matrix,
+	'hm_matrix' : main_hm_matrix,
+	'surrogate' : main_surrogate,
+	'gp' : main_surrogate,
 	'table' : main_table,
+	'top' : top,
 	'compute_ranges' : main_cr,
 	'cr' : main_cr,
 }
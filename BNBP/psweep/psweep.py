@@ -44,7 +44,7 @@ t_Val = Union[float,int,str]
 cn_Dict = Dict[t_Key,t_Val]
 cn_Dict_R = Dict[t_Key,List[t_Val]]
 
-LossMode = Literal['abs', 'rel']
+LossMode = Literal['abs', 'rel', 'slope', 'nan']
 
 CONSTS_DEFAULT_KEYS = get_args(t_Key)
 
@@ -154,9 +154,12 @@ CONFIG_KEYS_MAP = {
 
 
 
+# column -> metric, see `psweep_load.read_loss_metrics`. 'test' is read from `percent0.txt` instead
 LOSS_TYPES = {
 	'LOSS_REL' : 'rel',
 	'LOSS_ABS' : 'abs',
+	'LOSS_SLOPE' : 'slope',
+	'LOSS_NAN' : 'nan',
 	'TEST_ACCURACY' : 'test',
 }
 
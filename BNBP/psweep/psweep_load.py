@@ -1,4 +1,4 @@
-"""psweep_load.py - reads runs matching `run_ID` and saves them to a pandas dataframe (runs `read_and_save()`)
+"""psweep_load.py - reads runs matching `run_ID` and saves them to a results table (runs `read_and_save()`)
 
 ## usage
     psweep_load.py <flags>
@@ -12,14 +12,38 @@
        folder in which to look for the data
        (defaults to `'../../../psweep_data/'`)
      - `file_save : Optional[str]`
-       where to pickle the pandas dataframe into. if no value given, set to `'data_{run_ID}.df'`
+       table directory to save into, see `psweep/colstore.py`. if it ends in `.df`, the dataframe
+       is pickled there instead. if no value given, set to `'data_{run_ID}.cols'`
        (defaults to `None`)
      - `rem_cols : List[str]`
        columns to remove
        (defaults to `None`)
+     - `registry : bool`
+       also record the runs in the registry, see `psweep/registry.py`
+       (defaults to `True`)
+     - `incremental : bool`
+       only parse runs that are new or changed since the last call, see below
+       (defaults to `True`)
+     - `n_procs : Optional[int]`
+       number of reader processes. if `None`, one per core
+       (defaults to `None`)
+     - `curves : bool`
+       also keep every run's loss and label curves in a curve store, see `psweep/curve_store.py`
+       (defaults to `True`)
 
     ### Modifies
-     - saves the dataframe as a pickle file into `file_save`
+     - saves the table (or the pickled dataframe) into `file_save`
+     - saves the ingestion manifest into `{file_save}.ingest`
+     - adds the curves of the runs read to `data_{run_ID}.curves`
+     - updates the registry in `datadir`
+
+## incremental reads
+next to the dataframe, `read_and_save` keeps an ingestion manifest: for every run
+directory, the modification time and size of each of `INGEST_FILES` when it was
+read, and the row extracted from it. on the next call, only directories that are
+new, or where one of those files changed, are parsed again (in parallel), and
+their rows are merged with the ones kept for the others. directories that are
+gone are dropped from the table.
 """
 
 from os import listdir
@@ -28,6 +52,9 @@ import os
 import sys
 import math
 import glob
+import pickle
+from functools import partial
+from multiprocessing import Pool
 
 import numpy as np
 import pandas as pd
@@ -40,11 +67,94 @@ else:
 
 
 from psweep.psweep import *
+from psweep.result_cache import run_status, is_retired
+from psweep.registry import Registry, split_dirname
+from psweep.colstore import write_table, TABLE_EXT
+from psweep.curve_store import CurveStore, curves_path, COMPACT_GARBAGE
 
 
 def fcomp(a,b,delta = 1e-5):
 	return abs(a-b) < delta
 
+def parse_loss_file(filename : str) -> Optional[np.ndarray]:
+	"""parses a `loss.txt` in one go, as an `(n_batches, batch_size)` array
+
+	the trainer writes one line per batch, every value followed by a comma. a last line
+	without its newline (a run still writing) is left out. returns `None` if the file is
+	missing, empty, or not in that format
+	"""
+	try:
+		with open(filename, 'rb') as fin:
+			raw = fin.read()
+	except OSError:
+		return None
+	return parse_loss_bytes(raw)
+
+
+def parse_loss_bytes(raw : bytes) -> Optional[np.ndarray]:
+	"""`parse_loss_file` on the contents of a file, or any run of its lines"""
+	lines = raw.split(b'\n')
+	# `split` leaves whatever follows the last newline: nothing, or an unfinished line
+	lines.pop()
+	if not lines:
+		return None
+
+	width = lines[0].count(b',')
+	if width == 0 or sum(line.count(b',') for line in lines) != width * len(lines):
+		return None
+
+	try:
+		# handles `nan`, `-nan` and `inf` as written by the trainer
+		values = np.array(b' '.join(lines).replace(b',', b' ').split(), dtype = float)
+	except ValueError:
+		return None
+	if len(values) != width * len(lines):
+		return None
+	return values.reshape(len(lines), width)
+
+
+def loss_metrics(
+		data : Optional[np.ndarray],
+		first_n : int = 5,
+		last_n : int = 5,
+		slope_n : int = 20,
+	) -> Dict[str, float]:
+	"""every metric of a loss curve (rows are batches), keyed by `LossMode`:
+	 - `'abs'` : the average loss over the `last_n` batches
+	 - `'rel'` : `'abs'` divided by the average loss over the `first_n` batches
+	 - `'slope'` : change of the batch-averaged loss per batch, fitted over the `slope_n` last batches
+	 - `'nan'` : `1.0` if the loss was ever NaN or infinite, else `0.0`
+
+	all NaN if there is no curve
+	"""
+	if data is None or len(data) == 0:
+		return { 'abs' : float('nan'), 'rel' : float('nan'), 'slope' : float('nan'), 'nan' : float('nan') }
+
+	avg_final_loss = float(np.average(data[-last_n:]))
+	loss_first = float(np.average(data[:first_n]))
+
+	curve = np.average(data[-slope_n:], axis = 1)
+	if len(curve) > 1:
+		slope = float(np.polyfit(np.arange(len(curve)), curve, 1)[0]) if np.isfinite(curve).all() else float('nan')
+	else:
+		slope = float('nan')
+
+	with np.errstate(divide = 'ignore', invalid = 'ignore'):
+		rel = avg_final_loss / loss_first
+
+	return {
+		'abs' : avg_final_loss,
+		'rel' : rel,
+		'slope' : slope,
+		'nan' : 0.0 if np.isfinite(data).all() else 1.0,
+	}
+
+
+def read_loss_metrics(filename : str, first_n : int = 5, last_n : int = 5, slope_n : int = 20) -> Dict[str, float]:
+	"""parses `filename` once and returns all of `loss_metrics`"""
+	return loss_metrics(parse_loss_file(filename), first_n, last_n, slope_n)
+
+
 def read_loss(
 		filename : str,
 		mode : LossMode = 'abs',
@@ -56,7 +166,7 @@ def read_loss(
 	### Parameters:
 	 - `filename : str`   
 	 - `mode : LossMode`   
-	   one of 'abs', 'rel'. if 'abs', returns the average loss for the `last_n` timesteps. if 'rel', returns the ratio between the average loss between `last_n` and `first_n` timesteps
+	   one of 'abs', 'rel', 'slope', 'nan', see `loss_metrics`. if 'abs', returns the average loss for the `last_n` timesteps. if 'rel', returns the ratio between the average loss between `last_n` and `first_n` timesteps
 	   (defaults to `'abs'`)
 	 - `first_n : int`   
 	   only used if loss mode is 'rel'
@@ -69,25 +179,7 @@ def read_loss(
 	 - `float` 
 	   computed average loss from `filename`
 	"""
-		
-	try:
-		data = np.genfromtxt(filename, delimiter=',')
-	except ValueError:
-		return float('nan')
-
-	try:
-		data = data[:,:-1]
-	except:
-		return float('nan')
-	
-	avg_final_loss = np.average(data[-last_n:])
-
-	if mode == 'abs':
-		return avg_final_loss
-	elif mode == 'rel':
-		# loss_first = np.average(np.amin(np.average(data[:first_n], axis = 1)))
-		loss_first = np.average(data[:first_n])
-		return avg_final_loss / loss_first
+	return read_loss_metrics(filename, first_n, last_n)[mode]
 
 
 def read_percent(filename) -> float:
@@ -171,23 +263,110 @@ def read_single_folder(directory : str, keys_map : Dict[str,str] = CONFIG_KEYS_M
 	 - `Dict[str, Any]` 
 	   [description]
 	"""
-	data = read_config(directory + 'config.txt', keys_map = keys_map)
+	return _read_folder(directory, keys_map)[0]
+
 
-	for c in LOSS_TYPES:
-		data[c] = read_loss(directory + 'loss.txt', LOSS_TYPES[c])
+def _read_folder(
+		directory : str, 
+		keys_map : Dict[str,str] = CONFIG_KEYS_MAP, 
+		curves : bool = False,
+	) -> Tuple[Dict[str, Any], Optional[np.ndarray], Optional[np.ndarray]]:
+	"""`read_single_folder`, and the loss and label curves if `curves`, for `psweep/curve_store.py`"""
+	data = read_config(directory + 'config.txt', keys_map = keys_map)
 
-	if ENABLE_TESTING_DATA:
-		data['TEST_ACCURACY'] = read_percent(directory + 'percent0.txt')
+	# `loss.txt` is parsed once for all the loss types
+	loss = parse_loss_file(directory + 'loss.txt')
+	metrics = loss_metrics(loss)
+	for c, mode in LOSS_TYPES.items():
+		if mode == 'test':
+			if ENABLE_TESTING_DATA:
+				data[c] = read_percent(directory + 'percent0.txt')
+		else:
+			data[c] = metrics[mode]
 	
 	# print('\t%s' % str(data))		
-	return data
+	if not curves:
+		return (data, None, None)
+	# `labels.txt` has the same layout as `loss.txt`
+	return (data, loss, parse_loss_file(directory + 'labels.txt'))
+
+
+
+def registry_row(directory : str, data : Dict[str, Any]) -> Dict[str, Any]:
+	"""`data` read from a run directory, with what `Registry.record_runs` needs on top
+
+	keyed by the directory name rather than the config, since runs linked from
+	the result cache carry the IDs of the run they were linked from
+	"""
+	run_ID, cfg_ID = split_dirname(directory)
+	row = dict(data, RUN_ID = run_ID, CONFIG_ID = cfg_ID, STATUS = run_status(directory))
+	for key, fname in (('STARTED', 'config.txt'), ('FINISHED', 'DONE.txt')):
+		try:
+			row[key] = os.path.getmtime(directory + fname)
+		except OSError:
+			row[key] = None
+	return row
+
+
+
+# files whose changes mark a run to be read again. `DONE.txt` because a run can
+# finish without writing to the others again
+INGEST_FILES : Tuple[str, ...] = ('loss.txt', 'percent0.txt', 'DONE.txt')
+
+INGEST_EXT : str = '.ingest'
+
+# bump when the rows extracted from a run change, so that old manifests are not used
+INGEST_VERSION : int = 2
+
+# directories handed to a reader process at a time
+READ_CHUNKSIZE : int = 64
+
+
+def ingest_key(directory : str) -> Tuple[Optional[Tuple[int, int]], ...]:
+	"""`(mtime, size)` of each of `INGEST_FILES` in `directory`, `None` for missing files"""
+	key = []
+	for fname in INGEST_FILES:
+		try:
+			st = os.stat(directory + fname)
+			key.append((st.st_mtime_ns, st.st_size))
+		except OSError:
+			key.append(None)
+	return tuple(key)
 
 
+def read_ingest_manifest(filename : str) -> Dict[str, Tuple[Any, Dict[str, Any]]]:
+	"""`{directory : (ingest_key, row)}` from `filename`, empty if missing or from an older `INGEST_VERSION`"""
+	if not os.path.isfile(filename):
+		return dict()
+	with open(filename, 'rb') as fin:
+		manifest = pickle.load(fin)
+	if manifest.get('version') != INGEST_VERSION:
+		print('> ingestion manifest %s is outdated, reading everything again' % filename)
+		return dict()
+	return manifest['runs']
+
+
+def write_ingest_manifest(filename : str, runs : Dict[str, Tuple[Any, Dict[str, Any]]]) -> None:
+	tmp = filename + '.tmp'
+	with open(tmp, 'wb') as fout:
+		pickle.dump({ 'version' : INGEST_VERSION, 'runs' : runs }, fout, protocol = pickle.HIGHEST_PROTOCOL)
+	os.replace(tmp, filename)
+
+
+def _read_folder_keyed(directory : str, curves : bool = False) -> Tuple[str, Any, Dict[str, Any], Optional[np.ndarray], Optional[np.ndarray]]:
+	"""reader process: the key is taken before reading, so a run that changes meanwhile is read again next time"""
+	key = ingest_key(directory)
+	return (directory, key, *_read_folder(directory, curves = curves))
+
 
 def read_all_data(
 		datadir : str = '../../../psweep_data/', 
 		rem_cols : List[str] = None, 
 		run_ID : str = '',
+		registry : bool = True,
+		ingest_file : Optional[str] = None,
+		n_procs : Optional[int] = None,
+		curve_store : Optional[str] = None,
 	) -> pd.DataFrame:
 	"""gets data from many different runs (matching `run_ID`) and puts them into a dataframe
 	
@@ -201,6 +380,21 @@ def read_all_data(
 	 - `run_ID : str`   
 	   used to match directories
 	   (defaults to `''`)
+	 - `registry : bool`   
+	   also write every run (status, timings and metrics) to the registry in `datadir`, see `psweep/registry.py`.
+	   with an `ingest_file`, only the runs that were read again
+	   (defaults to `True`)
+	 - `ingest_file : Optional[str]`   
+	   ingestion manifest. runs it has, whose `INGEST_FILES` did not change, are not read again.
+	   updated with the runs read. if `None`, every run is read
+	   (defaults to `None`)
+	 - `n_procs : Optional[int]`   
+	   number of reader processes. if `None`, one per core
+	   (defaults to `None`)
+	 - `curve_store : Optional[str]`   
+	   also keep the loss and label curves of the runs read in this store, see `psweep/curve_store.py`.
+	   runs the store does not have yet are read even if they did not change
+	   (defaults to `None`)
 	
 	### Returns:
 	 - `pd.DataFrame` 
@@ -208,25 +402,65 @@ def read_all_data(
 	"""
 	# get directories
 	# dirnames = [join(datadir, f) + '/' for f in listdir(datadir) if isdir(join(datadir, f)) and f[0] == sys.argv[1][0]]
-	dirnames = [ x + '/' for x in glob.glob(datadir + run_ID + '_*') if isdir(x) ]
+	# retired runs (`{run_ID}_ID{n}.killed...`) are not configs of their own
+	dirnames = sorted( x + '/' for x in glob.glob(datadir + run_ID + '_*') if isdir(x) and not is_retired(x) )
 	
 	n_total_dir = len(dirnames)
 	print('> directories found:\t%d\n' % n_total_dir)
 
-	# get columns
-	cols = CONSTS_DEFAULT_KEYS + [ s for s in LOSS_TYPES ]
-	if ENABLE_TESTING_DATA:
-		cols = cols + ['TEST_ACCURACY']
-
-	# read in data
-	data = []
-	i = 0
+	# * only read what changed since the last manifest
+	known = read_ingest_manifest(ingest_file) if ingest_file is not None else dict()
+	store = CurveStore(curve_store) if curve_store is not None else None
+	runs : Dict[str, Tuple[Any, Dict[str, Any]]] = dict()
+	to_read = []
 	for d in dirnames:
-		print('\t read: \t%d\t/\t%d' % (i,n_total_dir), end='\r')
-		data.append(read_single_folder(d))
-		i = i + 1
-
-	print('\n\n> directories read in:\t%d' % len(data))
+		if d in known and known[d][0] == ingest_key(d) and (store is None or d in store):
+			runs[d] = known[d]
+		else:
+			to_read.append(d)
+	print('> directories unchanged:\t%d\n> directories to read:\t%d' % (len(runs), len(to_read)))
+
+	# * read in data
+	fresh : Dict[str, Dict[str, Any]] = dict()
+	new_curves = []
+	if to_read:
+		n_procs = min(n_procs or os.cpu_count() or 1, len(to_read))
+		reader = partial(_read_folder_keyed, curves = store is not None)
+		if n_procs > 1:
+			pool = Pool(n_procs)
+			results = pool.imap_unordered(reader, to_read, chunksize = READ_CHUNKSIZE)
+		else:
+			pool = None
+			results = map(reader, to_read)
+
+		for i, (d, key, row, loss, labels) in enumerate(results):
+			print('\t read: \t%d\t/\t%d' % (i, len(to_read)), end='\r')
+			runs[d] = (key, row)
+			fresh[d] = row
+			if store is not None:
+				new_curves.append((d, loss, labels))
+
+		if pool is not None:
+			pool.close()
+			pool.join()
+
+	print('\n\n> directories read in:\t%d' % len(fresh))
+
+	if store is not None:
+		store.append(new_curves)
+		store.retain(dirnames)
+		if store.garbage() > COMPACT_GARBAGE:
+			store.compact()
+		print('> curve store:\t%d runs in %s' % (len(store), curve_store))
+
+	if ingest_file is not None:
+		write_ingest_manifest(ingest_file, runs)
+
+	if registry and fresh:
+		n = Registry(datadir).record_runs(registry_row(d, x) for d, x in fresh.items())
+		print('> registry:\t%d runs recorded' % n)
+
+	data = [ runs[d][1] for d in dirnames ]
 
 	# bulk write to dataframe
 	# df = pd.DataFrame( columns = cols )
@@ -242,8 +476,17 @@ def read_all_data(
 	return df	
 
 
-def read_and_save(run_ID = '', datadir = '../../../psweep_data/', file_save : Optional[str] = None, rem_cols : List[str] = None) -> pd.DataFrame:
-	"""reads runs matching `run_ID` and saves them to a pandas dataframe
+def read_and_save(
+		run_ID = '', 
+		datadir = '../../../psweep_data/', 
+		file_save : Optional[str] = None, 
+		rem_cols : List[str] = None, 
+		registry : bool = True,
+		incremental : bool = True,
+		n_procs : Optional[int] = None,
+		curves : bool = True,
+	) -> pd.DataFrame:
+	"""reads runs matching `run_ID` and saves them to a results table, see `psweep/colstore.py`
 	
 	### Parameters:
 	 - `run_ID : str`   
@@ -253,25 +496,52 @@ def read_and_save(run_ID = '', datadir = '../../../psweep_data/', file_save : Op
 	   folder in which to look for the data
 	   (defaults to `'../../../psweep_data/'`)
 	 - `file_save : Optional[str]`   
-	   where to pickle the pandas dataframe into. if no value given, set to `'data_{run_ID}.df'`
+	   table directory to save into. if it ends in `.df`, the dataframe is pickled there instead (slow,
+	   and tied to the pandas version). if no value given, set to `'data_{run_ID}.cols'`
 	   (defaults to `None`)
 	 - `rem_cols : List[str]`   
 	   columns to remove
 	   (defaults to `None`)
+	 - `registry : bool`   
+	   also record the runs in the registry, see `read_all_data`
+	   (defaults to `True`)
+	 - `incremental : bool`   
+	   keep an ingestion manifest in `{file_save}.ingest`, and only parse runs that are new or changed since
+	   the last call. if `False`, every run is read again (and the manifest rewritten)
+	   (defaults to `True`)
+	 - `n_procs : Optional[int]`   
+	   number of reader processes. if `None`, one per core
+	   (defaults to `None`)
+	 - `curves : bool`   
+	   also keep every run's loss and label curves in `data_{run_ID}.curves`, see `psweep/curve_store.py`
+	   (defaults to `True`)
 
 	### Modifies
-	 - saves the dataframe as a pickle file into `file_save`
+	 - saves the table (or the pickled dataframe) into `file_save`
+	 - saves the ingestion manifest into `{file_save}.ingest`
+	 - adds the curves of the runs read to the curve store
+	 - updates the registry in `datadir`
 	"""
 	if file_save is None:
-		file_save = f'data_{run_ID}.df'
+		file_save = f'data_{run_ID}' + TABLE_EXT
+
+	ingest_file = file_save.rstrip('/') + INGEST_EXT
+	if not incremental and os.path.isfile(ingest_file):
+		os.remove(ingest_file)
 
-	df = read_all_data(datadir, rem_cols, run_ID)
-	df.to_pickle(file_save)
+	curve_store = curves_path(file_save) if curves else None
+	df = read_all_data(datadir, rem_cols, run_ID, registry, ingest_file, n_procs, curve_store)
+	if file_save.endswith('.df'):
+		df.to_pickle(file_save)
+	else:
+		write_table(df, file_save)
+	return df
 
 
 if __name__ == "__main__":
 	import fire
-	fire.Fire(read_and_save)
+	# the returned table is for callers from python, not for printing
+	fire.Fire(read_and_save, serialize = lambda _ : None)
 
 
 
@@ -0,0 +1,214 @@
+"""top-k queries over a results table, instead of dumping the whole sorted table to text
+
+a query picks runs by a metric (`by`), best first, with range filters on any column
+(`where`, see `colstore.parse_filter`), only some columns, and a page (`k` rows from `offset`).
+only that page is read and printed or saved.
+
+## sort indexes
+the first query by a column of a table (see `psweep/colstore.py`) stores the row numbers
+of the table sorted by that column, NaN last, as `c{i}.order.npy` in the table directory.
+later queries read just the `offset + k` rows they need from the front or back of it.
+with filters, the matching rows come from `Table.mask` (zone maps and dictionary codes),
+and the order is walked only over those. `write_table` replaces the whole directory, so an
+index never outlives its table. `index` builds them ahead of time, for `LOSS_TYPES` by default.
+
+a pickled dataframe has no index, and falls back to a partial sort (`nlargest`, `nsmallest`).
+
+## usage
+    python -m psweep.query top TABLE <flags>
+    python -m psweep.query index TABLE <flags>
+"""
+
+import os
+from typing import *
+
+import numpy as np
+import pandas as pd
+
+from psweep.psweep import *
+from psweep.colstore import Table, is_table, table_path, parse_filter, match, Filter
+
+
+ORDER_EXT : str = '.order'
+
+# metrics where higher is better, all others are sorted ascending by default
+HIGHER_IS_BETTER : Tuple[str, ...] = ('TEST_ACCURACY',)
+
+
+def _order_file(table : Table, col : str) -> str:
+	return os.path.join(table.path, table.meta['columns'][col]['file'] + ORDER_EXT + '.npy')
+
+
+def order_index(table : Table, col : str, rebuild : bool = False) -> np.ndarray:
+	"""row numbers of `table` sorted by `col` ascending, NaN last. read from the table directory, or built and saved there"""
+	fname = _order_file(table, col)
+	if not rebuild and os.path.isfile(fname):
+		order = np.load(fname, mmap_mode = 'r')
+		if len(order) == len(table):
+			return order
+
+	order = np.argsort(table.column(col), kind = 'stable')
+	order = order.astype(np.uint32 if len(table) <= np.iinfo(np.uint32).max else np.int64)
+
+	meta_file = os.path.join(table.path, 'meta.json')
+	before = os.stat(meta_file).st_ino
+	tmp = fname + '.tmp.npy'
+	try:
+		np.save(tmp, order)
+		os.replace(tmp, fname)
+	except OSError:
+		# a read-only table is still queryable, just without a stored index
+		return order
+	if os.stat(meta_file).st_ino != before:
+		# the table was replaced while sorting, so this order belongs to the old one
+		os.remove(fname)
+	return order
+
+
+def n_valid(table : Table, col : str, order : np.ndarray) -> int:
+	"""number of non-NaN values of `col`, which come first in `order`"""
+	lo, hi = 0, len(order)
+	if hi == 0 or table.column(col, order[-1:]).dtype.kind != 'f':
+		return hi
+	while lo < hi:
+		mid = (lo + hi) // 2
+		if np.isnan(table.column(col, order[mid : mid + 1])[0]):
+			hi = mid
+		else:
+			lo = mid + 1
+	return lo
+
+
+def top_rows(
+		table : Table,
+		by : str,
+		k : int = 20,
+		offset : int = 0,
+		ascending : bool = False,
+		filters : Sequence[Filter] = (),
+	) -> np.ndarray:
+	"""row numbers of the page `offset : offset + k` of the rows matching `filters`, sorted by `by` (NaN never included)"""
+	order = order_index(table, by)
+	valid = order[ : n_valid(table, by, order)]
+	if not ascending:
+		valid = valid[::-1]
+
+	if not filters:
+		return np.asarray(valid[offset : offset + k], dtype = np.int64)
+
+	mask = table.mask(filters)
+	hits = np.asarray(valid)[mask[valid]]
+	return hits[offset : offset + k].astype(np.int64)
+
+
+def _top_df(df : pd.DataFrame, by : str, k : int, offset : int, ascending : bool) -> pd.DataFrame:
+	df = df.loc[ df[by].notna() ]
+	if ascending:
+		return df.nsmallest(offset + k, by).iloc[offset :]
+	return df.nlargest(offset + k, by).iloc[offset :]
+
+
+def query(
+		filename : str = 'data.cols',
+		by : str = 'TEST_ACCURACY',
+		k : int = 20,
+		offset : int = 0,
+		ascending : Optional[bool] = None,
+		where : Sequence[str] = (),
+		columns : Optional[Sequence[str]] = None,
+	) -> pd.DataFrame:
+	"""the runs ranked `offset` to `offset + k` by `by`, as a dataframe indexed by row number in the table
+
+	### Parameters:
+	 - `filename : str`
+	   results table, or pickled dataframe
+	   (defaults to `'data.cols'`)
+	 - `by : str`
+	   metric (or any column) to rank by
+	   (defaults to `'TEST_ACCURACY'`)
+	 - `k : int`
+	   (defaults to `20`)
+	 - `offset : int`
+	   (defaults to `0`)
+	 - `ascending : Optional[bool]`
+	   lowest first. if `None`, unless `by` is in `HIGHER_IS_BETTER`
+	   (defaults to `None`)
+	 - `where : Sequence[str]`
+	   only runs matching all of these, such as `'LF_OUT>=0.5'`, see `colstore.parse_filter`
+	   (defaults to `()`)
+	 - `columns : Optional[Sequence[str]]`
+	   columns to return, besides `by`. if `None`, `DIRNAME` and every key that varies in the page
+	   (defaults to `None`)
+	"""
+	if ascending is None:
+		ascending = by not in HIGHER_IS_BETTER
+	# fire passes a single flag as a string
+	if isinstance(where, str):
+		where = [ where ]
+	if isinstance(columns, str):
+		columns = [ columns ]
+	filters = [ parse_filter(w) for w in where ]
+	if not is_table(filename) and not os.path.isfile(filename) and is_table(table_path(filename)):
+		filename = table_path(filename)
+
+	if is_table(filename):
+		table = Table(filename)
+		rows = top_rows(table, by, k, offset, ascending, filters)
+		wanted = [ c for c in ([ by ] + list(columns or CONSTS_DEFAULT_KEYS)) if c in table.columns ]
+		page = pd.DataFrame(index = rows)
+		for col in dict.fromkeys(wanted):
+			data = table.column(col, rows)
+			page[col] = np.char.decode(data, 'utf-8').astype(object) if data.dtype.kind == 'S' else data
+	else:
+		df = pd.read_pickle(filename)
+		for col, op, value in filters:
+			df = df.loc[ match(df[col].to_numpy(), op, value) ]
+		page = _top_df(df, by, k, offset, ascending)
+
+	if columns is None:
+		columns = [ 'DIRNAME' ] + [
+			c for c in CONSTS_DEFAULT_KEYS
+			if c not in CONSTS_DEFAULT_KEYS_META and c in page.columns and page[c].nunique() > 1
+		]
+	columns = [ by ] + [ c for c in columns if c != by and c in page.columns ]
+	return page[columns]
+
+
+def top(
+		filename : str = 'data.cols',
+		by : str = 'TEST_ACCURACY',
+		k : int = 20,
+		offset : int = 0,
+		ascending : Optional[bool] = None,
+		where : Sequence[str] = (),
+		columns : Optional[Sequence[str]] = None,
+		save_path : Optional[str] = None,
+	) -> None:
+	"""prints (or saves, as csv if `save_path` ends in `.csv`, else as text) one page of a leaderboard, see `query`"""
+	page = query(filename, by, k, offset, ascending, where, columns)
+	page.insert(0, 'RANK', np.arange(offset + 1, offset + 1 + len(page)))
+	if save_path is None:
+		print(page.to_string(index = False))
+	elif save_path.endswith('.csv'):
+		page.to_csv(save_path, index = False)
+	else:
+		with open(save_path, 'w') as fout:
+			print(page.to_string(index = False), file = fout)
+
+
+def index(filename : str = 'data.cols', columns : Optional[Sequence[str]] = None, rebuild : bool = False) -> None:
+	"""builds the sort indexes of a table for `columns` (the `LOSS_TYPES` in it, by default), see the module docstring"""
+	table = Table(table_path(filename))
+	if isinstance(columns, str):
+		columns = [ columns ]
+	for col in (columns or [ c for c in LOSS_TYPES if c in table.columns ]):
+		order_index(table, col, rebuild = rebuild)
+		print('> indexed %s' % col)
+
+
+if __name__ == '__main__':
+	import fire
+	fire.Fire({
+		'top' : top,
+		'index' : index,
+	}, serialize = lambda _ : None)
@@ -0,0 +1,385 @@
+"""sqlite registry of every config of every sweep: where it is, and how it went
+
+config state used to be spread over the manifests, slurm, `DONE.txt` files and
+pickled dataframes, and every tool found it again by scanning directories. the
+registry keeps it in one table, `configs`, in `{datadir}registry.sqlite`:
+ - `run_ID`, `cfg_ID` : the key. grid sweeps number their configs from 0 in every run, so `CONFIG_ID` alone is not unique
+ - `cfg_hash` : `gen_configs.config_hash`, the same hyperparameters under any run ID
+ - `status` : `'created'` by `gen_configs` or the nevergrad sweep, `'submitted'` once it has a job,
+   then one of the `result_cache.run_status` statuses: `'running'`, `'done'`, `'failed'`, `'pruned'` or `'stale'`.
+   `'rejected'` if it was never submitted because it fits on no partition, see `psweep/resources.py`
+ - `job_id` : slurm job id, if it was submitted to slurm
+ - `created`, `submitted`, `started`, `finished` : unix times. `runtime` is `finished - started`
+ - `test_accuracy`, `loss_abs`, `loss_rel` : final metrics, see `METRICS`
+ - `params` : json of the config values that differ from `CONSTS_DEFAULT`, to keep rows small
+
+the database is in WAL mode, so the loader and the sweeps can read while
+another process writes. every method is one transaction.
+
+## usage
+    python -m psweep.registry COMMAND <flags>
+
+COMMAND is one of `counts`, `pending`, `top`, `sync`, see the methods of `Registry`
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import *
+
+from psweep.psweep import *
+from psweep.gen_configs import config_hash
+from psweep.result_cache import run_status
+
+
+REGISTRY_FILE : str = 'registry.sqlite'
+
+# psweep column -> registry column
+METRICS : Dict[str, str] = {
+	'TEST_ACCURACY' : 'test_accuracy',
+	'LOSS_ABS' : 'loss_abs',
+	'LOSS_REL' : 'loss_rel',
+}
+
+# configs that are not finished and not known to be dead
+PENDING_STATUSES : Tuple[str, ...] = ('created', 'submitted', 'running')
+# statuses that do not change anymore
+FINAL_STATUSES : Tuple[str, ...] = ('done', 'failed', 'pruned')
+
+# rows inserted or updated per `executemany`
+BATCH_SIZE : int = 10000
+
+SCHEMA : str = '''
+CREATE TABLE IF NOT EXISTS configs (
+	run_ID TEXT NOT NULL,
+	cfg_ID TEXT NOT NULL,
+	cfg_hash TEXT,
+	status TEXT NOT NULL DEFAULT 'created',
+	job_id TEXT,
+	created REAL,
+	submitted REAL,
+	started REAL,
+	finished REAL,
+	runtime REAL,
+	test_accuracy REAL,
+	loss_abs REAL,
+	loss_rel REAL,
+	params TEXT,
+	PRIMARY KEY (run_ID, cfg_ID)
+);
+CREATE INDEX IF NOT EXISTS idx_configs_run_status ON configs (run_ID, status, test_accuracy);
+CREATE INDEX IF NOT EXISTS idx_configs_status ON configs (status, test_accuracy);
+CREATE INDEX IF NOT EXISTS idx_configs_hash ON configs (cfg_hash);
+'''
+
+
+def registry_path(datadir : str = '../../psweep_data/') -> str:
+	return os.path.join(datadir, REGISTRY_FILE)
+
+
+def split_dirname(dirname : str) -> Tuple[str, str]:
+	"""`(run_ID, cfg_ID)` of a run directory named `{run_ID}_ID{cfg_ID}`"""
+	name = os.path.basename(os.path.normpath(dirname))
+	run_ID, _, cfg_ID = name.rpartition('_ID')
+	return (run_ID, cfg_ID)
+
+
+def changed_params(
+		config : Dict[str, Any],
+		default_data : cn_Dict = CONSTS_DEFAULT,
+	) -> str:
+	"""json of the values of `config` that differ from `default_data`, leaving out `RUN_ID`, `CONFIG_ID` and `DIRNAME`"""
+	changed = dict()
+	for k, v in config.items():
+		if k in CONSTS_DEFAULT_KEYS_META or k not in default_data:
+			continue
+		try:
+			same = type(default_data[k])(float(v)) == default_data[k]
+		except (TypeError, ValueError):
+			same = str(v) == str(default_data[k])
+		if not same:
+			changed[k] = v
+	return json.dumps(changed, sort_keys = True)
+
+
+def _read_accuracy(dirname : str) -> Optional[float]:
+	"""final test accuracy from the last line of `percent0.txt`, like `psweep_load.read_percent`"""
+	try:
+		with open(os.path.join(dirname, 'percent0.txt'), 'r') as fin:
+			return float(fin.readlines()[-1].split('\t')[-1])
+	except (OSError, IndexError, ValueError):
+		return None
+
+
+class Registry(object):
+	"""the registry in `{datadir}registry.sqlite`, see the module docstring
+
+	safe to share between the threads of a process, and between processes
+
+	### Parameters:
+	 - `datadir : str`
+	   where the run directories are
+	   (defaults to `'../../psweep_data/'`)
+	 - `timeout : float`
+	   seconds to wait for another process to finish writing
+	   (defaults to `60.0`)
+	"""
+
+	def __init__(self, datadir : str = '../../psweep_data/', timeout : float = 60.0):
+		self.datadir = datadir
+		self.filename = registry_path(datadir)
+		# the trainer creates the data directory with its first run, which may not have happened yet
+		os.makedirs(datadir, exist_ok = True)
+		self._lock = threading.Lock()
+		self._conn = sqlite3.connect(self.filename, timeout = timeout, check_same_thread = False)
+		self._conn.row_factory = sqlite3.Row
+		self._conn.execute('PRAGMA journal_mode=WAL')
+		self._conn.execute('PRAGMA synchronous=NORMAL')
+		with self._lock, self._conn:
+			self._conn.executescript(SCHEMA)
+
+	def close(self) -> None:
+		self._conn.close()
+
+	def _write(self, sql : str, rows : Iterable[Sequence[Any]]) -> int:
+		"""runs `sql` for every row, in batches of `BATCH_SIZE`, all in one transaction. returns the number of rows changed"""
+		n = 0
+		batch : List[Sequence[Any]] = []
+		with self._lock, self._conn:
+			for row in rows:
+				batch.append(row)
+				if len(batch) >= BATCH_SIZE:
+					n += self._conn.executemany(sql, batch).rowcount
+					batch = []
+			if batch:
+				n += self._conn.executemany(sql, batch).rowcount
+		return n
+
+	def _read(self, sql : str, args : Sequence[Any] = ()) -> List[sqlite3.Row]:
+		with self._lock:
+			return self._conn.execute(sql, args).fetchall()
+
+	# * writing
+
+	def add_configs(
+			self,
+			run_ID : str,
+			configs : Iterable[Dict[str, Any]],
+			default_data : cn_Dict = CONSTS_DEFAULT,
+		) -> int:
+		"""registers configs as `'created'`, keyed by their `CONFIG_ID`. configs already registered are left alone
+
+		`configs` can be a generator. returns the number of new configs
+		"""
+		now = time.time()
+		return self._write(
+			'INSERT OR IGNORE INTO configs (run_ID, cfg_ID, cfg_hash, status, created, params) VALUES (?, ?, ?, ?, ?, ?)',
+			(
+				(run_ID, str(c['CONFIG_ID']), config_hash(c, default_data), 'created', now, changed_params(c, default_data))
+				for c in configs
+			),
+		)
+
+	def submitted(self, run_ID : str, job_ids : Dict[str, str]) -> int:
+		"""marks configs as `'submitted'`, with the slurm job id of each. configs that finished meanwhile are left alone"""
+		now = time.time()
+		return self._write(
+			'UPDATE configs SET status = ?, job_id = ?, submitted = ? WHERE run_ID = ? AND cfg_ID = ? AND status IN (%s)'
+				% ', '.join('?' * len(PENDING_STATUSES + ('stale', 'rejected'))),
+			(
+				('submitted', job_id, now, run_ID, str(cfg_ID)) + PENDING_STATUSES + ('stale', 'rejected')
+				for cfg_ID, job_id in job_ids.items()
+			),
+		)
+
+	def set_status(
+			self,
+			run_ID : str,
+			cfg_ID : str,
+			status : str,
+			cfg_hash : Optional[str] = None,
+			**fields : Any,
+		) -> None:
+		"""sets the status of one config, registering it if needed, along with any other columns in `fields`"""
+		columns = dict(fields, status = status)
+		if cfg_hash is not None:
+			columns['cfg_hash'] = cfg_hash
+		names = list(columns)
+		with self._lock, self._conn:
+			self._conn.execute(
+				'INSERT OR IGNORE INTO configs (run_ID, cfg_ID, created) VALUES (?, ?, ?)',
+				(run_ID, str(cfg_ID), time.time()),
+			)
+			self._conn.execute(
+				'UPDATE configs SET %s WHERE run_ID = ? AND cfg_ID = ?' % ', '.join('%s = ?' % k for k in names),
+				[ columns[k] for k in names ] + [ run_ID, str(cfg_ID) ],
+			)
+
+	def record_runs(
+			self,
+			runs : Iterable[Dict[str, Any]],
+			default_data : cn_Dict = CONSTS_DEFAULT,
+		) -> int:
+		"""upserts runs read from their directories (rows of `psweep_load.read_all_data`)
+
+		every run needs `RUN_ID` and `CONFIG_ID`. `STATUS`, `STARTED` and `FINISHED`
+		are used if present, as are the columns of `METRICS`. returns the number of runs written
+		"""
+		metric_cols = list(METRICS.values())
+		sql = (
+			'INSERT INTO configs (run_ID, cfg_ID, cfg_hash, status, created, started, finished, runtime, params, %s) '
+			'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, %s) '
+			'ON CONFLICT (run_ID, cfg_ID) DO UPDATE SET '
+			'cfg_hash = excluded.cfg_hash, status = excluded.status, started = excluded.started, '
+			'finished = excluded.finished, runtime = excluded.runtime, params = excluded.params, %s'
+		) % (
+			', '.join(metric_cols),
+			', '.join('?' * len(metric_cols)),
+			', '.join('%s = excluded.%s' % (k, k) for k in metric_cols),
+		)
+
+		def rows() -> Iterator[Tuple[Any, ...]]:
+			now = time.time()
+			for r in runs:
+				started, finished = r.get('STARTED', None), r.get('FINISHED', None)
+				runtime = finished - started if started is not None and finished is not None else None
+				try:
+					cfg_hash = config_hash(r, default_data)
+				except (KeyError, ValueError):
+					cfg_hash = None
+				yield (
+					str(r['RUN_ID']), str(r['CONFIG_ID']), cfg_hash, r.get('STATUS', 'done'), now,
+					started, finished, runtime, changed_params(r, default_data),
+				) + tuple(_nan_to_none(r.get(k, None)) for k in METRICS)
+
+		return self._write(sql, rows())
+
+	def sync(self, run_ID : Optional[str] = None, stale_after : float = 3600.0) -> int:
+		"""re-checks the run directories of unfinished configs only, see `result_cache.run_status`
+
+		finished runs get their final accuracy and timings. configs without a run directory
+		are left alone. returns the number of configs whose status changed
+		"""
+		where, args = self._where(run_ID, PENDING_STATUSES + ('stale',))
+		rows = self._read('SELECT run_ID, cfg_ID, status FROM configs ' + where, args)
+
+		updates = []
+		for r in rows:
+			dirname = os.path.join(self.datadir, '%s_ID%s' % (r['run_ID'], r['cfg_ID']))
+			if not os.path.isdir(dirname):
+				continue
+			status = run_status(dirname, stale_after)
+			if status == r['status']:
+				continue
+
+			started = _mtime(os.path.join(dirname, 'config.txt'))
+			finished = _mtime(os.path.join(dirname, 'DONE.txt'))
+			runtime = finished - started if started is not None and finished is not None else None
+			accuracy = _read_accuracy(dirname) if status == 'done' else None
+			updates.append((status, started, finished, runtime, accuracy, r['run_ID'], r['cfg_ID']))
+
+		return self._write(
+			'UPDATE configs SET status = ?, started = ?, finished = ?, runtime = ?, '
+			'test_accuracy = COALESCE(?, test_accuracy) WHERE run_ID = ? AND cfg_ID = ?',
+			updates,
+		)
+
+	# * queries
+
+	def _where(self, run_ID : Optional[str], statuses : Optional[Sequence[str]] = None) -> Tuple[str, List[Any]]:
+		clauses, args = [], []
+		if run_ID is not None:
+			clauses.append('run_ID = ?')
+			args.append(run_ID)
+		if statuses is not None:
+			clauses.append('status IN (%s)' % ', '.join('?' * len(statuses)))
+			args.extend(statuses)
+		return ('WHERE ' + ' AND '.join(clauses) if clauses else '', args)
+
+	def counts(self, run_ID : Optional[str] = None) -> Dict[str, int]:
+		"""number of configs in each status"""
+		where, args = self._where(run_ID)
+		return {
+			r['status'] : r['n']
+			for r in self._read('SELECT status, COUNT(*) AS n FROM configs %s GROUP BY status' % where, args)
+		}
+
+	def pending(self, run_ID : Optional[str] = None, statuses : Sequence[str] = PENDING_STATUSES) -> List[Tuple[str, str]]:
+		"""`(run_ID, cfg_ID)` of every config that is not finished yet (by default)"""
+		where, args = self._where(run_ID, statuses)
+		return [ (r['run_ID'], r['cfg_ID']) for r in self._read('SELECT run_ID, cfg_ID FROM configs ' + where, args) ]
+
+	def status(self, run_ID : str, cfg_ID : str) -> Optional[str]:
+		rows = self._read('SELECT status FROM configs WHERE run_ID = ? AND cfg_ID = ?', (run_ID, str(cfg_ID)))
+		return rows[0]['status'] if rows else None
+
+	def top(
+			self,
+			k : int = 20,
+			metric : str = 'test_accuracy',
+			run_ID : Optional[str] = None,
+			ascending : bool = False,
+		) -> List[Dict[str, Any]]:
+		"""the `k` finished configs with the best `metric` (highest, unless `ascending`)
+
+		`metric` is a column of the registry or a key of `METRICS`. `params` is decoded from json
+		"""
+		metric = METRICS.get(metric, metric)
+		if metric not in METRICS.values() and metric != 'runtime':
+			raise ValueError('unknown metric %s, expected one of %s' % (metric, str(list(METRICS.values()) + ['runtime'])))
+
+		where, args = self._where(run_ID, ('done',))
+		rows = self._read(
+			'SELECT * FROM configs %s AND %s IS NOT NULL ORDER BY %s %s LIMIT ?'
+				% (where, metric, metric, 'ASC' if ascending else 'DESC'),
+			args + [ k ],
+		)
+		return [ dict(r, params = json.loads(r['params'] or '{}')) for r in rows ]
+
+	def lookup_hash(self, cfg_hash : str) -> List[Dict[str, Any]]:
+		"""every config with these hyperparameters, under any run ID"""
+		return [ dict(r) for r in self._read('SELECT * FROM configs WHERE cfg_hash = ?', (cfg_hash,)) ]
+
+
+def _mtime(filename : str) -> Optional[float]:
+	try:
+		return os.path.getmtime(filename)
+	except OSError:
+		return None
+
+
+def _nan_to_none(x : Any) -> Any:
+	"""sqlite stores nan as NULL anyway, but only for floats"""
+	try:
+		return None if x is None or x != x else float(x)
+	except (TypeError, ValueError):
+		return None
+
+
+def counts(run_ID : Optional[str] = None, datadir : str = '../../psweep_data/') -> Dict[str, int]:
+	return Registry(datadir).counts(run_ID)
+
+
+def pending(run_ID : Optional[str] = None, datadir : str = '../../psweep_data/') -> List[str]:
+	return [ '%s_ID%s' % p for p in Registry(datadir).pending(run_ID) ]
+
+
+def top(k : int = 20, metric : str = 'test_accuracy', run_ID : Optional[str] = None, datadir : str = '../../psweep_data/') -> None:
+	for r in Registry(datadir).top(k, metric, run_ID):
+		print('%s_ID%s\t%s\t%s' % (r['run_ID'], r['cfg_ID'], str(r[METRICS.get(metric, metric)]), json.dumps(r['params'])))
+
+
+def sync(run_ID : Optional[str] = None, datadir : str = '../../psweep_data/') -> int:
+	return Registry(datadir).sync(run_ID)
+
+
+if __name__ == '__main__':
+	import fire
+	fire.Fire({
+		'counts' : counts,
+		'pending' : pending,
+		'top' : top,
+		'sync' : sync,
+	})
@@ -0,0 +1,302 @@
+"""predicts the memory and runtime of a config before it is submitted, and picks the slurm resources for it
+
+## memory
+the trainer holds, in `Float`s (4 bytes, see `defines.h`):
+ - `m_dCdW1_inc_parts` : one `N_LAYER_1 x N_LAYER_0` matrix per output neuron, `N_LAYER_2 * N_LAYER_1 * N_LAYER_0`
+ - the `delta` vectors of the neurons: `N_LAYER_0` per hidden neuron, `2 * N_LAYER_1`
+   (`delta` and `delta_T`) per output neuron, all twice because of `m_X1_init` and `m_X2_init`
+ - the spike trains `m_inp` and `m_winp`: `(N_LAYER_0 + N_LAYER_1) * SIM_STEPS`
+ - the weights `W1`, `W2`, their velocities and gradients
+on top of a fixed base (the process, and MNIST, which every run reads into memory).
+
+the predicted peak is `base_mb + scale * (sum of the terms)`. `base_mb` and `scale`
+start out as a guess, `calibrate` fits them to the `MaxRSS` that slurm reports for
+finished jobs (found through the registry, see `psweep/registry.py`), and saves
+them to `{datadir}resources.json`. a job runs its configs one after another in
+a single worker, so its peak is the largest peak of its configs.
+
+## runtime
+from `psweep/cost_model.py`. a job takes the sum of the runtimes of its configs.
+
+## admission
+`admit` picks the first of `PARTITIONS` where a job fits: memory (times `MEM_SAFETY`,
+rounded up to one of `MEM_BUCKETS_MB`), cores, and `--time`. configs that do not fit
+anywhere are rejected before submission, instead of being killed hours in.
+
+## usage
+    python -m psweep.resources calibrate <flags>
+    python -m psweep.resources estimate RUN_ID <flags>
+"""
+
+import os
+import json
+import math
+import shlex
+import subprocess
+from typing import *
+
+import numpy as np
+
+from psweep.psweep import *
+from psweep.cost_model import CostModel, load_model, time_limit, format_minutes, TIME_BUCKETS
+
+
+# size of `Float` in `defines.h`, 8 if compiled with `__USE_DOUBLE__`
+FLOAT_BYTES : int = 4
+
+CALIBRATION_FILE : str = 'resources.json'
+
+# before calibration: megabytes for the process and MNIST, and the factor on the formulas
+PRIOR_BASE_MB : float = 150.0
+PRIOR_SCALE : float = 1.0
+
+# the predicted peak is multiplied by this before picking a memory request
+MEM_SAFETY : float = 1.2
+
+# memory handed out to jobs, in megabytes
+MEM_BUCKETS_MB : Tuple[int, ...] = tuple(1024 * 2**k for k in range(12))
+
+# cores per job, as in `myJobArray.sh` and `myJobIndividual.sh`
+DEFAULT_CPUS : int = 8
+
+SACCT_CMD : str = 'sacct'
+
+
+class Partition(NamedTuple):
+	name : str
+	mem_per_node_mb : int
+	cpus_per_node : int
+	max_minutes : int
+
+
+# MODIFY ME: tried in order, a job goes to the first one it fits in
+PARTITIONS : Tuple[Partition, ...] = (
+	Partition('standard', 180 * 1024, 36, 14 * 24 * 60),
+	Partition('largemem', 1500 * 1024, 36, 14 * 24 * 60),
+)
+
+
+class Request(NamedTuple):
+	"""slurm resources of a job. `minutes` is `None` to keep the `--time` of the job script"""
+	partition : str
+	mem_per_cpu_mb : int
+	minutes : Optional[int]
+
+
+def memory_terms(config : Dict[str, Any]) -> Dict[str, float]:
+	"""bytes taken by the largest allocations of the trainer, see the module docstring"""
+	n0, n1, n2 = (float(config['N_LAYER_%d' % i]) for i in range(3))
+	steps = float(config['SIM_STEPS'])
+
+	return {
+		'dCdW1_inc_parts' : FLOAT_BYTES * n2 * n1 * n0,
+		'deltas' : FLOAT_BYTES * 2 * (n1 * n0 + n2 * 2 * n1),
+		'spiketrains' : FLOAT_BYTES * (n0 + n1) * steps,
+		'weights' : FLOAT_BYTES * (3 * n1 * n0 + 4 * n2 * n1),
+	}
+
+
+def read_calibration(datadir : str = '../../psweep_data/') -> Dict[str, Any]:
+	"""the calibration saved by `calibrate`, or the prior"""
+	filename = os.path.join(datadir, CALIBRATION_FILE)
+	if os.path.isfile(filename):
+		with open(filename, 'r') as fin:
+			return json.load(fin)
+	return { 'base_mb' : PRIOR_BASE_MB, 'scale' : PRIOR_SCALE, 'n_observed' : 0 }
+
+
+def write_calibration(calibration : Dict[str, Any], datadir : str = '../../psweep_data/') -> None:
+	filename = os.path.join(datadir, CALIBRATION_FILE)
+	with open(filename + '.tmp', 'w') as fout:
+		json.dump(calibration, fout, indent = '\t')
+	os.replace(filename + '.tmp', filename)
+
+
+def mem_bucket(mb : float, buckets : Sequence[int] = MEM_BUCKETS_MB) -> Optional[int]:
+	"""smallest of `buckets` that holds `mb`, `None` if none does"""
+	for b in sorted(buckets):
+		if b >= mb:
+			return b
+	return None
+
+
+def admit(
+		mem_mb : float,
+		seconds : float,
+		cpus : int = DEFAULT_CPUS,
+		with_time : bool = True,
+		time_safety : float = 1.5,
+		mem_safety : float = MEM_SAFETY,
+		partitions : Sequence[Partition] = PARTITIONS,
+	) -> Tuple[Optional[Request], str]:
+	"""resources for a job with a predicted peak of `mem_mb` and a runtime of `seconds`
+
+	### Returns:
+	 - `Tuple[Optional[Request], str]`
+	   the request, or `None` and the reason if the job fits in none of `partitions`
+	"""
+	mem = mem_bucket(mem_mb * mem_safety)
+	if mem is None or mem > max(p.mem_per_node_mb for p in partitions):
+		return (None, 'needs %.0f MB, more than any partition has' % (mem_mb * mem_safety))
+	if seconds * time_safety / 60.0 > max(p.max_minutes for p in partitions):
+		return (None, 'needs %.1f h, longer than any partition allows' % (seconds * time_safety / 3600.0))
+
+	minutes = time_limit(seconds, time_safety, TIME_BUCKETS + tuple(p.max_minutes for p in partitions))
+	for p in partitions:
+		if mem <= p.mem_per_node_mb and cpus <= p.cpus_per_node and minutes <= p.max_minutes:
+			return (Request(p.name, math.ceil(mem / cpus), minutes if with_time else None), '')
+
+	return (None, 'no partition has %d cores, %d MB and %d minutes' % (cpus, mem, minutes))
+
+
+def sbatch_args(request : Request) -> List[str]:
+	"""`sbatch` flags for `request`. `--mem-per-cpu` overrides the one in the job scripts"""
+	args = [ '--partition=' + request.partition, '--mem-per-cpu=%dM' % request.mem_per_cpu_mb ]
+	if request.minutes is not None:
+		args.append('--time=' + format_minutes(request.minutes))
+	return args
+
+
+class ResourceModel(object):
+	"""memory and runtime predictions, and the resulting slurm requests
+
+	### Parameters:
+	 - `datadir : str`
+	   where the calibration and the finished runs for the cost model are
+	   (defaults to `'../../psweep_data/'`)
+	 - `cost_model : Optional[CostModel]`
+	   if `None`, fitted on the finished runs in `datadir`, see `cost_model.load_model`
+	   (defaults to `None`)
+	"""
+
+	def __init__(self, datadir : str = '../../psweep_data/', cost_model : Optional[CostModel] = None):
+		self.calibration = read_calibration(datadir)
+		self.cost_model = cost_model if cost_model is not None else load_model(datadir)
+		print('> memory model:\tbase %.0f MB, scale %.2f, calibrated on %d jobs' % (
+			self.calibration['base_mb'], self.calibration['scale'], self.calibration['n_observed'],
+		))
+
+	def memory_mb(self, config : Dict[str, Any]) -> float:
+		"""predicted peak memory of `config`, in megabytes"""
+		raw = sum(memory_terms(config).values()) / 2**20
+		return self.calibration['base_mb'] + self.calibration['scale'] * raw
+
+	def runtime(self, config : Dict[str, Any]) -> float:
+		"""predicted runtime of `config`, in seconds"""
+		return self.cost_model.predict(config)
+
+	def request(
+			self,
+			configs : Sequence[Dict[str, Any]],
+			cpus : int = DEFAULT_CPUS,
+			with_time : bool = True,
+			time_safety : float = 1.5,
+			mem_safety : float = MEM_SAFETY,
+		) -> Tuple[Optional[Request], str]:
+		"""resources for a job running `configs` one after another, see `admit`"""
+		return admit(
+			max(self.memory_mb(c) for c in configs),
+			sum(self.runtime(c) for c in configs),
+			cpus, with_time, time_safety, mem_safety,
+		)
+
+
+def parse_rss(value : str) -> Optional[float]:
+	"""megabytes from a `MaxRSS` of `sacct`, such as `1234K` or `1.5G`"""
+	value = value.strip()
+	if not value:
+		return None
+	units = { 'K' : 2**-10, 'M' : 1.0, 'G' : 2**10, 'T' : 2**20 }
+	if value[-1] in units:
+		return float(value[:-1]) * units[value[-1]]
+	# plain bytes
+	return float(value) / 2**20
+
+
+def sacct_max_rss(job_ids : Sequence[str], sacct_cmd : str = SACCT_CMD, chunk : int = 500) -> Dict[str, float]:
+	"""peak memory (MB) of every job that `sacct` still knows about, over all of its steps"""
+	peak : Dict[str, float] = dict()
+	for k in range(0, len(job_ids), chunk):
+		cmd = shlex.split(sacct_cmd) + [ '-n', '-P', '--format=JobID,MaxRSS', '-j', ','.join(job_ids[k : k + chunk]) ]
+		proc = subprocess.run(cmd, stdout = subprocess.PIPE, stderr = subprocess.PIPE, universal_newlines = True)
+		if proc.returncode != 0:
+			raise OSError('%s failed:\n%s' % (' '.join(cmd), proc.stderr))
+
+		for line in proc.stdout.splitlines():
+			job, _, rss = line.partition('|')
+			# steps are `<job id>.<step>`
+			job = job.split('.')[0]
+			mb = parse_rss(rss)
+			if mb is not None:
+				peak[job] = max(peak.get(job, 0.0), mb)
+	return peak
+
+
+def calibrate(
+		datadir : str = '../../psweep_data/',
+		sacct_cmd : str = SACCT_CMD,
+		max_jobs : int = 2000,
+	) -> Dict[str, Any]:
+	"""fits `base_mb` and `scale` to the peak memory of finished slurm jobs, and saves them
+
+	jobs and their configs come from the registry. jobs that ran several configs
+	are compared with the largest of them
+	"""
+	from psweep.registry import Registry
+
+	rows = Registry(datadir)._read(
+		# other backends record their name instead of a slurm job id
+		"SELECT job_id, params FROM configs WHERE status = 'done' AND job_id GLOB '[0-9]*' "
+		"ORDER BY finished DESC LIMIT ?",
+		(max_jobs * 4,),
+	)
+	raw : Dict[str, float] = dict()
+	for r in rows:
+		config = { **CONSTS_DEFAULT, **json.loads(r['params'] or '{}') }
+		raw[r['job_id']] = max(raw.get(r['job_id'], 0.0), sum(memory_terms(config).values()) / 2**20)
+	job_ids = list(raw)[:max_jobs]
+
+	peak = sacct_max_rss(job_ids, sacct_cmd) if job_ids else dict()
+	x = np.array([ raw[j] for j in job_ids if j in peak ])
+	y = np.array([ peak[j] for j in job_ids if j in peak ])
+
+	calibration = read_calibration(datadir)
+	if len(y) >= 2 and np.ptp(x) > 0:
+		scale, base = np.polyfit(x, y, 1)
+		if scale <= 0 or base < 0:
+			# not enough spread to tell the two apart, keep the base and fit the scale
+			base = calibration['base_mb']
+			scale = max(float(np.sum((y - base) * x) / np.sum(x * x)), PRIOR_SCALE)
+		calibration = { 'base_mb' : float(base), 'scale' : float(scale), 'n_observed' : int(len(y)) }
+	elif len(y):
+		calibration = { 'base_mb' : float(max(y.max() - calibration['scale'] * x.max(), 0.0)), 'scale' : calibration['scale'], 'n_observed' : int(len(y)) }
+
+	write_calibration(calibration, datadir)
+	print('> memory model:\tbase %.0f MB, scale %.2f, from %d jobs' % (calibration['base_mb'], calibration['scale'], calibration['n_observed']))
+	return calibration
+
+
+def estimate(
+		run_ID : str,
+		path : str = 'psweep/config/',
+		datadir : str = '../../psweep_data/',
+		cpus : int = DEFAULT_CPUS,
+	) -> None:
+	"""prints the predicted memory, runtime and slurm request of every config of `run_ID`"""
+	from psweep.manifest import ConfigStore
+
+	model = ResourceModel(datadir)
+	for c in ConfigStore(run_ID, path):
+		request, reason = model.request([ c ], cpus)
+		print('%s\t%8.0f MB\t%8.2f h\t%s' % (
+			c['CONFIG_ID'], model.memory_mb(c), model.runtime(c) / 3600.0,
+			' '.join(sbatch_args(request)) if request is not None else 'REJECTED: ' + reason,
+		))
+
+
+if __name__ == '__main__':
+	import fire
+	fire.Fire({
+		'calibrate' : calibrate,
+		'estimate' : estimate,
+	})
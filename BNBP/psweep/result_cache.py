@@ -0,0 +1,246 @@
+"""content-addressed cache of finished runs
+
+runs are keyed by `gen_configs.config_hash`, which ignores `RUN_ID`, `CONFIG_ID`
+and `DIRNAME`, so the same hyperparameters proposed again -- by a restarted
+optimizer, a re-run grid, or a repeated nevergrad proposal -- are answered from
+the run directory that already exists in `psweep_data`.
+
+the index is an append-only text file `result_cache.tsv` in the data directory,
+one `hash \t status \t dirname` line per entry, later lines overriding earlier ones.
+
+## policy
+the status of a run directory is one of:
+ - `'done'` : `DONE.txt` exists and `percent0.txt` has a final accuracy. always reused
+ - `'failed'` : `DONE.txt` exists but there is no usable accuracy.
+   re-run if `on_failed == 'retry'`, reused if `on_failed == 'reuse'`
+ - `'running'` : no `DONE.txt`, but the directory was written to within `stale_after` seconds.
+   not resubmitted -- callers should wait on that directory instead
+ - `'pruned'` : stopped early by successive halving (`PRUNED.txt` exists). reused, reported as failed
+ - `'stale'` : no `DONE.txt` and no recent writes, the run was most likely killed. re-run.
+   runs known to be dead (see `retire_run`) are stale right away
+"""
+
+import os
+import re
+import time
+from typing import *
+
+from psweep.psweep import *
+from psweep.gen_configs import config_hash
+
+
+CACHE_INDEX_FILE : str = 'result_cache.tsv'
+
+# written into a run directory when the run is stopped early, see `psweep/halving.py`
+PRUNED_FILE : str = 'PRUNED.txt'
+# written into a run directory that is known to be dead, see `retire_run`
+KILLED_FILE : str = 'KILLED.txt'
+
+CacheStatus = Literal['done', 'failed', 'pruned', 'running', 'stale']
+
+# statuses that can not change anymore, these are never re-checked
+FINAL_STATUSES : Set[str] = { 'done', 'failed', 'pruned' }
+
+
+def read_config_strings(filename : str) -> Dict[str, str]:
+	"""reads `<key> = <value>` lines into a dict of strings, without any casting"""
+	cfg : Dict[str, str] = dict()
+	with open(filename, 'r') as fin:
+		for line in fin:
+			parts = line.split()
+			if len(parts) == 3:
+				cfg[parts[0]] = parts[2]
+	return cfg
+
+
+def run_status(dirname : str, stale_after : float = 3600.0) -> CacheStatus:
+	"""classifies a run directory, see the module docstring"""
+	if os.path.isfile(os.path.join(dirname, 'DONE.txt')):
+		try:
+			with open(os.path.join(dirname, 'percent0.txt'), 'r') as fin:
+				lines = fin.readlines()
+			float(lines[-1].split('\t')[-1])
+			return 'done'
+		except (OSError, IndexError, ValueError):
+			return 'failed'
+
+	if os.path.isfile(os.path.join(dirname, PRUNED_FILE)):
+		return 'pruned'
+
+	if not os.path.isdir(dirname) or os.path.isfile(os.path.join(dirname, KILLED_FILE)):
+		return 'stale'
+
+	# the trainer appends to `loss.txt` after every batch
+	try:
+		last_write = max(
+			os.path.getmtime(os.path.join(dirname, f))
+			for f in ('loss.txt', 'config.txt')
+			if os.path.isfile(os.path.join(dirname, f))
+		)
+	except ValueError:
+		last_write = os.path.getmtime(dirname)
+
+	if time.time() - last_write < stale_after:
+		return 'running'
+	return 'stale'
+
+
+def retire_run(dirname : str) -> str:
+	"""marks an unfinished run as dead and moves it out of the way, so that it can be re-run
+
+	the trainer appends to the files in its run directory, so re-running into
+	the partial output of a killed run would mix the two. returns the new location
+	"""
+	dirname = os.path.normpath(dirname)
+	with open(os.path.join(dirname, KILLED_FILE), 'w') as fout:
+		print('killed\t%d' % time.time(), file = fout)
+
+	dst = '%s.killed%d' % (dirname, time.time())
+	os.rename(dirname, dst)
+	return dst + '/'
+
+
+def is_retired(dirname : str) -> bool:
+	"""whether `dirname` is an earlier attempt moved out of the way by `retire_run`, not a run of its own"""
+	return (
+		re.search(r'\.killed\d+$', os.path.normpath(dirname)) is not None
+		or os.path.isfile(os.path.join(dirname, KILLED_FILE))
+	)
+
+
+def clear_run_dir(dirname : str) -> None:
+	"""makes way for (re-)running a config into `dirname`
+
+	the trainer appends to the files in its run directory, and the `DONE.txt` of an earlier
+	attempt would answer the new one right away, so an earlier attempt that is not running
+	anymore is retired (see `retire_run`). a link to a cached run is just removed
+	"""
+	path = os.path.normpath(dirname)
+	if os.path.islink(path):
+		os.remove(path)
+	elif os.path.isdir(path) and run_status(dirname) != 'running':
+		print('> retired earlier attempt %s -> %s' % (dirname, retire_run(dirname)))
+
+
+class ResultCache(object):
+	"""maps canonical config hashes to run directories in `datadir`
+
+	### Parameters:
+	 - `datadir : str`
+	   where the run directories are
+	   (defaults to `'../../psweep_data/'`)
+	 - `on_failed : str`
+	   what to do with runs that finished without a usable result, `'retry'` or `'reuse'`
+	   (defaults to `'retry'`)
+	 - `stale_after : float`
+	   seconds without writes after which an unfinished run is considered dead
+	   (defaults to `3600.0`)
+	"""
+
+	def __init__(
+			self,
+			datadir : str = '../../psweep_data/',
+			on_failed : Literal['retry', 'reuse'] = 'retry',
+			stale_after : float = 3600.0,
+		):
+		if on_failed not in ('retry', 'reuse'):
+			raise ValueError('on_failed must be one of retry, reuse, got %s' % on_failed)
+
+		self.datadir = datadir
+		self.on_failed = on_failed
+		self.stale_after = stale_after
+		self.index_file = os.path.join(datadir, CACHE_INDEX_FILE)
+
+		# hash -> dirname -> status
+		self._entries : Dict[str, Dict[str, str]] = dict()
+		# dirname -> status
+		self._status : Dict[str, str] = dict()
+
+		self._load()
+
+	def _load(self) -> None:
+		if not os.path.isfile(self.index_file):
+			return
+		with open(self.index_file, 'r') as fin:
+			for line in fin:
+				parts = line.rstrip('\n').split('\t')
+				if len(parts) == 3:
+					self._set(*parts)
+
+	def _set(self, cfg_hash : str, status : str, dirname : str) -> None:
+		self._entries.setdefault(cfg_hash, dict())[dirname] = status
+		self._status[dirname] = status
+
+	def record(self, cfg_hash : str, dirname : str, status : Optional[CacheStatus] = None) -> None:
+		"""adds or updates an entry. if `status` is not given, it is read from the directory"""
+		dirname = os.path.basename(os.path.normpath(dirname))
+		if status is None:
+			status = run_status(os.path.join(self.datadir, dirname), self.stale_after)
+		if self._status.get(dirname, None) == status:
+			return
+
+		self._set(cfg_hash, status, dirname)
+		with open(self.index_file, 'a') as fout:
+			print('%s\t%s\t%s' % (cfg_hash, status, dirname), file = fout)
+
+	def refresh(self, pattern : Optional[str] = None) -> int:
+		"""indexes run directories that are new, or not finished yet. returns the number of entries updated
+
+		### Parameters:
+		 - `pattern : Optional[str]`
+		   only look at directories starting with this (usually `'{run_ID}_'`)
+		   (defaults to `None`)
+		"""
+		n = 0
+		for name in os.listdir(self.datadir):
+			if pattern is not None and not name.startswith(pattern):
+				continue
+			if self._status.get(name, None) in FINAL_STATUSES:
+				continue
+
+			dirname = os.path.join(self.datadir, name)
+			try:
+				cfg_hash = config_hash(read_config_strings(os.path.join(dirname, 'config.txt')))
+			except (OSError, KeyError, ValueError):
+				# not a run directory, or a config with unknown keys
+				continue
+
+			before = self._status.get(name, None)
+			self.record(cfg_hash, name)
+			n += int(self._status[name] != before)
+
+		return n
+
+	def lookup(self, cfg_hash : str) -> Tuple[Optional[CacheStatus], Optional[str]]:
+		"""finds a run for `cfg_hash`, applying the policy from the module docstring
+
+		### Returns:
+		 - `Tuple[Optional[CacheStatus], Optional[str]]`
+		   `('done', dirname)`, `('failed', dirname)` or `('pruned', dirname)` if the result can be reused,
+		   `('running', dirname)` if the caller should wait on that run,
+		   `(None, None)` if the config has to be (re-)run
+		"""
+		entries = self._entries.get(cfg_hash, dict())
+
+		# re-check unfinished runs, they might have finished or died since
+		for dirname, status in list(entries.items()):
+			if status not in FINAL_STATUSES:
+				self.record(cfg_hash, dirname)
+
+		reusable = [ 'done', 'failed', 'pruned' ] if self.on_failed == 'reuse' else [ 'done', 'pruned' ]
+		for status in reusable + [ 'running' ]:
+			for dirname, s in entries.items():
+				if s == status:
+					return (status, os.path.join(self.datadir, dirname) + '/')
+
+		return (None, None)
+
+	def link(self, src : str, name : str) -> str:
+		"""makes the cached run `src` also available as `{datadir}/{name}`, so that it shows up under a new `RUN_ID`
+
+		returns the new directory. does nothing if it already exists
+		"""
+		dst = os.path.join(self.datadir, name)
+		if not os.path.lexists(dst):
+			os.symlink(os.path.basename(os.path.normpath(src)), dst)
+		return dst + '/'
@@ -0,0 +1,310 @@
+"""space-filling samples of the ranges in `CONSTS_RANGES`, instead of the full grid
+
+every key of the ranges is taken as an interval `[min, max]` of its listed values,
+and `n` points are drawn from a low-discrepancy sequence over the unit cube:
+ - `'sobol'` : scrambled Sobol points, from `scipy.stats.qmc` (scipy is only needed for this one)
+ - `'halton'` : Halton points, shifted by a random offset (a Cranley-Patterson rotation) drawn from the seed
+ - `'lhs'` : a Latin hypercube of the `n` points, every interval hit exactly once per key
+
+a point is mapped to the interval linearly, or geometrically for keys that are `'log'`
+in `CONSTS_SWEEP_TYPE`. values of `int` keys on a linear scale are rounded. other values
+are kept to `SIG_DIGITS` significant digits, so the configs stay readable. `int` keys on a
+log scale (`LEARNING_RATE`, read with `stof` by the trainer) keep their fractional part,
+see `gen_configs.canonical_value`.
+
+## extending a design
+the points go to the run's manifest (see `psweep/manifest.py`), with the `CONFIG_ID`s
+`0, 1, ...` just like a grid. calling `save_samples` again for the same run ID adds
+`n` more points to it: Sobol and Halton continue their sequence where the last call
+stopped, and the Latin hypercube draws a new, independent hypercube. points whose
+hyperparameters are already in the manifest (see `config_hash`) are skipped and
+replaced by the next ones. what the sequence needs to continue is kept next to
+the manifest, in `{directory}{run_ID}.sampler.json`.
+"""
+
+import os
+import json
+import warnings
+from typing import *
+
+import numpy as np
+
+from psweep.psweep import *
+from psweep.gen_configs import config_hash, canonical_value, config_filename, write_combos
+from psweep.manifest import Manifest, manifest_path, manifest_lock, create_manifest, write_rows
+from psweep.registry import Registry
+
+
+SAMPLERS : Tuple[str, ...] = ('sobol', 'halton', 'lhs')
+
+SAMPLER_EXT : str = '.sampler.json'
+
+# significant digits kept for float values
+SIG_DIGITS : int = 6
+
+# manifest field width of a sampled value. `str()` of a float with `SIG_DIGITS` digits fits easily
+SAMPLE_FIELD_WIDTH : int = 16
+
+# gives up on finding new points after drawing this many times `n` (an exhausted space of `int` keys)
+MAX_DRAW_FACTOR : int = 100
+
+
+def _primes(n : int) -> List[int]:
+	"""the first `n` primes"""
+	primes : List[int] = []
+	k = 2
+	while len(primes) < n:
+		if all(k % p for p in primes if p * p <= k):
+			primes.append(k)
+		k += 1
+	return primes
+
+
+def halton(n : int, d : int, start : int = 0, seed : Optional[int] = None) -> np.ndarray:
+	"""points `start` to `start + n` of the `d`-dimensional Halton sequence, as an `(n, d)` array
+
+	the sequence starts at index 1, skipping the corner at the origin. with a `seed`,
+	every coordinate is shifted by the same random offset (modulo 1) for all points
+	"""
+	idx = np.arange(start + 1, start + n + 1, dtype = np.int64)
+	out = np.empty((n, d))
+	for j, base in enumerate(_primes(d)):
+		# radical inverse: mirror the digits of the index in `base` around the decimal point
+		x = np.zeros(n)
+		f = 1.0 / base
+		rem = idx.copy()
+		while rem.any():
+			rem, digit = np.divmod(rem, base)
+			x += digit * f
+			f /= base
+		out[:, j] = x
+
+	if seed is not None:
+		out = (out + np.random.default_rng(seed).random(d)) % 1.0
+	return out
+
+
+def sobol(n : int, d : int, start : int = 0, seed : Optional[int] = None) -> np.ndarray:
+	"""points `start` to `start + n` of a scrambled `d`-dimensional Sobol sequence. needs scipy"""
+	try:
+		from scipy.stats import qmc
+	except ImportError:
+		raise ImportError("the 'sobol' sampler needs scipy, use 'halton' or 'lhs' instead")
+
+	engine = qmc.Sobol(d, scramble = True, seed = seed)
+	if start > 0:
+		engine.fast_forward(start)
+	with warnings.catch_warnings():
+		# balance is only guaranteed for powers of 2, which an extended design does not keep to anyway
+		warnings.simplefilter('ignore', UserWarning)
+		return engine.random(n)
+
+
+def latin_hypercube(n : int, d : int, start : int = 0, seed : Optional[int] = None) -> np.ndarray:
+	"""`n` points in `d` dimensions with exactly one point in each of the `n` slices of every axis
+
+	`start` only picks a different (reproducible) hypercube for every extension of a design
+	"""
+	rng = np.random.default_rng(None if seed is None else (seed, start))
+	out = np.empty((n, d))
+	for j in range(d):
+		out[:, j] = (rng.permutation(n) + rng.random(n)) / n
+	return out
+
+
+SAMPLER_FUNCS : Dict[str, Callable[[int, int, int, Optional[int]], np.ndarray]] = {
+	'sobol' : sobol,
+	'halton' : halton,
+	'lhs' : latin_hypercube,
+}
+
+
+def get_bounds(ranges : cn_Dict_R = CONSTS_RANGES) -> Dict[str, Tuple[float, float]]:
+	"""`(min, max)` of the values listed for every key"""
+	return { k : (float(min(v)), float(max(v))) for k, v in ranges.items() }
+
+
+def scale_points(
+		u : np.ndarray,
+		bounds : Dict[str, Tuple[float, float]],
+		sweep_type : Dict[str, str] = CONSTS_SWEEP_TYPE,
+		typemap : Dict[str, type] = TYPE_MAP,
+	) -> List[Dict[str, t_Val]]:
+	"""maps points of the unit cube (one column per key of `bounds`, in order) to config values
+
+	raises `ValueError` if a 'log' key has a bound that is not positive
+	"""
+	def rounded(k : str) -> bool:
+		return typemap[k] is int and sweep_type[k] != 'log'
+
+	columns : Dict[str, np.ndarray] = dict()
+	for j, (k, (lo, hi)) in enumerate(bounds.items()):
+		if sweep_type[k] == 'log':
+			if lo <= 0:
+				raise ValueError("key '%s' is swept on a log scale, but its range starts at %s" % (k, str(lo)))
+			x = lo * (hi / lo) ** u[:, j]
+		else:
+			x = lo + (hi - lo) * u[:, j]
+
+		columns[k] = np.rint(x).astype(np.int64) if rounded(k) else x
+
+	points = []
+	for i in range(len(u)):
+		points.append({
+			k : int(col[i]) if rounded(k) else canonical_value(float('%.*g' % (SIG_DIGITS, col[i])), typemap[k])
+			for k, col in columns.items()
+		})
+	return points
+
+
+def sample_row_width(
+		run_ID : str,
+		keys : Sequence[str],
+		default_data : cn_Dict = CONSTS_DEFAULT,
+		default_order : Sequence[t_Key] = CONSTS_DEFAULT_KEYS,
+	) -> int:
+	"""manifest row width that fits any sample of `keys`, and up to `10**LEN_ID` configs"""
+	widths = {
+		k : SAMPLE_FIELD_WIDTH if k in keys else len(str(default_data[k]))
+		for k in default_order
+	}
+	widths['RUN_ID'] = len(run_ID)
+	widths['CONFIG_ID'] = LEN_ID
+	widths['DIRNAME'] = len('%s_ID' % run_ID) + LEN_ID
+	return sum(widths.values()) + len(default_order)
+
+
+def read_sampler_state(filename : str) -> Optional[Dict[str, Any]]:
+	if not os.path.isfile(filename):
+		return None
+	with open(filename, 'r') as fin:
+		return json.load(fin)
+
+
+def write_sampler_state(filename : str, state : Dict[str, Any]) -> None:
+	tmp = filename + '.tmp'
+	with open(tmp, 'w') as fout:
+		json.dump(state, fout, indent = '\t')
+	os.replace(tmp, filename)
+
+
+def save_samples(
+		run_ID : str,
+		n : int,
+		method : str = 'sobol',
+		ranges : cn_Dict_R = CONSTS_RANGES,
+		seed : Optional[int] = 0,
+		default_data : cn_Dict = CONSTS_DEFAULT,
+		default_order : Sequence[t_Key] = CONSTS_DEFAULT_KEYS,
+		sweep_type : Dict[str, str] = CONSTS_SWEEP_TYPE,
+		directory : str = 'config/',
+		txt : bool = False,
+		registry : Optional[Registry] = None,
+	) -> int:
+	"""adds `n` new space-filling samples of `ranges` to the run's manifest, see the module docstring
+
+	### Parameters:
+	 - `run_ID : str`
+	 - `n : int`
+	   number of new configs
+	 - `method : str`
+	   one of `SAMPLERS`
+	   (defaults to `'sobol'`)
+	 - `ranges : cn_Dict_R`
+	   the interval of every key is the min and max of its values
+	   (defaults to `CONSTS_RANGES`)
+	 - `seed : Optional[int]`
+	   seed of the scrambling, shift or permutations. `None` for a fresh one every time (not reproducible)
+	   (defaults to `0`)
+	 - `sweep_type : Dict[str, str]`
+	   keys that are `'log'` are sampled on a log scale
+	   (defaults to `CONSTS_SWEEP_TYPE`)
+	 - `directory : str`
+	   (defaults to `'config/'`)
+	 - `txt : bool`
+	   also write one `{directory}{run_ID}_ID{n}.txt` per config
+	   (defaults to `False`)
+	 - `registry : Optional[Registry]`
+	   if given, the new configs are registered in it, see `psweep/registry.py`
+	   (defaults to `None`)
+
+	### Raises:
+	 - `ValueError` : unknown method, or the run already has a design that was made with a different method, seed or ranges
+
+	### Returns:
+	 - `int`
+	   number of configs added. fewer than `n` if the space ran out of new points
+	"""
+	if method not in SAMPLER_FUNCS:
+		raise ValueError('unknown sampler %s, expected one of %s' % (method, str(SAMPLERS)))
+
+	bounds = get_bounds(ranges)
+	state_file = directory + run_ID + SAMPLER_EXT
+	filename = manifest_path(run_ID, directory)
+
+	state = {
+		'method' : method,
+		'seed' : seed,
+		'bounds' : { k : list(b) for k, b in bounds.items() },
+		'sweep_type' : { k : sweep_type[k] for k in bounds },
+		'next_index' : 0,
+	}
+
+	# * pick up an existing design
+	seen : Set[str] = set()
+	n_rows = 0
+	# other processes extending the same run wait until this design is saved
+	with manifest_lock(filename):
+		old_state = read_sampler_state(state_file)
+		if old_state is not None:
+			for key in ('method', 'seed', 'bounds', 'sweep_type'):
+				if old_state[key] != state[key]:
+					raise ValueError(
+						'%s was sampled with %s = %s, not %s. use a new run ID for a different design'
+						% (run_ID, key, str(old_state[key]), str(state[key]))
+					)
+			state['next_index'] = old_state['next_index']
+
+		if os.path.isfile(filename):
+			manifest = Manifest(filename)
+			if old_state is None and len(manifest):
+				raise ValueError('%s already has configs that were not sampled, use a new run ID' % filename)
+			seen = { config_hash(row) for row in manifest.iter_rows() }
+			n_rows = len(manifest)
+			width, header_len = manifest.width, manifest.header_len
+		else:
+			width = sample_row_width(run_ID, list(bounds), default_data, default_order)
+			header_len = create_manifest(filename, default_order, width)
+
+		# * draw until there are `n` new points
+		print('sampling %d configs with %s, from point %d of the sequence' % (n, method, state['next_index']))
+		new : List[Dict[str, t_Val]] = []
+		max_index = state['next_index'] + MAX_DRAW_FACTOR * n
+		while len(new) < n and state['next_index'] < max_index:
+			n_draw = n - len(new)
+			u = SAMPLER_FUNCS[method](n_draw, len(bounds), state['next_index'], seed)
+			state['next_index'] += n_draw
+
+			for point in scale_points(u, bounds, sweep_type):
+				c = { **default_data, **point }
+				h = config_hash(c, default_data, default_order)
+				if h in seen:
+					continue
+				seen.add(h)
+				c['CONFIG_ID'] = str(n_rows + len(new))
+				config_filename(c, run_ID, directory)
+				new.append(c)
+
+		if len(new) < n:
+			print('  > only found %d new points, the space is exhausted' % len(new))
+
+		# * save
+		write_rows(filename, new, default_order, width, header_len, n_rows)
+		if txt:
+			write_combos(run_ID, new, default_data, default_order, directory)
+		write_sampler_state(state_file, state)
+	if registry is not None:
+		registry.add_configs(run_ID, new, default_data)
+
+	print('  > %s now has %d configs' % (filename, n_rows + len(new)))
+	return len(new)
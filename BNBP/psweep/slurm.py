@@ -0,0 +1,246 @@
+"""submits configs to slurm as job arrays instead of one `sbatch` call per config
+
+each array comes with a mapping file: line `k` (0-indexed) lists the config IDs
+that array task `k` runs, separated by spaces. `myJobArray.sh` reads its line
+using `$SLURM_ARRAY_TASK_ID`. arrays larger than `MAX_ARRAY_SIZE` are split.
+
+`sbatch_cmd` can point at any stand-in that accepts the same arguments and
+prints `<job id>` (as `sbatch --parsable` does), which is useful for testing.
+"""
+
+import os
+import time
+import shlex
+import itertools
+import threading
+import subprocess
+from typing import *
+
+
+# where the task -> config mapping files go
+ARRAY_DIR : str = 'psweep/arrays/'
+# slurm's default `MaxArraySize` is 1001, so at most 1000 tasks fit in one array
+MAX_ARRAY_SIZE : int = 1000
+SBATCH_CMD : str = 'sbatch'
+SQUEUE_CMD : str = 'squeue'
+ARRAY_SCRIPT : str = 'myJobArray.sh'
+
+_MAPFILE_COUNTER = itertools.count()
+
+
+def parse_job_id(output : str) -> str:
+	"""job id from the output of `sbatch --parsable` (`<job id>[;<cluster>]`)"""
+	return output.strip().splitlines()[-1].split(';')[0].strip()
+
+
+def write_mapping_file(filename : str, tasks : Sequence[Sequence[str]]) -> None:
+	with open(filename, 'w') as fout:
+		for task in tasks:
+			print(' '.join(str(c) for c in task), file = fout)
+
+
+def submit_array(
+		run_ID : str,
+		tasks : Sequence[Sequence[str]],
+		throttle : Optional[int] = None,
+		extra_args : Sequence[str] = (),
+		script : str = ARRAY_SCRIPT,
+		array_dir : str = ARRAY_DIR,
+		sbatch_cmd : str = SBATCH_CMD,
+		max_array_size : int = MAX_ARRAY_SIZE,
+	) -> Dict[str, str]:
+	"""submits `tasks` as one or more slurm job arrays
+
+	### Parameters:
+	 - `run_ID : str`
+	 - `tasks : Sequence[Sequence[str]]`
+	   config IDs for each array task. every task runs its configs one after another
+	 - `throttle : Optional[int]`
+	   maximum number of tasks of an array running at the same time (`--array=...%N`).
+	   `None` for no limit
+	   (defaults to `None`)
+	 - `extra_args : Sequence[str]`
+	   additional arguments for `sbatch`, such as `--time=...`
+	   (defaults to `()`)
+	 - `script : str`
+	   job script, gets the mapping file and `run_ID` as arguments
+	   (defaults to `ARRAY_SCRIPT`)
+	 - `array_dir : str`
+	   where to write mapping files
+	   (defaults to `ARRAY_DIR`)
+	 - `sbatch_cmd : str`
+	   command used to submit, can include arguments
+	   (defaults to `SBATCH_CMD`)
+	 - `max_array_size : int`
+	   arrays with more tasks than this are split
+	   (defaults to `MAX_ARRAY_SIZE`)
+
+	### Returns:
+	 - `Dict[str, str]`
+	   slurm job id of each config, as `<array job id>_<task index>`
+
+	### Raises:
+	 - `RuntimeError` if `sbatch` fails. arrays submitted before the failure are not cancelled
+	"""
+	os.makedirs(array_dir, exist_ok = True)
+	# several arrays can go out in the same millisecond (one per resource request), and
+	# a mapping file is read when the task starts, so it must never be overwritten
+	stamp = '%d_%d_%d' % (time.time() * 1000, os.getpid(), next(_MAPFILE_COUNTER))
+
+	job_ids : Dict[str, str] = dict()
+
+	for n, start in enumerate(range(0, len(tasks), max_array_size)):
+		chunk = tasks[start : start + max_array_size]
+		mapfile = os.path.join(array_dir, '%s_%s_%d.txt' % (run_ID, stamp, n))
+		write_mapping_file(mapfile, chunk)
+
+		array_spec = '--array=0-%d' % (len(chunk) - 1)
+		if throttle is not None:
+			array_spec += '%%%d' % throttle
+
+		cmd = shlex.split(sbatch_cmd) + [
+			'--parsable',
+			array_spec,
+			'--job-name=HH_' + run_ID,
+			*extra_args,
+			script,
+			mapfile,
+			run_ID,
+		]
+		print('CALLING:\t' + ' '.join(cmd))
+
+		proc = subprocess.run(cmd, stdout = subprocess.PIPE, stderr = subprocess.PIPE, universal_newlines = True)
+		if proc.returncode != 0:
+			raise RuntimeError(
+				'submitting array failed (exit code %d):\n%s'
+				% (proc.returncode, proc.stderr)
+			)
+
+		array_id = parse_job_id(proc.stdout)
+		for k, task in enumerate(chunk):
+			for cfg_ID in task:
+				job_ids[str(cfg_ID)] = '%s_%d' % (array_id, k)
+
+	return job_ids
+
+
+
+def job_alive(
+		job_id : Optional[str] = None,
+		name : Optional[str] = None,
+		squeue_cmd : str = SQUEUE_CMD,
+	) -> bool:
+	"""whether a slurm job (given by id, or by name) is still pending or running
+
+	returns `False` if `squeue` does not know the job
+
+	### Raises:
+	 - `OSError` if `squeue` can not be run
+	"""
+	cmd = shlex.split(squeue_cmd) + [ '-h', '-o', '%i' ]
+	if job_id is not None:
+		cmd += [ '-j', job_id ]
+	elif name is not None:
+		cmd += [ '-n', name ]
+	else:
+		raise ValueError('need either a job id or a job name')
+
+	proc = subprocess.run(cmd, stdout = subprocess.PIPE, stderr = subprocess.PIPE, universal_newlines = True)
+
+	# squeue fails on job ids it has already forgotten about
+	return proc.returncode == 0 and bool(proc.stdout.strip())
+
+
+
+class ArraySubmitter(object):
+	"""collects configs submitted one at a time, and sends them to slurm as job arrays
+
+	a batch is submitted `delay` seconds after its first config was queued,
+	or right away once it holds `max_batch` configs, as one array per distinct `extra_args`.
+	used by the nevergrad sweep, where candidates trickle in one by one.
+
+	### Parameters:
+	 - `run_ID : str`
+	 - `delay : float`
+	   seconds to wait for more configs before submitting
+	   (defaults to `2.0`)
+	 - `max_batch : int`
+	   (defaults to `MAX_ARRAY_SIZE`)
+	 - `on_error : Optional[Callable[[List[str]], None]]`
+	   called with the config IDs of an array that could not be submitted
+	   (defaults to `None`)
+	 - `on_submitted : Optional[Callable[[Dict[str, str]], None]]`
+	   called with the job id of each config, after an array was submitted
+	   (defaults to `None`)
+	 - `**submit_kwargs`
+	   passed on to `submit_array`
+	"""
+
+	def __init__(
+			self,
+			run_ID : str,
+			delay : float = 2.0,
+			max_batch : int = MAX_ARRAY_SIZE,
+			on_error : Optional[Callable[[List[str]], None]] = None,
+			on_submitted : Optional[Callable[[Dict[str, str]], None]] = None,
+			**submit_kwargs,
+		):
+		self.run_ID = run_ID
+		self.delay = delay
+		self.max_batch = max_batch
+		self.on_error = on_error
+		self.on_submitted = on_submitted
+		self.submit_kwargs = submit_kwargs
+
+		# config ID -> slurm job id, for every config submitted so far
+		self.job_ids : Dict[str, str] = dict()
+
+		self._lock = threading.Lock()
+		self._queued : List[Tuple[str, Tuple[str, ...]]] = []
+		self._timer : Optional[threading.Timer] = None
+
+	def submit(self, cfg_ID : str, extra_args : Sequence[str] = ()) -> None:
+		"""queues a config, returns immediately
+
+		`extra_args` go to `sbatch` on top of the ones in `submit_kwargs`, such as the
+		resources of the config (see `resources.sbatch_args`)
+		"""
+		with self._lock:
+			self._queued.append((str(cfg_ID), tuple(extra_args)))
+			full = len(self._queued) >= self.max_batch
+			if not full and self._timer is None:
+				self._timer = threading.Timer(self.delay, self.flush)
+				self._timer.daemon = True
+				self._timer.start()
+
+		if full:
+			self.flush()
+
+	def flush(self) -> None:
+		"""submits everything queued so far"""
+		with self._lock:
+			batch, self._queued = self._queued, []
+			if self._timer is not None:
+				self._timer.cancel()
+				self._timer = None
+
+		groups : Dict[Tuple[str, ...], List[str]] = dict()
+		for cfg_ID, extra_args in batch:
+			groups.setdefault(extra_args, []).append(cfg_ID)
+
+		for extra_args, cfg_IDs in groups.items():
+			kwargs = dict(self.submit_kwargs)
+			kwargs['extra_args'] = list(kwargs.get('extra_args', ())) + list(extra_args)
+			try:
+				job_ids = submit_array(self.run_ID, [ [c] for c in cfg_IDs ], **kwargs)
+			except (RuntimeError, OSError) as e:
+				print('> submitting %d configs failed:\t%r' % (len(cfg_IDs), e))
+				if self.on_error is not None:
+					self.on_error(cfg_IDs)
+				continue
+
+			with self._lock:
+				self.job_ids.update(job_ids)
+
+			if self.on_submitted is not None:
+				self.on_submitted(job_ids)
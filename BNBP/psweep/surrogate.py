@@ -0,0 +1,198 @@
+"""a surrogate of a metric over the swept keys, to plot landscapes from runs that are not on a grid
+
+`sweep_nevergrad` leaves scattered points, on which `plot_psweep.plot_pair_heatmap` gives
+mostly empty images. instead, a gaussian process is fit to the results table, and evaluated
+on a dense 2-d slice, giving the predicted metric and its uncertainty everywhere.
+
+the inputs are transformed first, so that one length scale fits all keys: keys swept as
+`'log'` in `CONSTS_SWEEP_TYPE` are taken as `log10`, then every key is scaled to `[0, 1]`
+over the values in the table. the metric is standardized. the kernel is a squared
+exponential with white noise, and its length scale and noise are the ones with the highest
+marginal likelihood on a grid (`LENGTH_SCALES`, `NOISES`), on a subsample of `SEARCH_POINTS` runs.
+only numpy is needed.
+
+fitting is cubic in the number of runs, so at most `MAX_TRAIN_POINTS` runs (a random subset) are used.
+"""
+
+from typing import *
+
+import numpy as np
+import pandas as pd
+
+from psweep.psweep import CONSTS_SWEEP_TYPE, CONSTS_DEFAULT_KEYS, CONSTS_DEFAULT_KEYS_META
+
+
+MAX_TRAIN_POINTS : int = 1500
+SEARCH_POINTS : int = 500
+
+# in the transformed (`[0, 1]` scaled) inputs, and relative to the variance of the standardized metric
+LENGTH_SCALES : np.ndarray = np.geomspace(0.05, 2.0, 10)
+NOISES : np.ndarray = np.array([ 1e-3, 1e-2, 0.05, 0.1, 0.3, 1.0, 3.0 ])
+
+# points along each axis of a slice
+N_GRID : int = 50
+
+
+def swept_keys(df : pd.DataFrame, keys : Optional[Sequence[str]] = None) -> List[str]:
+	"""numeric keys (of `keys`, or of `CONSTS_DEFAULT_KEYS`) that vary across the table"""
+	keys = [ k for k in (keys or CONSTS_DEFAULT_KEYS) if k not in CONSTS_DEFAULT_KEYS_META and k in df.columns ]
+	return [
+		k for k in keys
+		if df[k].dtype.kind in 'iuf' and np.nanmax(df[k].to_numpy(dtype = float)) > np.nanmin(df[k].to_numpy(dtype = float))
+	]
+
+
+def sq_dists(a : np.ndarray, b : np.ndarray) -> np.ndarray:
+	"""squared euclidean distances between the rows of `a` and `b`"""
+	d = (a * a).sum(axis = 1)[:, None] + (b * b).sum(axis = 1)[None, :] - 2 * a @ b.T
+	return np.clip(d, 0, None)
+
+
+def log_marginal_likelihood(d2 : np.ndarray, y : np.ndarray, length_scale : float, noise : float) -> float:
+	"""of standardized `y`, given the squared distances `d2` between its inputs"""
+	K = np.exp(-0.5 * d2 / length_scale ** 2) + noise * np.eye(len(y))
+	try:
+		L = np.linalg.cholesky(K)
+	except np.linalg.LinAlgError:
+		return -np.inf
+	alpha = np.linalg.solve(L.T, np.linalg.solve(L, y))
+	return float(-0.5 * y @ alpha - np.log(np.diag(L)).sum() - 0.5 * len(y) * np.log(2 * np.pi))
+
+
+class Surrogate(object):
+	"""a gaussian process of `metric` over `keys`, see the module docstring
+
+	### Parameters:
+	 - `df : pd.DataFrame`
+	   the results table. runs where `metric` is NaN are left out
+	 - `metric : str`
+	 - `keys : Optional[Sequence[str]]`
+	   inputs. if `None`, every key that varies, see `swept_keys`
+	   (defaults to `None`)
+	 - `sweep_type : Dict[str, str]`
+	   (defaults to `CONSTS_SWEEP_TYPE`)
+	 - `max_points : int`
+	   (defaults to `MAX_TRAIN_POINTS`)
+	 - `seed : int`
+	   for picking the subsets
+	   (defaults to `0`)
+	"""
+
+	def __init__(
+			self,
+			df : pd.DataFrame,
+			metric : str,
+			keys : Optional[Sequence[str]] = None,
+			sweep_type : Dict[str, str] = CONSTS_SWEEP_TYPE,
+			max_points : int = MAX_TRAIN_POINTS,
+			seed : int = 0,
+		):
+		self.metric = metric
+		self.keys = swept_keys(df, keys)
+		if not self.keys:
+			raise ValueError('no keys vary across the table, nothing to fit')
+		self.log_keys = [ k for k in self.keys if sweep_type.get(k) == 'log' and (df[k] > 0).all() ]
+
+		df = df.loc[ df[metric].notna() ]
+		if len(df) < 2:
+			raise ValueError('need at least 2 runs with a %s to fit a surrogate' % metric)
+		rng = np.random.default_rng(seed)
+		if len(df) > max_points:
+			df = df.iloc[ np.sort(rng.choice(len(df), max_points, replace = False)) ]
+
+		raw = self._log(df[self.keys].to_numpy(dtype = float))
+		self.lo, self.hi = raw.min(axis = 0), raw.max(axis = 0)
+		self.X_train = self._scale(raw)
+		self.raw_train = df[self.keys].to_numpy(dtype = float)
+
+		y = df[metric].to_numpy(dtype = float)
+		self.y_mean, self.y_std = y.mean(), (y.std() or 1.0)
+		y = (y - self.y_mean) / self.y_std
+
+		# * hyperparameters, on a subsample
+		sub = rng.choice(len(y), min(len(y), SEARCH_POINTS), replace = False)
+		d2 = sq_dists(self.X_train[sub], self.X_train[sub])
+		self.length_scale, self.noise = max(
+			( (l, n) for l in LENGTH_SCALES for n in NOISES ),
+			key = lambda p : log_marginal_likelihood(d2, y[sub], *p),
+		)
+
+		# * fit
+		K = np.exp(-0.5 * sq_dists(self.X_train, self.X_train) / self.length_scale ** 2) + self.noise * np.eye(len(y))
+		L = np.linalg.cholesky(K)
+		self.L_inv = np.linalg.inv(L)
+		self.alpha = self.L_inv.T @ (self.L_inv @ y)
+
+	def _log(self, raw : np.ndarray) -> np.ndarray:
+		raw = raw.copy()
+		for i, k in enumerate(self.keys):
+			if k in self.log_keys:
+				raw[:, i] = np.log10(raw[:, i])
+		return raw
+
+	def _scale(self, raw : np.ndarray) -> np.ndarray:
+		return (raw - self.lo) / np.where(self.hi > self.lo, self.hi - self.lo, 1.0)
+
+	def transform(self, points : np.ndarray) -> np.ndarray:
+		"""`(n, len(keys))` points, in the units of the table, to the inputs of the process"""
+		return self._scale(self._log(np.asarray(points, dtype = float)))
+
+	def predict(self, points : np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+		"""mean and standard deviation of the metric at `(n, len(keys))` points, in the units of the table.
+		the deviation is of the underlying function, without the noise of single runs
+		"""
+		Ks = np.exp(-0.5 * sq_dists(self.transform(points), self.X_train) / self.length_scale ** 2)
+		mean = Ks @ self.alpha
+		v = self.L_inv @ Ks.T
+		var = np.clip(1.0 - (v * v).sum(axis = 0), 0, None)
+		return (mean * self.y_std + self.y_mean, np.sqrt(var) * self.y_std)
+
+	def axis(self, key : str, n : int = N_GRID) -> np.ndarray:
+		"""`n` points spanning the runs along `key`, evenly spaced in the transformed inputs"""
+		i = self.keys.index(key)
+		t = np.linspace(self.lo[i], self.hi[i], n)
+		return 10 ** t if key in self.log_keys else t
+
+	def slice(
+			self,
+			X : str,
+			Y : str,
+			others : Optional[Dict[str, float]] = None,
+			n : int = N_GRID,
+		) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+		"""the metric on a dense grid of `X,Y`, with the other keys fixed
+
+		### Parameters:
+		 - `X : str`
+		 - `Y : str`
+		 - `others : Optional[Dict[str, float]]`
+		   values of the other keys. keys not in here are fixed at the median of the runs
+		   (defaults to `None`)
+		 - `n : int`
+		   points along each axis
+		   (defaults to `N_GRID`)
+
+		### Returns:
+		 - `Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]`
+		   the `X` grid, the `Y` grid, and the mean and standard deviation, both of shape `(n, n)`,
+		   laid out like `PivotIndex.pivot`
+		"""
+		others = others or dict()
+		x_vals, y_vals = self.axis(X, n), self.axis(Y, n)
+		points = np.tile(np.median(self.raw_train, axis = 0), (n * n, 1))
+		for k, v in others.items():
+			if k in self.keys:
+				points[:, self.keys.index(k)] = v
+		gx, gy = np.meshgrid(x_vals, y_vals)
+		points[:, self.keys.index(X)] = gx.ravel()
+		points[:, self.keys.index(Y)] = gy.ravel()
+
+		mean, std = self.predict(points)
+		return (x_vals, y_vals, mean.reshape(n, n), std.reshape(n, n))
+
+	def grid_position(self, key : str, values : np.ndarray, n : int = N_GRID) -> np.ndarray:
+		"""where `values` of `key` fall on `axis(key, n)`, in (fractional) grid indices, for plotting runs over a slice"""
+		i = self.keys.index(key)
+		t = np.log10(values) if key in self.log_keys else np.asarray(values, dtype = float)
+		span = self.hi[i] - self.lo[i]
+		return (t - self.lo[i]) / (span if span > 0 else 1.0) * (n - 1)
@@ -0,0 +1,414 @@
+"""watches run directories for the `DONE.txt` marker written by `hh_psweep`
+
+a single `CompletionWatcher` serves every run that is waiting on a result.
+on linux it uses inotify to get woken up as soon as `DONE.txt` is created.
+since inotify does not see writes made by other nodes on network filesystems
+(lustre, nfs), a batched scan is still run every `rescan_interval` seconds as a
+safety net. without inotify, that scan is run every `interval` seconds instead.
+
+a scan lists each watched parent directory once. creating `DONE.txt` changes
+the modification time of the run directory (appending to `loss.txt` does not),
+so `DONE.txt` is only looked up in pending run directories that changed since
+the last scan, and the cost of a tick does not depend on how many
+threads/coroutines are waiting.
+"""
+
+import os
+import sys
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+from time import monotonic, time
+from typing import *
+
+
+DONE_FILE : str = 'DONE.txt'
+
+# run directories modified less than this many seconds ago are checked on every scan,
+# since a filesystem with whole-second timestamps can hide a second change
+MTIME_SLACK : float = 2.0
+
+# inotify constants, from <sys/inotify.h>
+IN_CLOSE_WRITE : int = 0x00000008
+IN_MOVED_TO : int = 0x00000080
+IN_CREATE : int = 0x00000100
+IN_Q_OVERFLOW : int = 0x00004000
+IN_IGNORED : int = 0x00008000
+IN_ISDIR : int = 0x40000000
+IN_NONBLOCK : int = os.O_NONBLOCK
+IN_CLOEXEC : int = 0o2000000
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+# (dirname, found DONE.txt)
+t_Callback = Callable[[str, bool], None]
+
+
+def norm_dirname(dirname : str) -> str:
+	"""absolute path of a run directory, without a trailing slash"""
+	return os.path.abspath(dirname)
+
+
+class _Inotify(object):
+	"""minimal ctypes wrapper around the linux inotify api"""
+
+	def __init__(self):
+		libname = ctypes.util.find_library('c')
+		if not sys.platform.startswith('linux') or libname is None:
+			raise OSError('inotify not available on this platform')
+
+		self._libc = ctypes.CDLL(libname, use_errno = True)
+		self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+		if self.fd < 0:
+			raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+	def add_watch(self, path : str, mask : int) -> int:
+		wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+		if wd < 0:
+			raise OSError(ctypes.get_errno(), 'inotify_add_watch failed: %s' % path)
+		return wd
+
+	def rm_watch(self, wd : int) -> None:
+		self._libc.inotify_rm_watch(self.fd, wd)
+
+	def read_events(self, timeout : float, wake_fd : int) -> List[Tuple[int, int, str]]:
+		"""blocks for up to `timeout` seconds or until `wake_fd` is readable, returns a list of `(wd, mask, name)`"""
+		ready, _, _ = select.select([self.fd, wake_fd], [], [], timeout)
+		if wake_fd in ready:
+			try:
+				os.read(wake_fd, 4096)
+			except BlockingIOError:
+				pass
+		if self.fd not in ready:
+			return []
+
+		try:
+			buf = os.read(self.fd, 64 * 1024)
+		except BlockingIOError:
+			return []
+
+		events = []
+		i = 0
+		while i + _EVENT_HEADER.size <= len(buf):
+			wd, mask, _, length = _EVENT_HEADER.unpack_from(buf, i)
+			i += _EVENT_HEADER.size
+			name = os.fsdecode(buf[i : i + length].rstrip(b'\0'))
+			i += length
+			events.append((wd, mask, name))
+
+		return events
+
+	def close(self) -> None:
+		os.close(self.fd)
+
+
+
+class CompletionWatcher(object):
+	"""wakes up everything waiting on a run directory once `DONE.txt` appears in it
+
+	### Parameters:
+	 - `interval : float`
+	   seconds between batched scans when inotify is not available
+	   (defaults to `1.0`)
+	 - `rescan_interval : float`
+	   seconds between safety scans when inotify is available
+	   (defaults to `30.0`)
+	 - `use_inotify : bool`
+	   set to `False` to always use the batched scan
+	   (defaults to `True`)
+
+	### Usage:
+	```python
+	watcher = CompletionWatcher()
+	watcher.start()
+	found = watcher.wait('../../psweep_data/RUN_ID123/', timeout = 3600)
+	```
+	"""
+
+	def __init__(
+			self,
+			interval : float = 1.0,
+			rescan_interval : float = 30.0,
+			use_inotify : bool = True,
+		):
+		self.interval = interval
+		self.rescan_interval = rescan_interval
+
+		self._lock = threading.Lock()
+		self._wakeup = threading.Event()
+		self._stop = threading.Event()
+		self._thread : Optional[threading.Thread] = None
+
+		# pending run directories: dirname -> (event, callback) of every waiter
+		self._pending : Dict[str, List[Tuple[threading.Event, t_Callback]]] = dict()
+		# finished run directories: dirname -> found DONE.txt
+		self._finished : Dict[str, bool] = dict()
+		# modification time of pending run directories at the last scan
+		self._mtimes : Dict[str, float] = dict()
+		# registered since the last scan, only used with inotify
+		self._fresh : List[str] = []
+
+		self._inotify : Optional[_Inotify] = None
+		# watch descriptor -> watched directory
+		self._wds : Dict[int, str] = dict()
+		# watched directory -> watch descriptor
+		self._watched : Dict[str, int] = dict()
+
+		if use_inotify:
+			try:
+				self._inotify = _Inotify()
+				# lets `register` interrupt the blocking read of inotify events
+				self._wake_r, self._wake_w = os.pipe()
+				os.set_blocking(self._wake_r, False)
+				os.set_blocking(self._wake_w, False)
+			except OSError:
+				self._inotify = None
+
+	@property
+	def uses_inotify(self) -> bool:
+		return self._inotify is not None
+
+	def start(self) -> 'CompletionWatcher':
+		"""starts the background thread (no-op if already running)"""
+		if self._thread is None or not self._thread.is_alive():
+			self._stop.clear()
+			self._thread = threading.Thread(
+				target = self._run,
+				name = 'CompletionWatcher',
+				daemon = True,
+			)
+			self._thread.start()
+		return self
+
+	def stop(self) -> None:
+		self._stop.set()
+		self._wakeup.set()
+		if self._inotify is not None:
+			os.write(self._wake_w, b'\0')
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+
+	def register(
+			self,
+			dirname : str,
+			callback : Optional[t_Callback] = None,
+		) -> threading.Event:
+		"""registers interest in `dirname`, returns an event that is set once it is finished
+
+		if given, `callback(dirname, found)` is called from the watcher thread
+		(or immediately, if the run is already known to be finished).
+		`dirname` is passed to the callback as given here, not normalized.
+		"""
+		event = threading.Event()
+
+		def _notify(_ : str, found : bool) -> None:
+			# the callback goes first, so that whoever wakes up on the event sees its effects
+			if callback is not None:
+				callback(dirname, found)
+			event.set()
+
+		key = norm_dirname(dirname)
+
+		with self._lock:
+			if key in self._finished:
+				found = self._finished[key]
+			else:
+				self._pending.setdefault(key, []).append((event, _notify))
+				found = None
+
+		if found is not None:
+			_notify(key, found)
+		elif self._inotify is not None:
+			# have the thread set up a watch on the new directory right away.
+			# without inotify, it is picked up by the next batched scan
+			with self._lock:
+				self._fresh.append(key)
+			self._wakeup.set()
+			try:
+				os.write(self._wake_w, b'\0')
+			except BlockingIOError:
+				pass
+
+		return event
+
+	def unregister(self, dirname : str, event : threading.Event) -> None:
+		"""drops the waiter that `register` returned `event` for, such as after a timeout"""
+		key = norm_dirname(dirname)
+		wd = None
+		with self._lock:
+			waiters = [ w for w in self._pending.get(key, []) if w[0] is not event ]
+			if waiters:
+				self._pending[key] = waiters
+			else:
+				self._pending.pop(key, None)
+				self._mtimes.pop(key, None)
+				wd = self._watched.pop(key, None)
+				if wd is not None:
+					del self._wds[wd]
+
+		if wd is not None and self._inotify is not None:
+			self._inotify.rm_watch(wd)
+
+	def wait(self, dirname : str, timeout : Optional[float] = None) -> bool:
+		"""blocks until `dirname` is finished. returns whether `DONE.txt` was found
+
+		returns `False` on timeout, or if the run was marked as failed
+		"""
+		self.start()
+		result : List[bool] = []
+		event = self.register(dirname, lambda _, found : result.append(found))
+		if not event.wait(timeout):
+			self.unregister(dirname, event)
+		return result[0] if result else False
+
+	def mark(self, dirname : str, found : bool = False) -> None:
+		"""marks `dirname` as finished without waiting for `DONE.txt`
+
+		used by executors that know a run died, so that waiters do not hang until timeout
+		"""
+		self._complete(norm_dirname(dirname), found)
+
+	def forget(self, dirname : str) -> None:
+		"""drops any cached state for `dirname`, so that it can be waited on again
+
+		to be called when a run directory is retired or resubmitted, otherwise waiters get its old result
+		"""
+		key = norm_dirname(dirname)
+		with self._lock:
+			self._finished.pop(key, None)
+
+	def is_done(self, dirname : str) -> Optional[bool]:
+		"""`None` if `dirname` is not known to be finished, otherwise whether `DONE.txt` was found"""
+		with self._lock:
+			return self._finished.get(norm_dirname(dirname), None)
+
+	# * internals
+
+	def _complete(self, key : str, found : bool) -> None:
+		with self._lock:
+			self._finished[key] = found
+			callbacks = self._pending.pop(key, [])
+			self._mtimes.pop(key, None)
+			wd = self._watched.pop(key, None)
+			if wd is not None:
+				del self._wds[wd]
+
+		if wd is not None and self._inotify is not None:
+			self._inotify.rm_watch(wd)
+
+		for _, cb in callbacks:
+			cb(key, found)
+
+	def _watch(self, path : str, mask : int) -> None:
+		if self._inotify is None or path in self._watched:
+			return
+		try:
+			wd = self._inotify.add_watch(path, mask)
+		except OSError:
+			return
+		with self._lock:
+			self._wds[wd] = path
+			self._watched[path] = wd
+
+	def _scan(self, keys : Optional[List[str]] = None) -> None:
+		"""one batched pass over `keys` (defaults to all pending directories)"""
+		with self._lock:
+			if keys is None:
+				pending = list(self._pending)
+			else:
+				pending = [ k for k in keys if k in self._pending ]
+
+		# group by parent so that each parent is only listed once
+		by_parent : Dict[str, List[str]] = dict()
+		for key in pending:
+			by_parent.setdefault(os.path.dirname(key), []).append(key)
+
+		for parent, keys in by_parent.items():
+			self._watch(parent, IN_CREATE | IN_MOVED_TO)
+			try:
+				with os.scandir(parent) as it:
+					existing = { e.name : e for e in it }
+			except OSError:
+				continue
+
+			now = time()
+			for key in keys:
+				entry = existing.get(os.path.basename(key), None)
+				if entry is None:
+					continue
+				# watch before checking, so that a marker created in between is not missed
+				self._watch(key, IN_CREATE | IN_CLOSE_WRITE | IN_MOVED_TO)
+				try:
+					mtime = entry.stat().st_mtime
+				except OSError:
+					continue
+				if self._mtimes.get(key, None) == mtime and now - mtime > MTIME_SLACK:
+					continue
+				with self._lock:
+					if key in self._pending:
+						self._mtimes[key] = mtime
+				if os.path.isfile(os.path.join(key, DONE_FILE)):
+					self._complete(key, True)
+
+	def _handle_events(self, events : List[Tuple[int, int, str]]) -> bool:
+		"""processes inotify events, returns `True` if a full rescan is needed"""
+		need_scan = False
+		for wd, mask, name in events:
+			if mask & IN_Q_OVERFLOW:
+				need_scan = True
+				continue
+
+			with self._lock:
+				path = self._wds.get(wd, None)
+				if mask & IN_IGNORED and path is not None:
+					del self._wds[wd]
+					self._watched.pop(path, None)
+
+			if path is None or not name:
+				continue
+
+			child = os.path.join(path, name)
+			if name == DONE_FILE:
+				with self._lock:
+					is_pending = path in self._pending
+				if is_pending:
+					self._complete(path, True)
+			elif mask & IN_ISDIR:
+				with self._lock:
+					is_pending = child in self._pending
+				if is_pending:
+					self._watch(child, IN_CREATE | IN_CLOSE_WRITE | IN_MOVED_TO)
+					if os.path.isfile(os.path.join(child, DONE_FILE)):
+						self._complete(child, True)
+
+		return need_scan
+
+	def _run(self) -> None:
+		if self._inotify is None:
+			period = self.interval
+		else:
+			period = self.rescan_interval
+
+		last_scan = 0.0
+		while not self._stop.is_set():
+			if monotonic() - last_scan >= period:
+				last_scan = monotonic()
+				self._scan()
+			elif self._wakeup.is_set():
+				self._wakeup.clear()
+				with self._lock:
+					fresh, self._fresh = self._fresh, []
+				self._scan(fresh)
+
+			if self._inotify is not None:
+				events = self._inotify.read_events(
+					max(0.0, period - (monotonic() - last_scan)),
+					self._wake_r,
+				)
+				if self._handle_events(events):
+					last_scan = 0.0
+			else:
+				self._wakeup.wait(max(0.0, period - (monotonic() - last_scan)))
@@ -0,0 +1,216 @@
+"""keeps `hh_psweep --worker` processes alive and feeds them configs, instead of launching the trainer once per config
+
+every launch of the trainer reads all of MNIST before training anything, which
+dominates short (few epoch) evaluations. a worker reads it once, then trains
+configs one after another: each config ID is written as a line to its stdin,
+and once it is done the worker writes a tab-separated line to stderr,
+`RESULT <cfg_ID> <run_ID> DONE <accuracy>` or `RESULT <cfg_ID> <run_ID> FAILED <error>`.
+the run directory (and `DONE.txt`) is written exactly as in a normal run.
+like `LocalExecutor`, every worker is pinned to its own disjoint core set,
+and the two share the same interface.
+"""
+
+import os
+import queue
+import threading
+import subprocess
+from concurrent import futures
+from typing import *
+
+from psweep.watcher import CompletionWatcher
+from psweep.local_exec import core_slots, omp_env
+
+
+RESULT_PREFIX : str = 'RESULT\t'
+
+
+class WorkerPool(object):
+	"""runs configs on long-lived `hh_psweep --worker` processes, one per disjoint core set
+
+	a worker that crashes, or is terminated to cancel its current config,
+	is restarted when it gets the next config
+
+	### Parameters:
+	 - `threads_per_job : int`
+	   openMP threads (and cores) given to every worker
+	   (defaults to `1`)
+	 - `cores : Optional[Sequence[int]]`
+	   cores to use. if `None`, uses every core this process may run on
+	   (defaults to `None`)
+	 - `executable : str`
+	   path to the trainer
+	   (defaults to `'./hh_psweep'`)
+	 - `data_dir : str`
+	   where the trainer puts the run directories
+	   (defaults to `'../../psweep_data/'`)
+	 - `log_dir : Optional[str]`
+	   output of worker `k` goes to `{log_dir}worker-{k}.out`. if `None`, output is discarded
+	   (defaults to `'./'`)
+	 - `watcher : Optional[CompletionWatcher]`
+	   if given, configs that end without writing `DONE.txt` are marked as failed on it
+	   (defaults to `None`)
+	"""
+
+	def __init__(
+			self,
+			threads_per_job : int = 1,
+			cores : Optional[Sequence[int]] = None,
+			executable : str = './hh_psweep',
+			data_dir : str = '../../psweep_data/',
+			log_dir : Optional[str] = './',
+			watcher : Optional[CompletionWatcher] = None,
+		):
+		slots = core_slots(cores, threads_per_job)
+
+		self.threads_per_job = threads_per_job
+		self.executable = executable
+		self.data_dir = data_dir
+		self.log_dir = log_dir
+		self.watcher = watcher
+		self.n_slots = len(slots)
+
+		# `(cfg_ID, run_ID, future)`, or `None` to stop a worker
+		self._tasks : 'queue.Queue[Optional[Tuple[str, str, futures.Future]]]' = queue.Queue()
+
+		# `{run_ID}_ID{cfg_ID}` -> 0 if the config finished, 1 if the trainer reported
+		# an error, -1 if it was cancelled or the worker died
+		self.exit_codes : Dict[str, int] = dict()
+		# runs cancelled before a worker got to them
+		self._cancelled : Set[str] = set()
+		# worker index -> process, and the run it is training
+		self._procs : Dict[int, subprocess.Popen] = dict()
+		self._current : Dict[int, str] = dict()
+
+		self._threads = [
+			threading.Thread(target = self._serve, args = (k, slot), name = 'WorkerPool-%d' % k, daemon = True)
+			for k, slot in enumerate(slots)
+		]
+		for thread in self._threads:
+			thread.start()
+
+	def submit(self, cfg_ID : str, run_ID : str) -> 'futures.Future[int]':
+		"""queues a run, returns a future for its exit code (see `exit_codes`)"""
+		fut : futures.Future = futures.Future()
+		self._tasks.put((str(cfg_ID), run_ID, fut))
+		return fut
+
+	def cancel(self, cfg_ID : str, run_ID : str) -> None:
+		"""stops a run: terminates its worker if it is training it, otherwise it is skipped"""
+		name = '%s_ID%s' % (run_ID, cfg_ID)
+		self._cancelled.add(name)
+		for k, current in list(self._current.items()):
+			if current == name:
+				self._procs[k].terminate()
+
+	def shutdown(self, wait : bool = True) -> None:
+		"""lets every worker finish the queue, then closes their stdin so that they exit"""
+		for _ in self._threads:
+			self._tasks.put(None)
+		if wait:
+			for thread in self._threads:
+				thread.join()
+
+	def _start_worker(self, k : int, cores : Tuple[int, ...], log : Any) -> subprocess.Popen:
+		cmd = [ self.executable, str(self.threads_per_job), '--worker' ]
+		print('CALLING:\t%s\t(worker %d, cores %s)' % (' '.join(cmd), k, ','.join(str(c) for c in cores)))
+
+		proc = subprocess.Popen(
+			cmd,
+			stdin = subprocess.PIPE,
+			stdout = log,
+			stderr = subprocess.PIPE,
+			env = omp_env(cores),
+			universal_newlines = True,
+			bufsize = 1,
+		)
+		try:
+			os.sched_setaffinity(proc.pid, cores)
+		except ProcessLookupError:
+			pass
+		except OSError:
+			# cores this machine does not have, or may not use
+			proc.kill()
+			proc.wait()
+			raise
+		self._procs[k] = proc
+		return proc
+
+	def _train(self, proc : subprocess.Popen, cfg_ID : str, run_ID : str, log : Any) -> int:
+		"""hands one config to a worker, returns its exit code once the worker reports back"""
+		try:
+			proc.stdin.write('%s %s\n' % (cfg_ID, run_ID))
+			proc.stdin.flush()
+		except OSError:
+			return -1
+
+		for line in proc.stderr:
+			if not line.startswith(RESULT_PREFIX):
+				if log is not subprocess.DEVNULL:
+					log.write(line)
+				continue
+
+			fields = line.rstrip('\n').split('\t')
+			if len(fields) >= 4 and fields[1 : 3] == [ cfg_ID, run_ID ]:
+				if fields[3] != 'DONE':
+					print('> run failed:\t%s_ID%s\t%s' % (run_ID, cfg_ID, '\t'.join(fields[4:])))
+				return 0 if fields[3] == 'DONE' else 1
+
+		# stderr closed: the worker died, or was terminated to cancel this run
+		proc.wait()
+		return -1
+
+	def _mark_unfinished(self, name : str) -> None:
+		"""marks a run that did not write `DONE.txt` as failed on the watcher, so that nobody waits on it until timeout"""
+		if self.watcher is not None:
+			dirname = os.path.join(self.data_dir, name)
+			if not os.path.isfile(os.path.join(dirname, 'DONE.txt')):
+				self.watcher.mark(dirname, False)
+
+	def _serve(self, k : int, cores : Tuple[int, ...]) -> None:
+		if self.log_dir is None:
+			log = subprocess.DEVNULL
+		else:
+			log = open(os.path.join(self.log_dir, 'worker-%d.out' % k), 'a')
+
+		proc : Optional[subprocess.Popen] = None
+		try:
+			while True:
+				task = self._tasks.get()
+				if task is None:
+					break
+				cfg_ID, run_ID, fut = task
+				name = '%s_ID%s' % (run_ID, cfg_ID)
+
+				if not fut.set_running_or_notify_cancel():
+					continue
+				if name in self._cancelled:
+					self.exit_codes[name] = -1
+					fut.set_result(-1)
+					continue
+
+				self._current[k] = name
+				try:
+					if proc is None or proc.poll() is not None:
+						proc = self._start_worker(k, cores, log)
+					code = self._train(proc, cfg_ID, run_ID, log)
+				except Exception as e:
+					# keep serving the queue, whoever waits on this run gets the error
+					print('> worker %d could not train %s:\t%r' % (k, name, e))
+					self._mark_unfinished(name)
+					fut.set_exception(e)
+					continue
+				finally:
+					self._current.pop(k, None)
+
+				self.exit_codes[name] = code
+				if code < 0:
+					print('> worker %d died while training:\t%s' % (k, name))
+
+				self._mark_unfinished(name)
+				fut.set_result(code)
+		finally:
+			if proc is not None and proc.poll() is None:
+				proc.stdin.close()
+				proc.wait()
+			if log is not subprocess.DEVNULL:
+				log.close()
@@ -11,73 +11,450 @@ COMMAND is one of the following:
 
 - `indiv`
     `run_indiv()` -- launch slurm jobs with one set of parameters per job
+
+both submit slurm job arrays (see `psweep/slurm.py` and `myJobArray.sh`),
+so a whole sweep takes a handful of `sbatch` calls
+
+- `local`
+    `run_local()` -- run every config on this machine, without slurm, each pinned to its own cores.
+    with `--worker`, the trainer is kept running between configs
 """
 
 
 import sys
-from os import listdir, system
-from os.path import isfile, join
-import glob
+from os import listdir
+from os.path import isfile, join, lexists
 # import subprocess
+from typing import *
+
+from psweep.local_exec import LocalExecutor
+from psweep.worker_pool import WorkerPool
+from psweep.gen_configs import config_hash
+from psweep.result_cache import ResultCache, clear_run_dir
+from psweep.manifest import ConfigStore
+from psweep.registry import Registry
+from psweep.slurm import submit_array, SBATCH_CMD
+from psweep.cost_model import pack_lpt, time_limit, format_minutes
+from psweep.resources import ResourceModel, Request, sbatch_args, DEFAULT_CPUS, MEM_SAFETY
+
+
+# where `hh_psweep` puts the run directories
+DATA_DIR = "../../psweep_data/"
+
+
+def filter_cached(
+        run_ID : str, 
+        indices : Iterable[int], 
+        path : str = "psweep/config/", 
+        datadir : str = DATA_DIR,
+        registry : Optional[Registry] = None,
+    ) -> List[int]:
+    """drops configs whose hyperparameters already ran (under any run ID), returns the indices still to run
+
+    cached runs (finished, or still running) are linked into `datadir` as `{run_ID}_ID{n}`,
+    so they show up as part of this run when loading the data. if a `registry` is given,
+    they are recorded in it with the status of the cached run.
+    an earlier attempt left in the directory of a config that is run again is retired (see `result_cache.clear_run_dir`)
+    """
+
+    cache = ResultCache(datadir = datadir)
+    cache.refresh()
+    configs = ConfigStore(run_ID, path)
+
+    to_run = []
+    n_cached = 0
+    for i in indices:
+        name = f'{run_ID}_ID{i}'
+        cfg_hash = config_hash(configs[i])
+        status, cached = cache.lookup(cfg_hash)
+        if status is None:
+            if lexists(join(datadir, name)):
+                clear_run_dir(join(datadir, name) + '/')
+            to_run.append(i)
+        else:
+            cache.link(cached, name)
+            if registry is not None:
+                registry.set_status(run_ID, str(i), status, cfg_hash)
+            n_cached += 1
+
+    print(f'> result cache:\t{n_cached} configs already ran, {len(to_run)} left to run')
+    return to_run
+
+
+def open_registry(run_ID : str, path : str = "psweep/config/", datadir : str = DATA_DIR) -> Registry:
+    """the registry of `datadir`, with every config of `run_ID` registered (configs from before the registry existed, too)"""
+    registry = Registry(datadir)
+    n = registry.add_configs(run_ID, ConfigStore(run_ID, path))
+    if n:
+        print(f'> registry:\t{n} configs of {run_ID} were not registered yet')
+    return registry
+
+
+def chunks(indices : Sequence[int], n : int) -> List[List[str]]:
+    """splits `indices` into lists of at most `n` config IDs"""
+    return [ [ str(i) for i in indices[k : k + n] ] for k in range(0, len(indices), n) ]
+
+
+def pack_jobs(
+        run_ID : str,
+        indices : Sequence[int],
+        n_jobs : int,
+        model : ResourceModel,
+        path : str = "psweep/config/",
+    ) -> List[List[str]]:
+    """packs configs into `n_jobs` jobs (lists of config IDs) of roughly equal predicted runtime, see `psweep/cost_model.py`"""
+    configs = ConfigStore(run_ID, path)
+    costs = {
+        str(i) : model.runtime(configs[i])
+        for i in indices
+    }
+    jobs = pack_lpt(costs, n_jobs)
 
-def run_multi(run_ID : str, n_per_job : int, path : str = "psweep/config/", nthreads : int = 1):
+    loads = [ sum(costs[c] for c in job) for job in jobs ]
+    print(f'> packed {len(costs)} configs into {len(jobs)} jobs: longest {max(loads) / 3600:.2f}h, '
+          f'ideal {sum(loads) / len(jobs) / 3600:.2f}h')
+    return jobs
+
+
+def admit_configs(
+        run_ID : str,
+        indices : Sequence[int],
+        model : ResourceModel,
+        path : str = "psweep/config/",
+        cpus : int = DEFAULT_CPUS,
+        mem_safety : float = MEM_SAFETY,
+        registry : Optional[Registry] = None,
+    ) -> List[int]:
+    """drops configs that would not fit on any partition even as a job of their own, see `psweep/resources.py`
+
+    rejected configs are reported, and marked `'rejected'` in the `registry` if one is given
+    """
+    configs = ConfigStore(run_ID, path)
+    admitted = []
+    for i in indices:
+        request, reason = model.request([ configs[i] ], cpus, mem_safety = mem_safety)
+        if request is None:
+            print(f'> rejected:\t{run_ID}_ID{i}\t{reason}')
+            if registry is not None:
+                registry.set_status(run_ID, str(i), 'rejected')
+        else:
+            admitted.append(i)
+
+    if len(admitted) < len(indices):
+        print(f'> admission:\t{len(indices) - len(admitted)} configs rejected, {len(admitted)} left to run')
+    return admitted
+
+
+def group_by_request(
+        run_ID : str,
+        jobs : Sequence[Sequence[str]],
+        model : ResourceModel,
+        path : str = "psweep/config/",
+        cpus : int = DEFAULT_CPUS,
+        with_time : bool = True,
+        time_safety : float = 1.5,
+        mem_safety : float = MEM_SAFETY,
+    ) -> Dict[Request, List[List[str]]]:
+    """groups jobs by the slurm resources they need, so that each group can go out as one array
+
+    jobs that do not fit anywhere as a whole (too long together) are split into single configs
+    """
+    configs = ConfigStore(run_ID, path)
+    groups : Dict[Request, List[List[str]]] = dict()
+    for job in jobs:
+        request, _ = model.request([ configs[c] for c in job ], cpus, with_time, time_safety, mem_safety)
+        if request is not None:
+            groups.setdefault(request, []).append(list(job))
+            continue
+        # every config fits on its own, see `admit_configs`
+        for c in job:
+            request, _ = model.request([ configs[c] ], cpus, with_time, time_safety, mem_safety)
+            groups.setdefault(request, []).append([ c ])
+    return groups
+
+
+def submit_groups(
+        run_ID : str,
+        groups : Dict[Tuple[str, ...], List[List[str]]],
+        extra_args : Sequence[str] = (),
+        throttle : Optional[int] = None,
+        sbatch_cmd : str = SBATCH_CMD,
+        registry : Optional[Registry] = None,
+    ) -> Dict[str, str]:
+    """submits one job array per group of jobs, with the group's `sbatch` flags on top of `extra_args`
+
+    ### Returns:
+     - `Dict[str, str]`
+       slurm job id of every config submitted
+    """
+    job_ids : Dict[str, str] = dict()
+    for args, jobs in sorted(groups.items()):
+        job_ids.update(submit_array(
+            run_ID, 
+            jobs, 
+            throttle = throttle,
+            extra_args = list(extra_args) + list(args),
+            sbatch_cmd = sbatch_cmd,
+        ))
+        # as soon as every array is in, in case a later one fails
+        if registry is not None:
+            registry.submitted(run_ID, job_ids)
+    return job_ids
+
+
+def run_multi(
+        run_ID : str, 
+        n_per_job : int, 
+        path : str = "psweep/config/", 
+        nthreads : Optional[int] = None, 
+        use_cache : bool = True,
+        throttle : Optional[int] = None,
+        sbatch_cmd : str = SBATCH_CMD,
+        pack : bool = True,
+        n_jobs : Optional[int] = None,
+        time_safety : float = 1.5,
+        registry : bool = True,
+        admission : bool = True,
+        mem_safety : float = MEM_SAFETY,
+    ) -> Dict[str, str]:
     """launch slurm jobs with multiple threads and multiple parameter sets/runs per job
+
+    all jobs are submitted as slurm job arrays. by default, configs are packed into jobs
+    of roughly equal predicted runtime (see `pack_jobs`), and every job asks for the partition,
+    memory and `--time` matching its prediction (see `psweep/resources.py`) -- one array per distinct request.
+    configs that would not fit on any partition are not submitted
     
     ### Parameters:
      - `run_ID : str`   
        config file pattern
      - `n_per_job : int`   
-       number of runs per job
+       number of runs per job (on average, when packing)
      - `path : str`   
        where to look for config files
        (defaults to `"psweep/config/"`)
-     - `nthreads : int`   
-       number of threads per job
-       (defaults to `1`)
+     - `nthreads : Optional[int]`   
+       number of threads per job. if `None`, uses the default from `myJobArray.sh`
+       (defaults to `None`)
+     - `use_cache : bool`   
+       skip configs that already ran, see `filter_cached`
+       (defaults to `True`)
+     - `throttle : Optional[int]`   
+       maximum number of jobs running at once (per array of up to `MAX_ARRAY_SIZE` jobs)
+       (defaults to `None`)
+     - `sbatch_cmd : str`   
+       command used to submit, replace with a stand-in for testing
+       (defaults to `SBATCH_CMD`)
+     - `pack : bool`   
+       pack by predicted runtime. if `False`, configs are split into chunks of `n_per_job` in order,
+       with the time limit from `myJobArray.sh`
+       (defaults to `True`)
+     - `n_jobs : Optional[int]`   
+       number of jobs to pack into, for example the number of nodes available. 
+       if `None`, enough jobs for `n_per_job` runs each
+       (defaults to `None`)
+     - `time_safety : float`   
+       `--time` is the predicted runtime of a job times this, rounded up to one of `cost_model.TIME_BUCKETS`
+       (defaults to `1.5`)
+     - `registry : bool`   
+       record the configs and their jobs in the registry of `DATA_DIR`, see `psweep/registry.py`
+       (defaults to `True`)
+     - `admission : bool`   
+       predict the memory of every job, reject configs that fit nowhere and pick the partition and
+       `--mem-per-cpu` for the rest. if `False`, the resources from the job script are used
+       (defaults to `True`)
+     - `mem_safety : float`   
+       memory requested is the predicted peak times this
+       (defaults to `MEM_SAFETY`)
+
+    ### Returns:
+     - `Dict[str, str]`
+       slurm job id of each config
     """
 
     # configfiles = [f for f in listdir(path) if isfile(join(path, f)) and f ]
-    configfiles = glob.glob(path + run_ID + '_*')
-    n = len(configfiles)
+    # from the run's manifest if there is one, so large sweeps do not need a glob
+    n = len(ConfigStore(run_ID, path))
+
+    reg = open_registry(run_ID, path) if registry else None
+
+    indices = list(range(0, n))
+    if use_cache:
+        indices = filter_cached(run_ID, indices, path, registry = reg)
+
+    if not indices:
+        return dict()
+
+    extra_args = [] if nthreads is None else [ f'--cpus-per-task={nthreads}' ]
+    cpus = DEFAULT_CPUS if nthreads is None else nthreads
 
-    if n % n_per_job != 0:
-        Warning(f'n_per_job ({n_per_job}) does not divide the number of config files ({n}). things might be buggy')
-        str_cont = input('press enter to continue, or Ctrl+C to exit')
-        if str_cont in 'exit 0 n N no No'.split(' '):
-            exit(1)
+    model = ResourceModel(DATA_DIR) if pack or admission else None
+    if admission:
+        indices = admit_configs(run_ID, indices, model, path, cpus, mem_safety, reg)
+        if not indices:
+            return dict()
 
-    for i in range(0, n, n_per_job):
-        cmd = "sbatch --job-name=HH_" + run_ID + " myJobIndividual.sh "
-        cmd += " " + str(i)
-        cmd += " " + str(n_per_job + i)
-        cmd += " " + run_ID
-        print("CALLING " + cmd)
-        system(cmd)
+    if pack:
+        if n_jobs is None:
+            n_jobs = -(-len(indices) // n_per_job)
+        jobs = pack_jobs(run_ID, indices, n_jobs, model, path)
+    else:
+        jobs = chunks(indices, n_per_job)
 
+    groups : Dict[Tuple[str, ...], List[List[str]]] = dict()
+    if admission:
+        for request, group in group_by_request(run_ID, jobs, model, path, cpus, pack, time_safety, mem_safety).items():
+            groups[tuple(sbatch_args(request))] = group
+    elif pack:
+        # only the time limit, the rest comes from the job script
+        configs = ConfigStore(run_ID, path)
+        for job in jobs:
+            minutes = time_limit(sum(model.runtime(configs[c]) for c in job), time_safety)
+            groups.setdefault(( '--time=' + format_minutes(minutes), ), []).append(job)
+    else:
+        groups[()] = list(jobs)
 
+    return submit_groups(run_ID, groups, extra_args, throttle, sbatch_cmd, reg)
 
-def run_indiv(run_ID : str, path : str = "psweep/config/"):
+
+
+def run_indiv(
+        run_ID : str, 
+        path : str = "psweep/config/", 
+        use_cache : bool = True,
+        throttle : Optional[int] = None,
+        sbatch_cmd : str = SBATCH_CMD,
+        registry : bool = True,
+        admission : bool = True,
+        mem_safety : float = MEM_SAFETY,
+    ) -> Dict[str, str]:
     """launch slurm jobs with one set of parameters per job
 
+    all jobs are submitted as slurm job arrays, one array task per config,
+    and one array per partition and memory request (see `psweep/resources.py`)
+
     ### Parameters:
      - `run_ID : str`   
        config file pattern
      - `path : str`   
        where to look for config files
        (defaults to `"psweep/config/"`)
+     - `use_cache : bool`   
+       skip configs that already ran, see `filter_cached`
+       (defaults to `True`)
+     - `throttle : Optional[int]`   
+       maximum number of jobs running at once (per array of up to `MAX_ARRAY_SIZE` jobs)
+       (defaults to `None`)
+     - `sbatch_cmd : str`   
+       command used to submit, replace with a stand-in for testing
+       (defaults to `SBATCH_CMD`)
+     - `registry : bool`   
+       record the configs and their jobs in the registry of `DATA_DIR`, see `psweep/registry.py`
+       (defaults to `True`)
+     - `admission : bool`   
+       reject configs that fit on no partition, and pick the partition and `--mem-per-cpu` for the rest.
+       if `False`, the resources from the job script are used
+       (defaults to `True`)
+     - `mem_safety : float`   
+       memory requested is the predicted peak times this
+       (defaults to `MEM_SAFETY`)
+
+    ### Returns:
+     - `Dict[str, str]`
+       slurm job id of each config
     """
     
 
-    configfiles = glob.glob(path + run_ID + '_*')
-    n = len(configfiles)
+    n = len(ConfigStore(run_ID, path))
+
+    reg = open_registry(run_ID, path) if registry else None
+
+    indices = list(range(0, n))
+    if use_cache:
+        indices = filter_cached(run_ID, indices, path, registry = reg)
+
+    if not indices:
+        return dict()
+
+    groups : Dict[Tuple[str, ...], List[List[str]]] = dict()
+    if admission:
+        model = ResourceModel(DATA_DIR)
+        indices = admit_configs(run_ID, indices, model, path, mem_safety = mem_safety, registry = reg)
+        jobs = chunks(indices, 1)
+        for request, group in group_by_request(run_ID, jobs, model, path, with_time = False, mem_safety = mem_safety).items():
+            groups[tuple(sbatch_args(request))] = group
+    else:
+        groups[()] = chunks(indices, 1)
+
+    return submit_groups(run_ID, groups, throttle = throttle, sbatch_cmd = sbatch_cmd, registry = reg)
+
+
+
+def run_local(
+        run_ID : str, 
+        path : str = "psweep/config/", 
+        nthreads : int = 1, 
+        cores : Optional[List[int]] = None,
+        use_cache : bool = True,
+        worker : bool = False,
+        registry : bool = True,
+    ) -> Dict[str, int]:
+    """run every config on this machine, without slurm
+
+    runs are pinned to disjoint sets of `nthreads` cores each, and at most
+    `len(cores) // nthreads` of them are active at once. blocks until all runs are finished
+
+    ### Parameters:
+     - `run_ID : str`   
+       config file pattern
+     - `path : str`   
+       where to look for config files
+       (defaults to `"psweep/config/"`)
+     - `nthreads : int`   
+       number of openMP threads (and cores) per run
+       (defaults to `1`)
+     - `cores : Optional[List[int]]`   
+       cores to use. if `None`, uses all the cores available to this process
+       (defaults to `None`)
+     - `use_cache : bool`   
+       skip configs that already ran, see `filter_cached`
+       (defaults to `True`)
+     - `worker : bool`   
+       keep one `hh_psweep --worker` process per core set alive, instead of launching
+       the trainer for every config (see `psweep/worker_pool.py`)
+       (defaults to `False`)
+     - `registry : bool`   
+       record the configs and their jobs in the registry of `DATA_DIR`, see `psweep/registry.py`
+       (defaults to `True`)
+
+    ### Returns:
+     - `Dict[str, int]`
+       exit code of each run, by `{run_ID}_ID{n}`
+    """
+
+    n = len(ConfigStore(run_ID, path))
+
+    reg = open_registry(run_ID, path) if registry else None
+
+    indices = list(range(0, n))
+    if use_cache:
+        indices = filter_cached(run_ID, indices, path, registry = reg)
+
+    executor_cls = WorkerPool if worker else LocalExecutor
+    executor = executor_cls(threads_per_job = nthreads, cores = cores, data_dir = DATA_DIR)
+    print(f'running {len(indices)} configs locally, {executor.n_slots} at a time with {nthreads} threads each')
+
+    if reg is not None:
+        reg.submitted(run_ID, { str(i) : 'local' for i in indices })
+    for i in indices:
+        executor.submit(str(i), run_ID)
+    executor.shutdown(wait = True)
+    if reg is not None:
+        reg.sync(run_ID)
+
+    n_failed = sum(1 for code in executor.exit_codes.values() if code != 0)
+    print(f'done: {len(indices) - n_failed} succeeded, {n_failed} failed')
 
-    for i in range(0, n):
-        cmd = "sbatch --job-name=HH_" + run_ID + " myJobIndividual.sh "
-        cmd += " " + str(i)
-        cmd += " " + str(i)
-        cmd += " " + run_ID
-        print("CALLING " + cmd)
-        system(cmd)
+    return executor.exit_codes
 
 
 
@@ -86,5 +463,6 @@ if __name__ == '__main__':
     fire.Fire({
         'multi' : run_multi,
         'indiv' : run_indiv,
+        'local' : run_local,
     })
 
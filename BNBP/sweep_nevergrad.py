@@ -1,17 +1,29 @@
+import os
 from os import listdir, system
 from os.path import isfile, join
 import sys
 from typing import *
 from copy import deepcopy
-from time import sleep
 from concurrent import futures
+import asyncio
 
 from hashlib import md5
 import numpy as np
 import nevergrad as ng
 
 import psweep.psweep as ps
-from psweep.gen_configs import dict_to_string,collapse_dict
+from psweep.gen_configs import collapse_dict,config_hash
+from psweep.watcher import CompletionWatcher
+from psweep.local_exec import LocalExecutor
+from psweep.worker_pool import WorkerPool
+import psweep.result_cache as result_cache
+from psweep.result_cache import ResultCache, run_status, retire_run, PRUNED_FILE
+from psweep.slurm import ArraySubmitter, job_alive
+from psweep.halving import LossTail, RungTracker, rung_rows
+from psweep.ledger import SweepLedger
+from psweep.manifest import append_row, manifest_path, ConfigStore
+from psweep.resources import ResourceModel, sbatch_args, MEM_SAFETY
+from psweep.registry import Registry
 
 Num = Union[float,int]
 
@@ -22,6 +34,68 @@ WALLTIME_WAIT : float = 1.0
 # maximum steps of `WALLTIME_WAIT` before aborting
 WALLTIME_LIMIT : int = 10000
 
+# where `hh_psweep` puts the run directories
+DATA_DIR : str = '../../psweep_data/'
+
+# shared by every evaluation waiting on a result, see `get_watcher()`
+WATCHER : Optional[CompletionWatcher] = None
+
+# where to run the trainer, one of the keys of `RUN_BACKENDS`
+BACKEND : str = 'sbatch'
+
+# used by the 'sbatch' backend, one per run ID, see `get_array_submitter()`
+ARRAY_SUBMITTERS : Dict[str, ArraySubmitter] = dict()
+# maximum number of array tasks running at the same time, `None` for no limit
+ARRAY_THROTTLE : Optional[int] = None
+# whether the 'sbatch' backend asks for the partition, memory and time each config needs,
+# and rejects configs that fit nowhere, see `psweep/resources.py` and `get_resource_model()`
+ADMISSION : bool = True
+MEM_SAFETY_FACTOR : float = MEM_SAFETY
+RESOURCE_MODEL : Optional[ResourceModel] = None
+# `(run_ID, cfg_ID)` of configs rejected by admission, these never run
+REJECTED : Set[Tuple[str, str]] = set()
+
+# used by the 'local' backend, see `get_local_executor()`
+LOCAL_EXECUTOR : Optional[LocalExecutor] = None
+# used by the 'worker' backend, see `get_worker_pool()`
+WORKER_POOL : Optional[WorkerPool] = None
+# openMP threads (and pinned cores) per run for the 'local' and 'worker' backends
+THREADS_PER_JOB : int = 1
+
+# whether to answer configs that already ran from `psweep_data`, see `get_result_cache()`
+USE_CACHE : bool = True
+# what to do with cached runs that finished without a result, 'retry' or 'reuse'
+CACHE_ON_FAILED : str = 'retry'
+RESULT_CACHE : Optional[ResultCache] = None
+
+# loss reported to the optimizer when an evaluation fails (same as 0% accuracy)
+FAILED_LOSS : float = 100.0
+
+# successive halving rungs, as fractions of a full run (see `psweep/halving.py`).
+# `None` to always train to completion
+HALVING_RUNGS : Optional[List[float]] = None
+# only the best `1 / HALVING_ETA` of runs at each rung continue
+HALVING_ETA : float = 3.0
+# seconds between reads of `loss.txt` of a running job
+HALVING_POLL : float = 60.0
+HALVING_TRACKER : Optional[RungTracker] = None
+# loss told to the optimizer for runs stopped early
+PRUNED_LOSS : float = FAILED_LOSS
+
+# evaluations in flight in the async driver, by `CONFIG_ID`.
+# if the optimizer proposes the same config twice, both share one run
+INFLIGHT : Dict[str, 'asyncio.Future[float]'] = dict()
+
+# records asks, submissions and tells, for resuming the sweep after a crash.
+# `None` when not checkpointing
+LEDGER : Optional[SweepLedger] = None
+# attribute of a dumped optimizer holding the number of ledger results it knows, see `save_checkpoint()`
+LEDGER_TOLD_ATTR : str = 'ledger_told'
+
+# whether to record configs, submissions and results in the registry of `DATA_DIR`, see `get_registry()`
+USE_REGISTRY : bool = True
+REGISTRY : Optional[Registry] = None
+
 # GLOBAL_ID_COUNTER = 1
 
 SWEEP_TYPE_TO_NG_FUNC = {
@@ -85,15 +159,12 @@ def create_config(
 	# create filename
 	fname = '%s_ID%s' % (c['RUN_ID'], c['CONFIG_ID'])
 	c['DIRNAME'] = fname
-	fname = cfg_dir + fname + '.txt'
 
-	# convert each combo to string and save
-	with open(fname, 'w') as fout:
-		print(
-			dict_to_string(c, default_data, default_order),
-			file = fout,
-		)
-	# print('> created file:\t' + fname)
+	# add it to the run's manifest, unless it is already there
+	append_row(manifest_path(run_ID, cfg_dir), c, default_order)
+	if USE_REGISTRY:
+		get_registry().add_configs(run_ID, [ c ], default_data)
+	# print('> added to manifest:\t' + fname)
 
 	return cfg_ID
 
@@ -114,41 +185,291 @@ def run_on_config_sbatch(
 	system(cmd)
 
 
-def run_on_config_basic(
+def get_local_executor() -> LocalExecutor:
+	"""returns the global `LocalExecutor`, creating it on first use with `THREADS_PER_JOB` threads per run"""
+	global LOCAL_EXECUTOR
+	if LOCAL_EXECUTOR is None:
+		LOCAL_EXECUTOR = LocalExecutor(
+			threads_per_job = THREADS_PER_JOB,
+			data_dir = DATA_DIR,
+			watcher = get_watcher(),
+		)
+	return LOCAL_EXECUTOR
+
+
+def run_on_config_local(
 		cfg_ID : str,
 		run_ID : str,
 		cfg_dir : str,
-	):
+	) -> None:
+	"""queues the run on the local machine, pinned to its own cores. returns immediately"""
+	get_local_executor().submit(cfg_ID, run_ID)
+
+
+def get_worker_pool() -> WorkerPool:
+	"""returns the global `WorkerPool`, starting it on first use with `THREADS_PER_JOB` threads per worker"""
+	global WORKER_POOL
+	if WORKER_POOL is None:
+		WORKER_POOL = WorkerPool(
+			threads_per_job = THREADS_PER_JOB,
+			data_dir = DATA_DIR,
+			watcher = get_watcher(),
+		)
+	return WORKER_POOL
+
+
+def run_on_config_worker(
+		cfg_ID : str,
+		run_ID : str,
+		cfg_dir : str,
+	) -> None:
+	"""queues the run for the next free `hh_psweep --worker` process. returns immediately"""
+	get_worker_pool().submit(cfg_ID, run_ID)
+
+
+def get_array_submitter(run_ID : str) -> ArraySubmitter:
+	"""returns the `ArraySubmitter` for `run_ID`, creating it on first use"""
+	if run_ID not in ARRAY_SUBMITTERS:
+		ARRAY_SUBMITTERS[run_ID] = ArraySubmitter(
+			run_ID = run_ID,
+			throttle = ARRAY_THROTTLE,
+			# wake up whoever waits on configs that could not be submitted
+			on_error = lambda cfg_IDs : [
+				get_watcher().mark(DATA_DIR + '%s_ID%s' % (run_ID, c), False)
+				for c in cfg_IDs
+			],
+			on_submitted = lambda job_ids : record_submitted(run_ID, job_ids),
+		)
+	return ARRAY_SUBMITTERS[run_ID]
+
+
+def get_resource_model() -> ResourceModel:
+	"""returns the global `ResourceModel` of `DATA_DIR`, fitting it on first use"""
+	global RESOURCE_MODEL
+	if RESOURCE_MODEL is None:
+		RESOURCE_MODEL = ResourceModel(DATA_DIR)
+	return RESOURCE_MODEL
+
+
+def run_on_config_array(
+		cfg_ID : str,
+		run_ID : str,
+		cfg_dir : str,
+	) -> None:
+	"""queues the config for the next slurm job array of `run_ID`. returns immediately
+
+	with `ADMISSION`, the config goes into an array with the resources it needs,
+	and a config that fits on no partition is failed right away instead
+	"""
+	if not ADMISSION:
+		get_array_submitter(run_ID).submit(cfg_ID)
+		return
+
+	request, reason = get_resource_model().request(
+		[ ConfigStore(run_ID, cfg_dir)[cfg_ID] ],
+		mem_safety = MEM_SAFETY_FACTOR,
+	)
+	if request is None:
+		print('> rejected:\t%s_ID%s\t%s' % (run_ID, cfg_ID, reason))
+		REJECTED.add((run_ID, cfg_ID))
+		if USE_REGISTRY:
+			get_registry().set_status(run_ID, cfg_ID, 'rejected')
+		get_watcher().mark(DATA_DIR + '%s_ID%s' % (run_ID, cfg_ID), False)
+		return
+
+	get_array_submitter(run_ID).submit(cfg_ID, sbatch_args(request))
+
+
+RUN_BACKENDS : Dict[str, Callable[..., None]] = {
+	'sbatch' : run_on_config_array,
+	'sbatch_single' : run_on_config_sbatch,
+	'local' : run_on_config_local,
+	'worker' : run_on_config_worker,
+}
+
+
+def cancel_run_array(
+		cfg_ID : str,
+		run_ID : str,
+	) -> None:
+	job_id = get_array_submitter(run_ID).job_ids.get(cfg_ID, None)
+	if job_id is None:
+		print('> cannot cancel %s_ID%s: no slurm job id known' % (run_ID, cfg_ID))
+		return
+	system('scancel ' + job_id)
+
+
+def cancel_run_sbatch(
+		cfg_ID : str,
+		run_ID : str,
+	) -> None:
+	# jobs from `run_on_config_sbatch` are only known by name
+	system('scancel --name=HH_' + run_ID + '_ID' + cfg_ID)
+
+
+def cancel_run_local(
+		cfg_ID : str,
+		run_ID : str,
+	) -> None:
+	get_local_executor().cancel(cfg_ID, run_ID)
+
+
+def cancel_run_worker(
+		cfg_ID : str,
+		run_ID : str,
+	) -> None:
+	get_worker_pool().cancel(cfg_ID, run_ID)
+
+
+# how to stop a run early, for each of `RUN_BACKENDS`
+CANCEL_BACKENDS : Dict[str, Callable[..., None]] = {
+	'sbatch' : cancel_run_array,
+	'sbatch_single' : cancel_run_sbatch,
+	'local' : cancel_run_local,
+	'worker' : cancel_run_worker,
+}
+
+
+def is_alive_array(
+		cfg_ID : str,
+		run_ID : str,
+	) -> bool:
+	job_id = get_array_submitter(run_ID).job_ids.get(cfg_ID, None)
+	return job_id is not None and job_alive(job_id = job_id)
+
+
+def is_alive_sbatch(
+		cfg_ID : str,
+		run_ID : str,
+	) -> bool:
+	return job_alive(name = 'HH_' + run_ID + '_ID' + cfg_ID)
+
+
+def is_alive_local(
+		cfg_ID : str,
+		run_ID : str,
+	) -> bool:
+	# local runs die with the driver
+	return False
+
+
+# whether a run submitted before a restart is still queued or running, for each of `RUN_BACKENDS`
+ALIVE_BACKENDS : Dict[str, Callable[..., bool]] = {
+	'sbatch' : is_alive_array,
+	'sbatch_single' : is_alive_sbatch,
+	'local' : is_alive_local,
+	'worker' : is_alive_local,
+}
+
+
+def get_watcher() -> CompletionWatcher:
+	"""returns the global `CompletionWatcher`, starting it on first use
+
+	`WALLTIME_WAIT` is used as the scan interval, with or without inotify: inotify does not
+	see `DONE.txt` written by compute nodes over lustre or nfs
+	"""
+	global WATCHER
+	if WATCHER is None:
+		WATCHER = CompletionWatcher(interval = WALLTIME_WAIT, rescan_interval = WALLTIME_WAIT)
+	return WATCHER.start()
+
+
+def wait_for_done(dirname : str) -> bool:
+	"""blocks until `DONE.txt` shows up in `dirname`, for at most `WALLTIME_WAIT * WALLTIME_LIMIT` seconds
+
+	returns `False` if the run timed out or was marked as failed
+	"""
+	return get_watcher().wait(dirname, timeout = WALLTIME_WAIT * WALLTIME_LIMIT)
 
-	cmd = "./hh_psweep 1 {cfg_ID} {run_ID}".format(cfg_ID = cfg_ID, run_ID = run_ID)
-	print('CALLING:\t' + cmd)
-	system(cmd)
+
+async def wait_for_done_async(dirname : str) -> bool:
+	"""like `wait_for_done`, but awaitable. no thread is blocked while waiting"""
+	loop = asyncio.get_running_loop()
+	fut : asyncio.Future[bool] = loop.create_future()
+
+	def _set(found : bool) -> None:
+		if not fut.done():
+			fut.set_result(found)
+
+	# the callback runs on the watcher thread, hand the result over to the loop
+	event = get_watcher().register(dirname, lambda _, found : loop.call_soon_threadsafe(_set, found))
+
+	try:
+		return await asyncio.wait_for(fut, timeout = WALLTIME_WAIT * WALLTIME_LIMIT)
+	except asyncio.TimeoutError:
+		return False
+	finally:
+		get_watcher().unregister(dirname, event)
 
 
 def read_accuracy(
 		dirname : str,
 	):
 
-#	print('> reading file:\t')
+	if not wait_for_done(dirname):
+		print('\n\n\nABORTING: process took too long or failed. returning accuracy of 0 \n%s' % dirname)
+		return 0.0
 
-	i = 0
-	while not isfile(dirname + 'DONE.txt'):
-		if i > WALLTIME_LIMIT:
-			print('\n\n\nABORTING: process took too long. returning accuracy of 0 \n%s' % dirname)
-			return 0.0
+	return parse_accuracy(dirname)
 
-		# print('waiting...\ti=\t%i' % i, end = '\r')
-		sleep(WALLTIME_WAIT)
-		i += 1 
 
-#	print('\n> found file!')
+async def read_accuracy_async(
+		dirname : str,
+	):
+
+	if not await wait_for_done_async(dirname):
+		print('\n\n\nABORTING: process took too long or failed. returning accuracy of 0 \n%s' % dirname)
+		return 0.0
+
+	return parse_accuracy(dirname)
+
+
+async def read_accuracy_halving(
+		dirname : str,
+		cfg_ID : str,
+		run_ID : str,
+		config : Dict[str, Any],
+	) -> Optional[float]:
+	"""like `read_accuracy_async`, but stops the run at a rung if `HALVING_TRACKER` says so
+
+	returns `None` if the run was stopped. a `PRUNED.txt` marker is left in its directory
+	"""
+	tail = LossTail(dirname + 'loss.txt')
+	rows = rung_rows(config, HALVING_RUNGS)
+	done = asyncio.ensure_future(read_accuracy_async(dirname))
+
+	rung = 0
+	while rung < len(rows):
+		finished, _ = await asyncio.wait([done], timeout = HALVING_POLL)
+		if finished:
+			break
+
+		n_rows = tail.poll()
+		while rung < len(rows) and n_rows >= rows[rung]:
+			loss = tail.recent_loss()
+			if not HALVING_TRACKER.report(rung, loss):
+				print('> stopping at rung %d (%d rows, loss %s):\t%s' % (rung, n_rows, str(loss), dirname))
+				done.cancel()
+				with open(dirname + PRUNED_FILE, 'w') as fout:
+					print('rung\t%d\nrows\t%d\nloss\t%s' % (rung, n_rows, str(loss)), file = fout)
+				CANCEL_BACKENDS[BACKEND](cfg_ID = cfg_ID, run_ID = run_ID)
+				get_watcher().mark(dirname, False)
+				return None
+			rung += 1
+
+	return await done
+
+
+def parse_accuracy(
+		dirname : str,
+	):
+	"""reads the final test accuracy from a finished run"""
 
 	try:
 		data = np.genfromtxt(dirname + 'percent0.txt')
-	except ValueError:
+		accuracy = data[-1, -1]
+	except (ValueError, OSError, IndexError):
 		return 0.0
-	
-	accuracy = data[-1, -1]
 
 	print('> dirname:\t%s\n\taccuracy:\t%s' % (dirname, str(accuracy)))
 
@@ -160,35 +481,102 @@ def read_loss(
 		last_n : int = 5,
 	):
 
-	# print('> reading file:\t')
+	if not wait_for_done(dirname):
+		print('\n\n\nABORTING: process took too long or failed. returning NAN loss \n%s' % dirname)
+		return float('nan')
 
-	i = 0
-	while not isfile(dirname + 'DONE.txt'):
-		if i > WALLTIME_LIMIT:
-			print('\n\n\nABORTING: process took too long. returning NAN loss \n%s' % dirname)
-			return float('nan')
+	from psweep.psweep_load import read_loss_metrics
+	avg_final_loss = read_loss_metrics(dirname + 'loss.txt', last_n = last_n)['abs']
 
-		# print('waiting...\ti=\t%i' % i, end = '\r')
-		sleep(WALLTIME_WAIT)
-		i += 1 
+	print('> dirname:\t%s\n\tloss:\t%s' % (dirname, str(avg_final_loss)))
 
-	# print('\n> found file!')
+	return avg_final_loss
 
-	try:
-		data = np.genfromtxt(dirname + 'loss.txt', delimiter=',')
-	except ValueError:
-		return float('nan')
 
-	try:
-		data = data[:,:-1]
-	except:
-		return float('nan')
-	
-	avg_final_loss = np.average(data[-last_n:])
+def get_registry() -> Registry:
+	"""returns the global `Registry` of `DATA_DIR`, opening it on first use"""
+	global REGISTRY
+	if REGISTRY is None:
+		REGISTRY = Registry(DATA_DIR)
+	return REGISTRY
 
-	print('> dirname:\t%s\n\tloss:\t%s' % (dirname, str(avg_final_loss)))
 
-	return avg_final_loss
+def record_submitted(run_ID : str, job_ids : Dict[str, str]) -> None:
+	"""records submitted configs (`cfg_ID -> job id`) in the ledger and the registry"""
+	if LEDGER is not None:
+		LEDGER.submitted(job_ids)
+	if USE_REGISTRY:
+		get_registry().submitted(run_ID, job_ids)
+
+
+def record_result(
+		run_ID : str,
+		cfg_ID : str,
+		dirname : str,
+		percent : Optional[float],
+	) -> None:
+	"""records the outcome of an evaluation in the registry. `percent` is `None` for runs stopped early"""
+	if not USE_REGISTRY or (run_ID, cfg_ID) in REJECTED:
+		# rejected configs keep the status they got on rejection
+		return
+	status = 'pruned' if percent is None else run_status(dirname)
+	get_registry().set_status(
+		run_ID, cfg_ID, status,
+		test_accuracy = float(percent) if status == 'done' else None,
+	)
+
+
+def get_result_cache() -> ResultCache:
+	"""returns the global `ResultCache`, indexing `DATA_DIR` on first use"""
+	global RESULT_CACHE
+	if RESULT_CACHE is None:
+		RESULT_CACHE = ResultCache(datadir = DATA_DIR, on_failed = CACHE_ON_FAILED)
+		n = RESULT_CACHE.refresh()
+		print('> result cache:\tindexed %d new runs' % n)
+	return RESULT_CACHE
+
+
+def lookup_cached(
+		params : Dict[str, Num],
+		run_ID : str,
+		cfg_ID : str,
+		default_data : dict = ps.CONSTS_DEFAULT,
+	) -> Tuple[Optional[str], str]:
+	"""checks the result cache for `params`
+
+	### Returns:
+	 - `Tuple[Optional[str], str]`
+	   the cache status (`None` on a miss) and the run directory to read the result from.
+	   finished (or pruned) cached runs are linked as `{run_ID}_ID{cfg_ID}` so that they show up under this run
+	"""
+	dirname = DATA_DIR + '{run_ID}_ID{cfg_ID}/'.format(cfg_ID = cfg_ID, run_ID = run_ID)
+	if not USE_CACHE:
+		return (None, dirname)
+
+	status, cached = get_result_cache().lookup(config_hash({**default_data, **params}))
+	if status in ('done', 'failed', 'pruned'):
+		print('> cache hit (%s):\t%s\t-> %s' % (status, dirname, cached))
+		return (status, get_result_cache().link(cached, os.path.basename(os.path.normpath(dirname))))
+	elif status == 'running':
+		print('> cache hit (still running):\t%s\t-> %s' % (dirname, cached))
+		return (status, cached)
+
+	return (None, dirname)
+
+
+def clear_run_dir(dirname : str) -> None:
+	"""`result_cache.clear_run_dir`, and the watcher forgets the earlier attempt"""
+	result_cache.clear_run_dir(dirname)
+	get_watcher().forget(dirname)
+
+
+def record_cached(
+		params : Dict[str, Num],
+		dirname : str,
+		default_data : dict = ps.CONSTS_DEFAULT,
+	) -> None:
+	if USE_CACHE:
+		get_result_cache().record(config_hash({**default_data, **params}), dirname)
 
 
 def eval_parameter_set(
@@ -208,17 +596,30 @@ def eval_parameter_set(
 		default_order = default_order,
 	)
 
-	# run the C++ code
-	# run_on_config(
-	run_on_config_sbatch(
-		cfg_ID = cfg_ID,
-		run_ID = run_ID,
-		cfg_dir = cfg_dir,
-	)
+	status, dirname = lookup_cached(params, run_ID, cfg_ID, default_data)
+
+	if status is None:
+		clear_run_dir(dirname)
+		# run the C++ code
+		RUN_BACKENDS[BACKEND](
+			cfg_ID = cfg_ID,
+			run_ID = run_ID,
+			cfg_dir = cfg_dir,
+		)
+		# job arrays are recorded once they are submitted, see `get_array_submitter()`
+		if BACKEND != 'sbatch':
+			record_submitted(run_ID, { cfg_ID : BACKEND })
+
+	if status == 'pruned':
+		# stopped early by an earlier sweep, it has no final accuracy to wait for
+		record_result(run_ID, cfg_ID, dirname, None)
+		return PRUNED_LOSS
 
 	# read the output accuracy
-#	loss = read_loss('../../psweep_data/{run_ID}_ID{cfg_ID}/'.format(cfg_ID = cfg_ID, run_ID = run_ID))
-	percent = read_accuracy('../../psweep_data/{run_ID}_ID{cfg_ID}/'.format(cfg_ID = cfg_ID, run_ID = run_ID))
+#	loss = read_loss(dirname)
+	percent = read_accuracy(dirname)
+	record_cached(params, dirname, default_data)
+	record_result(run_ID, cfg_ID, dirname, percent)
 	return 100 - percent
 
 
@@ -229,6 +630,351 @@ def eval_wrapper(**kwargs):
 	return loss
 
 
+async def eval_parameter_set_async(
+		params : Dict[str, Num],
+		run_ID : str = 'NG_CROSS',
+		cfg_dir : str = 'psweep/config/',
+		default_data : dict = ps.CONSTS_DEFAULT,
+		default_order : Sequence = ps.CONSTS_DEFAULT_KEYS,
+		attach : bool = False,
+	) -> float:
+	"""same as `eval_parameter_set`, but as a coroutine
+
+	duplicate proposals (same `CONFIG_ID`) that are in flight at the same time share a single run.
+	with `attach`, the run is assumed to be submitted already (by a previous driver process)
+	and only waited on
+	"""
+
+	cfg_ID = create_config(
+		params = params,
+		run_ID = run_ID,
+		cfg_dir = cfg_dir,
+		default_data = default_data,
+		default_order = default_order,
+	)
+
+	if cfg_ID in INFLIGHT:
+		return await asyncio.shield(INFLIGHT[cfg_ID])
+
+	async def _run() -> float:
+		status, dirname = lookup_cached(params, run_ID, cfg_ID, default_data)
+
+		if status is None and not attach:
+			clear_run_dir(dirname)
+			# submitting only takes a moment, but it is blocking -- keep it off the event loop
+			await asyncio.get_running_loop().run_in_executor(
+				None,
+				lambda : RUN_BACKENDS[BACKEND](
+					cfg_ID = cfg_ID,
+					run_ID = run_ID,
+					cfg_dir = cfg_dir,
+				),
+			)
+			# job arrays are recorded once they are submitted, see `get_array_submitter()`
+			if BACKEND != 'sbatch':
+				record_submitted(run_ID, { cfg_ID : BACKEND })
+
+		if status == 'pruned':
+			percent = None
+		elif status is None and HALVING_RUNGS:
+			# only our own runs are stopped early, not cached runs shared with someone else
+			percent = await read_accuracy_halving(
+				dirname, cfg_ID, run_ID, 
+				config = {**default_data, **params},
+			)
+		else:
+			percent = await read_accuracy_async(dirname)
+
+		record_cached(params, dirname, default_data)
+		record_result(run_ID, cfg_ID, dirname, percent)
+		if percent is None:
+			return PRUNED_LOSS
+		return 100 - percent
+
+	INFLIGHT[cfg_ID] = asyncio.ensure_future(_run())
+	try:
+		return await asyncio.shield(INFLIGHT[cfg_ID])
+	finally:
+		INFLIGHT.pop(cfg_ID, None)
+
+
+async def eval_wrapper_async(**kwargs) -> float:
+	return await eval_parameter_set_async(
+		params = kwargs,
+	)
+
+
+async def minimize_async(
+		optimizer : ng.optimizers.base.Optimizer,
+		func : Callable[..., Awaitable[float]],
+		max_inflight : int,
+		resumed : Sequence[Tuple[ng.p.Parameter, str, Awaitable[float]]] = (),
+		n_asked : Optional[int] = None,
+		ledger : Optional[SweepLedger] = None,
+		checkpoint_file : Optional[str] = None,
+		checkpoint_every : float = 300.0,
+	) -> ng.p.Parameter:
+	"""asyncio replacement for `optimizer.minimize` using nevergrad's ask/tell interface
+
+	keeps up to `max_inflight` evaluations of `func(**candidate.kwargs)` running as coroutines.
+	as soon as one finishes, its loss is told to the optimizer and a new candidate is asked for.
+	the optimizer should be created with `num_workers = max_inflight`, so that it keeps
+	proposing new points while earlier ones are still pending.
+	an evaluation that raises is told `FAILED_LOSS`.
+
+	### Parameters:
+	 - `optimizer : ng.optimizers.base.Optimizer`
+	 - `func : Callable[..., Awaitable[float]]`
+	   coroutine function taking the instrumentation kwargs, returning the loss
+	 - `max_inflight : int`
+	   number of evaluations to keep running at the same time
+	 - `resumed : Sequence[Tuple[ng.p.Parameter, str, Awaitable[float]]]`
+	   evaluations left in flight by a previous run of the sweep: candidate, ledger uid, and evaluation
+	   (defaults to `()`)
+	 - `n_asked : Optional[int]`
+	   candidates asked so far, counted against the budget. if `None`, uses `optimizer.num_ask`
+	   (defaults to `None`)
+	 - `ledger : Optional[SweepLedger]`
+	   if given, every ask and tell is recorded in it
+	   (defaults to `None`)
+	 - `checkpoint_file : Optional[str]`
+	   if given, the optimizer is dumped here every `checkpoint_every` seconds and at the end
+	   (defaults to `None`)
+	 - `checkpoint_every : float`
+	   (defaults to `300.0`)
+
+	### Returns:
+	 - `ng.p.Parameter`
+	   the optimizer's recommendation
+	"""
+	pending : Dict[asyncio.Future, Tuple[ng.p.Parameter, str]] = {
+		asyncio.ensure_future(evaluation) : (candidate, uid)
+		for candidate, uid, evaluation in resumed
+	}
+	if n_asked is None:
+		n_asked = optimizer.num_ask
+
+	loop = asyncio.get_running_loop()
+	last_checkpoint = loop.time()
+
+	while pending or n_asked < optimizer.budget:
+		# fill all free slots
+		while len(pending) < max_inflight and n_asked < optimizer.budget:
+			candidate = optimizer.ask()
+			n_asked += 1
+			if ledger is not None:
+				ledger.asked(candidate.uid, candidate.kwargs)
+			pending[asyncio.ensure_future(func(**candidate.kwargs))] = (candidate, candidate.uid)
+
+		done, _ = await asyncio.wait(pending, return_when = asyncio.FIRST_COMPLETED)
+
+		for fut in done:
+			candidate, uid = pending.pop(fut)
+			try:
+				loss = fut.result()
+			except Exception as e:
+				print('> evaluation failed:\t%s\n\t%r' % (str(candidate.kwargs), e))
+				loss = FAILED_LOSS
+			optimizer.tell(candidate, loss)
+			if ledger is not None:
+				ledger.told(uid, float(loss))
+
+		if checkpoint_file is not None and loop.time() - last_checkpoint >= checkpoint_every:
+			save_checkpoint(optimizer, checkpoint_file, ledger)
+			last_checkpoint = loop.time()
+
+	if checkpoint_file is not None:
+		save_checkpoint(optimizer, checkpoint_file, ledger)
+
+	return optimizer.provide_recommendation()
+
+
+def save_checkpoint(
+		optimizer : ng.optimizers.base.Optimizer,
+		checkpoint_file : str,
+		ledger : Optional[SweepLedger] = None,
+	) -> None:
+	"""dumps the optimizer state, then marks the checkpoint in the ledger
+
+	the dump is written next to `checkpoint_file` and moved into place,
+	so a crash while dumping leaves the previous checkpoint intact. the dump
+	keeps the number of results in the ledger as `LEDGER_TOLD_ATTR`, so that a crash
+	before the ledger is marked does not get those results told twice on resume
+	"""
+	if ledger is not None:
+		setattr(optimizer, LEDGER_TOLD_ATTR, ledger.n_told)
+	tmp = checkpoint_file + '.tmp'
+	optimizer.dump(tmp)
+	os.replace(tmp, checkpoint_file)
+	if ledger is not None:
+		ledger.checkpointed(ledger.n_told)
+	print('> checkpoint:\t%s\t(%d told)' % (checkpoint_file, optimizer.num_tell))
+
+
+def resume_sweep(
+		optimizer : ng.optimizers.base.Optimizer,
+		ledger : SweepLedger,
+		run_ID : str = 'NG_CROSS',
+		cfg_dir : str = 'psweep/config/',
+		default_data : dict = ps.CONSTS_DEFAULT,
+		default_order : Sequence = ps.CONSTS_DEFAULT_KEYS,
+	) -> Tuple[List[Tuple[ng.p.Parameter, str, Awaitable[float]]], int]:
+	"""replays `ledger` into `optimizer`, which is either fresh or loaded from the last checkpoint
+
+	results told after the checkpoint are told again. candidates that were in flight are
+	re-attached to their runs if those are still queued or running (or already finished).
+	otherwise, their partial output is retired (see `result_cache.retire_run`) and they are resubmitted
+
+	### Returns:
+	 - `List[Tuple[ng.p.Parameter, str, Awaitable[float]]]`
+	   evaluations to pass to `minimize_async` as `resumed`
+	 - `int`
+	   number of candidates asked so far, to pass to `minimize_async` as `n_asked`
+	"""
+	pending, told_since, job_ids, n_asked = ledger.replay(getattr(optimizer, LEDGER_TOLD_ATTR, None))
+
+	for params, loss in told_since:
+		optimizer.tell(optimizer.parametrization.spawn_child(new_value = ((), params)), loss)
+
+	# so that the 'sbatch' backend can find (and cancel) jobs submitted before the restart
+	if job_ids:
+		get_array_submitter(run_ID).job_ids.update(job_ids)
+
+	resumed : List[Tuple[ng.p.Parameter, str, Awaitable[float]]] = []
+	n_attached = 0
+	for uid, params in pending.items():
+		cfg_ID = create_config(
+			params = params,
+			run_ID = run_ID,
+			cfg_dir = cfg_dir,
+			default_data = default_data,
+			default_order = default_order,
+		)
+		dirname = DATA_DIR + '%s_ID%s/' % (run_ID, cfg_ID)
+		# runs that finished while the driver was down are only read, whether or not the cache is used
+		attach = run_status(dirname) == 'done' or ALIVE_BACKENDS[BACKEND](cfg_ID = cfg_ID, run_ID = run_ID)
+		n_attached += int(attach)
+
+		# links to cached runs belong to someone else, those are only waited on
+		own_run = os.path.isdir(dirname) and not os.path.islink(os.path.normpath(dirname))
+		if not attach and own_run and run_status(dirname) in ('running', 'stale'):
+			print('> resume:\tretired dead run %s -> %s' % (dirname, retire_run(dirname)))
+			get_watcher().forget(dirname)
+
+		resumed.append((
+			optimizer.parametrization.spawn_child(new_value = ((), params)),
+			uid,
+			eval_parameter_set_async(
+				params = params,
+				run_ID = run_ID,
+				cfg_dir = cfg_dir,
+				default_data = default_data,
+				default_order = default_order,
+				attach = attach,
+			),
+		))
+
+	print('> resume:\tretold %d results, %d runs in flight (%d queued, running or finished)' % (
+		len(told_since), len(resumed), n_attached,
+	))
+	return (resumed, n_asked)
+
+
+
+
+def load_history(
+		source : str,
+		run_ID : str = '',
+	) -> 'pd.DataFrame':
+	"""loads already evaluated runs, from a psweep results table or pickled dataframe, or a run directory
+
+	### Parameters:
+	 - `source : str`   
+	   a table (or pickled dataframe) saved by `psweep_load.read_and_save`, or a data directory such as `DATA_DIR`
+	 - `run_ID : str`   
+	   if `source` is a directory, only read runs matching `{run_ID}_*`
+	   (defaults to `''`)
+	"""
+	# pandas is only needed for warm starts
+	import pandas as pd
+	from psweep.psweep_load import read_all_data
+	from psweep.colstore import is_table, load_table
+
+	if is_table(source):
+		return load_table(source)
+	if os.path.isdir(source):
+		return read_all_data(datadir = os.path.join(source, ''), run_ID = run_ID)
+	return pd.read_pickle(source)
+
+
+def warm_start(
+		optimizer : ng.optimizers.base.Optimizer,
+		data : 'pd.DataFrame',
+		ranges : Dict[str,List[float]] = ps.CONSTS_RANGES,
+		sweep_type : Dict[str,str] = ps.CONSTS_SWEEP_TYPE,
+		default_data : dict = ps.CONSTS_DEFAULT,
+		metric : str = 'TEST_ACCURACY',
+		rtol : float = 1e-5,
+	) -> int:
+	"""tells the optimizer the results of already evaluated runs, before asking for new points
+
+	a row is dropped if:
+	 - any key of `ranges` is missing, or outside the current bounds (or not positive, for 'log' keys)
+	 - a hyperparameter that is not swept differs from `default_data`, since that is a different objective
+	 - `metric` is missing
+	
+	### Parameters:
+	 - `optimizer : ng.optimizers.base.Optimizer`   
+	   must use the parametrization from `setup_instr(ranges, sweep_type)`
+	 - `data : pd.DataFrame`   
+	   one row per run, as produced by `psweep_load.read_all_data`
+	 - `metric : str`   
+	   accuracy column, `100 - metric` is told as the loss
+	   (defaults to `'TEST_ACCURACY'`)
+	 - `rtol : float`   
+	   relative tolerance when comparing fixed hyperparameters to `default_data`
+	   (defaults to `1e-5`)
+
+	### Returns:
+	 - `int` 
+	   number of points told
+	"""
+	bounds = { k : list_to_bounding_kwargs(ranges[k]) for k in ranges }
+
+	# hyperparameters held fixed in this sweep
+	fixed = [
+		k for k in default_data 
+		if k not in ranges and k not in ps.CONSTS_DEFAULT_KEYS_META and k in data.columns
+	]
+
+	n_told = 0
+	for _, row in data.iterrows():
+		if metric not in row or np.isnan(row[metric]):
+			continue
+
+		if any(
+			not np.isclose(float(row[k]), float(default_data[k]), rtol = rtol)
+			for k in fixed
+		):
+			continue
+
+		point = dict()
+		for k in ranges:
+			if k not in row or np.isnan(row[k]):
+				break
+			x = float(row[k])
+			if not (bounds[k]['lower'] <= x <= bounds[k]['upper']):
+				break
+			if sweep_type[k] == 'log' and x <= 0:
+				break
+			point[k] = x
+		else:
+			candidate = optimizer.parametrization.spawn_child(new_value = ((), point))
+			optimizer.tell(candidate, 100 - float(row[metric]))
+			n_told += 1
+
+	print('> warm start:\ttold %d of %d runs' % (n_told, len(data)))
+	return n_told
 
 
 def read_cmd(
@@ -373,6 +1119,21 @@ def run_nevergrad(
 		file_out : str = 'NG_out.txt',
 		ranges : Dict[str,List[float]] = ps.CONSTS_RANGES,
 		sweep_type : Dict[str,str] = ps.CONSTS_SWEEP_TYPE,
+		backend : str = BACKEND,
+		threads_per_job : int = THREADS_PER_JOB,
+		use_cache : bool = USE_CACHE,
+		cache_on_failed : str = CACHE_ON_FAILED,
+		use_registry : bool = USE_REGISTRY,
+		array_throttle : Optional[int] = ARRAY_THROTTLE,
+		admission : bool = ADMISSION,
+		mem_safety : float = MEM_SAFETY_FACTOR,
+		halving_rungs : Optional[List[float]] = HALVING_RUNGS,
+		halving_eta : float = HALVING_ETA,
+		warm_start_from : Optional[str] = None,
+		warm_start_run_ID : str = '',
+		checkpoint : Optional[str] = None,
+		checkpoint_every : float = 300.0,
+		resume : bool = False,
 	):
 	"""tries to optimize hyperparameters using nevergrad
 	
@@ -380,13 +1141,13 @@ def run_nevergrad(
 	 - `ng_budget : int`   
 	   budget of how many hyperparameter sets to try
 	 - `walltime_wait : float`   
-	   interval (seconds) between checking that the training is done
+	   interval (seconds) between scans for finished runs, when inotify is not available
 	   (defaults to `WALLTIME_WAIT`)
 	 - `walltime_limit : int`   
 	   maximum steps of `WALLTIME_WAIT` before aborting
 	   (defaults to `WALLTIME_LIMIT`)
 	 - `ng_workers : int`   
-	   number of nevergrad workers
+	   number of evaluations kept in flight at the same time
 	   (defaults to `1`)
 	 - `file_out : str`   
 	   where to save the nevergrad output
@@ -397,16 +1158,98 @@ def run_nevergrad(
 	 - `sweep_type : Dict[str,str]`   
 	   type to sweep (logarithmic, scalar, int, etc)
 	   (defaults to `ps.CONSTS_SWEEP_TYPE`)
+	 - `backend : str`   
+	   where to run the trainer, one of `RUN_BACKENDS`: 'sbatch' submits batches of candidates as slurm job arrays,
+	   'sbatch_single' submits one slurm job per candidate,
+	   'local' runs on this machine with every run pinned to its own cores,
+	   'worker' is like 'local', but keeps `hh_psweep --worker` processes alive between runs (see `psweep/worker_pool.py`)
+	   (defaults to `BACKEND`)
+	 - `threads_per_job : int`   
+	   openMP threads (and cores) per run, for the 'local' and 'worker' backends
+	   (defaults to `THREADS_PER_JOB`)
+	 - `use_cache : bool`   
+	   answer configs that already ran (under any `RUN_ID`) from `psweep_data` instead of retraining
+	   (defaults to `USE_CACHE`)
+	 - `cache_on_failed : str`   
+	   for cached runs that finished without a result: 'retry' re-runs them, 'reuse' reports them as failed
+	   (defaults to `CACHE_ON_FAILED`)
+	 - `use_registry : bool`   
+	   record every config, its submission and its result in the registry of `DATA_DIR` (see `psweep/registry.py`)
+	   (defaults to `USE_REGISTRY`)
+	 - `array_throttle : Optional[int]`   
+	   maximum number of tasks of a job array running at once, for the 'sbatch' backend
+	   (defaults to `ARRAY_THROTTLE`)
+	 - `admission : bool`   
+	   for the 'sbatch' backend: submit every candidate with the partition, memory and `--time` it is predicted
+	   to need (see `psweep/resources.py`), and fail candidates that fit on no partition without running them.
+	   if `False`, the resources from `myJobArray.sh` are used
+	   (defaults to `ADMISSION`)
+	 - `mem_safety : float`   
+	   factor on the predicted peak memory, for `admission`
+	   (defaults to `MEM_SAFETY_FACTOR`)
+	 - `halving_rungs : Optional[List[float]]`   
+	   enables successive halving: at each of these fractions of a full run (e.g. `[0.1, 0.3]`),
+	   runs whose recent loss is not in the best `1 / halving_eta` are stopped, and told `PRUNED_LOSS`
+	   (defaults to `HALVING_RUNGS`)
+	 - `halving_eta : float`   
+	   (defaults to `HALVING_ETA`)
+	 - `warm_start_from : Optional[str]`   
+	   pickled psweep dataframe or data directory with already evaluated runs,
+	   told to the optimizer before any new points are asked for (see `warm_start`)
+	   (defaults to `None`)
+	 - `warm_start_run_ID : str`   
+	   if `warm_start_from` is a directory, only runs matching `{warm_start_run_ID}_*` are read
+	   (defaults to `''`)
+	 - `checkpoint : Optional[str]`   
+	   enables checkpointing: the optimizer is dumped to `{checkpoint}.pkl`, and every ask,
+	   slurm submission and tell is appended to `{checkpoint}.ledger` as it happens
+	   (defaults to `None`)
+	 - `checkpoint_every : float`   
+	   seconds between optimizer dumps
+	   (defaults to `300.0`)
+	 - `resume : bool`   
+	   continue the sweep saved at `checkpoint` after the driver died: loads the last dump,
+	   replays the ledger on top of it, and re-attaches to runs that were in flight
+	   (defaults to `False`)
 	"""
 	global NG_BUDGET
 	global WALLTIME_WAIT
 	global WALLTIME_LIMIT
 	global NG_WORKERS
+	global BACKEND
+	global THREADS_PER_JOB
+	global USE_CACHE
+	global CACHE_ON_FAILED
+	global USE_REGISTRY
+	global ARRAY_THROTTLE
+	global ADMISSION
+	global MEM_SAFETY_FACTOR
+	global HALVING_RUNGS
+	global HALVING_ETA
+	global HALVING_TRACKER
+	global LEDGER
+
+	if backend not in RUN_BACKENDS:
+		raise KeyError('unknown backend %s, expected one of %s' % (backend, list(RUN_BACKENDS)))
+	if resume and checkpoint is None:
+		raise ValueError('resume needs the checkpoint to resume from')
 	
 	# write to global vars,
 	# because passing it all the way down to the relevant function is a hassle
 	WALLTIME_WAIT = walltime_wait
 	WALLTIME_LIMIT = walltime_limit
+	BACKEND = backend
+	THREADS_PER_JOB = threads_per_job
+	USE_CACHE = use_cache
+	CACHE_ON_FAILED = cache_on_failed
+	USE_REGISTRY = use_registry
+	ARRAY_THROTTLE = array_throttle
+	ADMISSION = admission
+	MEM_SAFETY_FACTOR = mem_safety
+	HALVING_RUNGS = halving_rungs
+	HALVING_ETA = halving_eta
+	if halving_rungs:
+		HALVING_TRACKER = RungTracker(n_rungs = len(halving_rungs), eta = halving_eta)
 
 	# echo settings
 	print('running with settings:')
@@ -414,20 +1257,53 @@ def run_nevergrad(
 	print('\t{k}\t: {v}'.format(k = 'walltime-wait', v = walltime_wait))
 	print('\t{k}\t: {v}'.format(k = 'walltime-limit', v = walltime_limit))
 	print('\t{k}\t: {v}'.format(k = 'num-workers', v = ng_workers))
+	print('\t{k}\t: {v}'.format(k = 'backend', v = backend))
 
 	parametrization = setup_instr(
 		ranges = ranges,
 		sweep_type = sweep_type,
 	)
 
-	optimizer = ng.optimizers.NGOpt(
-		parametrization = parametrization,
-		budget = ng_budget,
-		num_workers = ng_workers,
-	)
+	checkpoint_file = None
+	if checkpoint is not None:
+		checkpoint_file = checkpoint + '.pkl'
+		LEDGER = SweepLedger(checkpoint + '.ledger')
+		if not resume and isfile(LEDGER.filename):
+			raise FileExistsError('%s already exists, pass `resume` to continue that sweep' % LEDGER.filename)
+
+	if resume and isfile(checkpoint_file):
+		print('> resume:\tloading %s' % checkpoint_file)
+		optimizer = ng.optimizers.NGOpt.load(checkpoint_file)
+	else:
+		optimizer = ng.optimizers.NGOpt(
+			parametrization = parametrization,
+			budget = ng_budget,
+			num_workers = ng_workers,
+		)
+
+		# warm start results are part of the dump, without one they have to be told again
+		if warm_start_from is not None:
+			warm_start(
+				optimizer,
+				load_history(warm_start_from, run_ID = warm_start_run_ID),
+				ranges = ranges,
+				sweep_type = sweep_type,
+			)
+
+	resumed, n_asked = [], None
+	if resume:
+		resumed, n_asked = resume_sweep(optimizer, LEDGER)
 	
-	with futures.ThreadPoolExecutor(max_workers=optimizer.num_workers) as executor:
-		recc = optimizer.minimize(eval_wrapper, executor=executor, batch_mode=False)
+	recc = asyncio.run(minimize_async(
+		optimizer = optimizer,
+		func = eval_wrapper_async,
+		max_inflight = optimizer.num_workers,
+		resumed = resumed,
+		n_asked = n_asked,
+		ledger = LEDGER,
+		checkpoint_file = checkpoint_file,
+		checkpoint_every = checkpoint_every,
+	))
 
 	with open(file_out, 'w') as f:
 		print(recc.kwargs, file = f)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules are imported as `psweep.*`, from the directory the scripts run in
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
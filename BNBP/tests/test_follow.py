@@ -0,0 +1,22 @@
+"""`psweep/follow.py`"""
+
+import os
+
+from psweep.follow import LiveLoss
+
+
+def test_live_loss_rerun(tmp_path):
+	filename = str(tmp_path / 'loss.txt')
+	with open(filename, 'w') as fout:
+		fout.write('1,2,\n3,4,\n5,6,\n')
+	live = LiveLoss(filename, keep_rows = True)
+	assert live.poll() == 3
+
+	# the run is retired, and its config re-run into the same directory
+	os.rename(filename, filename + '.old')
+	with open(filename, 'w') as fout:
+		fout.write('9,8,\n')
+
+	assert live.poll() == 1
+	assert live.n_rows == 1
+	assert live.curve().tolist() == [ [ 9.0, 8.0 ] ]
@@ -0,0 +1,26 @@
+"""`psweep/ledger.py`"""
+
+from psweep.ledger import SweepLedger
+
+
+def test_replay_after_checkpoint(tmp_path):
+	ledger = SweepLedger(str(tmp_path / 'sweep.ledger'))
+	for i in range(4):
+		ledger.asked(str(i), { 'x' : i })
+	ledger.told('0', 0.5)
+	ledger.told('1', 0.25)
+	ledger.checkpointed(ledger.n_told)
+	ledger.told('2', 0.125)
+
+	# a new process reading the same ledger
+	ledger = SweepLedger(ledger.filename)
+	assert ledger.n_told == 3
+
+	pending, told_since, _, n_asked = ledger.replay()
+	assert pending == { '3' : { 'x' : 3 } }
+	assert told_since == [ ({ 'x' : 2 }, 0.125) ]
+	assert n_asked == 4
+
+	# the dump was moved into place, but the process died before the ledger was marked
+	_, told_since, _, _ = ledger.replay(n_known = 3)
+	assert told_since == []
@@ -0,0 +1,24 @@
+"""`psweep/pivot.py`"""
+
+import numpy as np
+import pandas as pd
+
+from psweep.pivot import PivotIndex, sweep_axes, MAX_GRID_POINTS
+
+
+def test_pivot_binned_ranges():
+	# `GNA` was sampled (nevergrad), not swept on a grid, so it gets binned
+	rng = np.random.default_rng(0)
+	n = 10 * MAX_GRID_POINTS
+	df = pd.DataFrame({
+		'GNA' : rng.uniform(100.0, 200.0, n),
+		'GK' : rng.choice([ 1.0, 2.0, 3.0 ], n),
+		'LOSS_REL' : rng.random(n),
+	})
+	# what `plot_psweep.compute_ranges` returns for these columns
+	ranges = { k : axis.values.tolist() for k, axis in sweep_axes(df).items() }
+
+	index = PivotIndex(df, axes = { k : ranges[k] for k in ('GNA', 'GK') })
+	_, _, img = index.pivot('GNA', 'GK', 'LOSS_REL', agg = 'count')
+
+	assert img.sum() == n
@@ -0,0 +1,35 @@
+"""`psweep/psweep_load.py` on a fake data tree, laid out the way `hh_psweep` writes it"""
+
+import os
+
+from psweep.psweep_load import read_all_data
+from psweep.result_cache import retire_run
+
+
+def write_run(dirname, config_ID, percent = None, n_batches = 3):
+	"""a run directory with a config, a loss curve and, if `percent` is given, a final accuracy"""
+	os.makedirs(dirname)
+	with open(os.path.join(dirname, 'config.txt'), 'w') as fout:
+		print('CONFIG_ID = %s' % config_ID, file = fout)
+		print('RUN_ID = RUN', file = fout)
+	with open(os.path.join(dirname, 'loss.txt'), 'w') as fout:
+		for i in range(n_batches):
+			print('%f,%f,' % (1.0 / (i + 1), 2.0 / (i + 1)), file = fout)
+	if percent is not None:
+		with open(os.path.join(dirname, 'percent0.txt'), 'w') as fout:
+			print('0\t%f' % percent, file = fout)
+		open(os.path.join(dirname, 'DONE.txt'), 'w').close()
+
+
+def test_read_all_data_skips_retired(tmp_path):
+	datadir = str(tmp_path) + '/'
+	# an attempt that was killed, and the re-run of the same config next to it
+	write_run(datadir + 'RUN_ID1', '1', n_batches = 1)
+	retire_run(datadir + 'RUN_ID1')
+	write_run(datadir + 'RUN_ID1', '1', percent = 90.0)
+	write_run(datadir + 'RUN_ID2', '2', percent = 80.0)
+
+	df = read_all_data(datadir, run_ID = 'RUN', registry = False, n_procs = 1)
+
+	assert sorted(df['CONFIG_ID']) == [ '1', '2' ]
+	assert sorted(df['TEST_ACCURACY']) == [ 80.0, 90.0 ]
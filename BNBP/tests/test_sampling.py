@@ -0,0 +1,19 @@
+"""`psweep/sampling.py`"""
+
+from psweep.sampling import latin_hypercube, scale_points
+
+
+def test_scale_points_log_int_key():
+	# `LEARNING_RATE` defaults to an int, but is swept on a log scale and read with `stof`
+	n = 16
+	u = latin_hypercube(n, 2, seed = 0)
+	points = scale_points(u, { 'LEARNING_RATE' : (1e-3, 1.0), 'N_LAYER_1' : (10.0, 20.0) })
+
+	rates = [ p['LEARNING_RATE'] for p in points ]
+	assert all(1e-3 <= r <= 1.0 for r in rates)
+	# one point per slice of the hypercube, none of them rounded onto another
+	assert len(set(rates)) == n
+	assert sum(r < 1e-2 for r in rates) >= 4
+
+	# linear int keys are still rounded
+	assert all(type(p['N_LAYER_1']) is int for p in points)
@@ -0,0 +1,126 @@
+"""`psweep/slurm.py` against a stub `sbatch`, which logs its arguments and prints job ids `101`, `102`, ..."""
+
+import stat
+
+import pytest
+
+from psweep.slurm import submit_array, ArraySubmitter
+
+
+STUB_SBATCH : str = '''#!/bin/sh
+echo "$@" >> "%(log)s"
+echo "$((100 + $(wc -l < "%(log)s")));cluster"
+'''
+
+
+@pytest.fixture
+def sbatch(tmp_path):
+	"""path of the stub, and a function returning the argument lists it was called with"""
+	log = tmp_path / 'calls.txt'
+	stub = tmp_path / 'sbatch'
+	stub.write_text(STUB_SBATCH % { 'log' : log })
+	stub.chmod(stub.stat().st_mode | stat.S_IXUSR)
+
+	def calls():
+		return [ line.split() for line in log.read_text().splitlines() ] if log.exists() else []
+
+	return (str(stub), calls)
+
+
+def option(args, name):
+	return [ a for a in args if a.startswith(name + '=') ][0].split('=', 1)[1]
+
+
+def read_lines(filename):
+	with open(filename, 'r') as fin:
+		return fin.read().splitlines()
+
+
+def test_submit_array(tmp_path, sbatch):
+	stub, calls = sbatch
+	tasks = [ [ '3' ], [ '5', '8' ], [ '13' ] ]
+	job_ids = submit_array(
+		'RUN', tasks, throttle = 4, extra_args = [ '--time=1:00:00' ],
+		array_dir = str(tmp_path / 'arrays'), sbatch_cmd = stub,
+	)
+
+	[ args ] = calls()
+	assert '--parsable' in args and '--time=1:00:00' in args
+	assert option(args, '--array') == '0-2%4'
+	assert option(args, '--job-name') == 'HH_RUN'
+	# the job script gets the mapping file and the run ID
+	assert args[-1] == 'RUN'
+	assert read_lines(args[-2]) == [ '3', '5 8', '13' ]
+	assert job_ids == { '3' : '101_0', '5' : '101_1', '8' : '101_1', '13' : '101_2' }
+
+
+def test_submit_array_splits(tmp_path, sbatch):
+	stub, calls = sbatch
+	tasks = [ [ str(i) ] for i in range(5) ]
+	job_ids = submit_array('RUN', tasks, array_dir = str(tmp_path / 'arrays'), sbatch_cmd = stub, max_array_size = 2)
+
+	args = calls()
+	assert [ option(a, '--array') for a in args ] == [ '0-1', '0-1', '0-0' ]
+	assert [ read_lines(a[-2]) for a in args ] == [ [ '0', '1' ], [ '2', '3' ], [ '4' ] ]
+	# every array gets its own mapping file
+	assert len({ a[-2] for a in args }) == 3
+	assert job_ids == { '0' : '101_0', '1' : '101_1', '2' : '102_0', '3' : '102_1', '4' : '103_0' }
+
+
+def test_submit_array_fails(tmp_path):
+	with pytest.raises(RuntimeError):
+		submit_array('RUN', [ [ '1' ] ], array_dir = str(tmp_path), sbatch_cmd = 'false')
+
+
+def test_array_submitter(tmp_path, sbatch):
+	stub, calls = sbatch
+	submitted = []
+	submitter = ArraySubmitter(
+		'RUN', delay = 60.0, max_batch = 3,
+		on_submitted = submitted.append,
+		throttle = 2, array_dir = str(tmp_path / 'arrays'), sbatch_cmd = stub, max_array_size = 2,
+	)
+
+	# a full batch goes out right away, split at `max_array_size`
+	for cfg_ID in [ 'a', 'b', 'c' ]:
+		submitter.submit(cfg_ID)
+	assert [ option(a, '--array') for a in calls() ] == [ '0-1%2', '0-0%2' ]
+
+	# the rest once flushed
+	submitter.submit('d')
+	assert len(calls()) == 2
+	submitter.flush()
+
+	args = calls()
+	assert option(args[-1], '--array') == '0-0%2'
+	assert read_lines(args[-1][-2]) == [ 'd' ]
+	assert submitter.job_ids == { 'a' : '101_0', 'b' : '101_1', 'c' : '102_0', 'd' : '103_0' }
+	assert submitted == [ { 'a' : '101_0', 'b' : '101_1', 'c' : '102_0' }, { 'd' : '103_0' } ]
+
+
+def test_array_submitter_error(tmp_path):
+	failed = []
+	submitter = ArraySubmitter('RUN', on_error = failed.append, array_dir = str(tmp_path), sbatch_cmd = 'false')
+	submitter.submit('a')
+	submitter.flush()
+	assert failed == [ [ 'a' ] ] and submitter.job_ids == dict()
+
+
+def test_array_submitter_groups(tmp_path, sbatch):
+	stub, calls = sbatch
+	submitter = ArraySubmitter(
+		'RUN', delay = 60.0, extra_args = [ '--account=x' ],
+		array_dir = str(tmp_path / 'arrays'), sbatch_cmd = stub,
+	)
+	submitter.submit('a', [ '--mem-per-cpu=128M' ])
+	submitter.submit('b', [ '--mem-per-cpu=256M' ])
+	submitter.submit('c', [ '--mem-per-cpu=128M' ])
+	submitter.flush()
+
+	# one array per distinct set of flags, on top of the ones given to every array
+	args = calls()
+	assert [ (option(a, '--mem-per-cpu'), option(a, '--account'), read_lines(a[-2])) for a in args ] == [
+		('128M', 'x', [ 'a', 'c' ]),
+		('256M', 'x', [ 'b' ]),
+	]
+	assert submitter.job_ids == { 'a' : '101_0', 'c' : '101_1', 'b' : '102_0' }
@@ -3,51 +3,26 @@
 //#define DONT_SET_PHYSIOLOGY
 
 #include <unordered_map>
+#include <sstream>
 
 #include "configer.h"
 #include "mnist/read_n_mnist.h"
 #include "mnist/poisson_mnist.h"
 #include "mnist/mnist_reader.hpp"
 
-int main (int argc, char** argv) 
+// Trains one config, reading it from the manifest `psweep/config/{run_id}.manifest`,
+// or from `psweep/config/{run_id}_ID{config_id}.txt` if the manifest does not have it.
+// Writes DONE.txt to the run directory when finished, returns the final test accuracy.
+double train_config(std::string const& config_id, std::string const& run_id,
+                    std::vector<uint8_t> const& training_labels, std::vector<uint8_t> const& test_labels)
 {
-    // * threads
-
-    // Set number of openMP threads.
-    int n_threads = omp_get_max_threads();
-    if(argc > 1)
-    {
-        n_threads = atoi(argv[1]);
-        std::cout << "Set number of threads to " << n_threads << std::endl; 
-    }
-    else 
-    {
-        std::cout << "  WARNING: number of threads not specified. Defaulting to 8." << std::endl;
-    }
-    omp_set_num_threads(n_threads);
-    Eigen::setNbThreads(n_threads);
-    
-
     // * read config
-    // get name of config file and read it
-    std::string config_file;
-    if(argc == 2)
-    {
-        std::cout << "\n\nFATAL ERROR: config file not specified in command line args. terminating" << std::endl;
-        return 1;
-    }
-    else if(argc == 3)
-    {
-        std::cout << "\n\nFATAL ERROR: run index not specified in command line args. terminating" << std::endl;
-        return 1;
-    }
-    else 
+    std::unordered_map<std::string, std::string> config = ManifestReader("psweep/config/" + run_id + ".manifest", config_id);
+    if (config.empty())
     {
-        config_file = "psweep/config/" + std::string(argv[3]) + "_ID" + std::string(argv[2]) + ".txt";
+        // read a config file
+        config = ConfigReader("psweep/config/" + run_id + "_ID" + config_id + ".txt");
     }
-
-    // read a config file
-    std::unordered_map<std::string, std::string> config = ConfigReader(config_file);
     
     // * use config
     // update modifiable "consts"
@@ -97,12 +72,12 @@ int main (int argc, char** argv)
     std::cout << std::endl;
 
 
-    // * get data and run
-    auto dataset = mnist::read_dataset<std::vector, std::vector, uint8_t, uint8_t>();
+    // * run
     net.open_loss_file();
 
-    PoissonSampler sampler(n_epochs * mini_batch_size, std::move(dataset.training_labels), 1, true);
-    PoissonSampler test_sampler(10000, std::move(dataset.test_labels), 1, false);
+    // The samplers take ownership of the labels, so every config gets its own copy.
+    PoissonSampler sampler(n_epochs * mini_batch_size, std::vector<uint8_t>(training_labels), 1, true);
+    PoissonSampler test_sampler(10000, std::vector<uint8_t>(test_labels), 1, false);
     for(int s = 0; s < n_sniffs; ++s)
     {
         sampler.ShuffleOrder();
@@ -110,8 +85,91 @@ int main (int argc, char** argv)
         sampler.Reset();
         test_sampler.Reset();
     }
-    net.EvaluateNetwork(&test_sampler, 0, 100);
+    double accuracy = net.EvaluateNetwork(&test_sampler, 0, 100);
     // Create an empty file called DONE.txt to let them know we are done. 
     std::ofstream done_file(net.dirname + "/DONE.txt");
     done_file.close();
+
+    return accuracy;
+}
+
+// Worker mode: trains one config after another without restarting, so the dataset is only read once.
+// Reads lines `<config id> [<run id>]` from stdin until EOF. The run id defaults to `default_run_id`.
+// After each config, a line `RESULT\t<config id>\t<run id>\tDONE\t<accuracy>` 
+// (or `RESULT\t<config id>\t<run id>\tFAILED\t<error>`) is written to stderr.
+int run_worker(std::string const& default_run_id)
+{
+    auto dataset = mnist::read_dataset<std::vector, std::vector, uint8_t, uint8_t>();
+
+    std::string line;
+    while(std::getline(std::cin, line))
+    {
+        std::istringstream fields(line);
+        std::string config_id, run_id;
+        if(!(fields >> config_id))
+            continue;
+        if(!(fields >> run_id))
+            run_id = default_run_id;
+
+        if(run_id.empty())
+        {
+            std::cerr << "RESULT\t" << config_id << "\t\tFAILED\trun index not specified" << std::endl;
+            continue;
+        }
+
+        try
+        {
+            double accuracy = train_config(config_id, run_id, dataset.training_labels, dataset.test_labels);
+            std::cout << std::flush;
+            std::cerr << "RESULT\t" << config_id << "\t" << run_id << "\tDONE\t" << accuracy << std::endl;
+        }
+        catch(std::exception const& e)
+        {
+            // A bad config should not take down the worker and everything queued behind it.
+            std::cout << std::flush;
+            std::cerr << "RESULT\t" << config_id << "\t" << run_id << "\tFAILED\t" << e.what() << std::endl;
+        }
+    }
+    return 0;
+}
+
+int main (int argc, char** argv) 
+{
+    // * threads
+
+    // Set number of openMP threads.
+    int n_threads = omp_get_max_threads();
+    if(argc > 1)
+    {
+        n_threads = atoi(argv[1]);
+        std::cout << "Set number of threads to " << n_threads << std::endl; 
+    }
+    else 
+    {
+        std::cout << "  WARNING: number of threads not specified. Defaulting to 8." << std::endl;
+    }
+    omp_set_num_threads(n_threads);
+    Eigen::setNbThreads(n_threads);
+    
+    // `hh_psweep <threads> --worker [run id]` reads config ids from stdin, see `run_worker`.
+    if(argc > 2 && std::string(argv[2]) == "--worker")
+    {
+        return run_worker(argc > 3 ? std::string(argv[3]) : std::string());
+    }
+
+    // get name of config file
+    if(argc <= 2)
+    {
+        std::cout << "\n\nFATAL ERROR: config file not specified in command line args. terminating" << std::endl;
+        return 1;
+    }
+    else if(argc == 3)
+    {
+        std::cout << "\n\nFATAL ERROR: run index not specified in command line args. terminating" << std::endl;
+        return 1;
+    }
+
+    // * get data and run
+    auto dataset = mnist::read_dataset<std::vector, std::vector, uint8_t, uint8_t>();
+    train_config(std::string(argv[2]), std::string(argv[3]), dataset.training_labels, dataset.test_labels);
 }
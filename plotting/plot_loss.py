@@ -1,6 +1,7 @@
 import os
 import sys
 import warnings
+from typing import *
 
 import numpy as np
 import matplotlib.pyplot as plt
@@ -69,6 +70,42 @@ class LossPlotters(object):
 		plt.show()
 
 
+	@staticmethod
+	def store(path : str, keys : Optional[List[str]] = None, verbose : bool = True, show : bool = True):
+		"""plot the loss of many runs from a curve store (`data_{run_ID}.curves`), without reading their directories
+				
+		# Parameters:
+		 - `path : str`   
+		   curve store written by `psweep_load.read_and_save`, see `BNBP/psweep/curve_store.py`
+		 - `keys : Optional[List[str]]`   
+		   runs to plot, as `{run_ID}_ID{n}`. if `None`, plots every run in the store
+		   (defaults to `None`)
+		 - `verbose : bool`   
+		   whether to print which runs are plotted
+		   (defaults to `True`)
+		 - `show : bool`   
+		   whether to show the plot upon completion (set to False if wrapped in another script)
+		   (defaults to `True`)
+		"""
+		sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'BNBP'))
+		from psweep.curve_store import CurveStore
+
+		names, means, offsets = CurveStore(path).batch_means(keys)
+
+		if verbose:
+			print('plotting data:')
+
+		for i, name in enumerate(names):
+			if verbose:
+				print('\t' + name)
+			curve = means[offsets[i] : offsets[i + 1]]
+			plt.plot(np.arange(0, len(curve), 1), curve, label = name)
+
+		plt.legend()
+		if show:
+			plt.show()
+
+
 
 if __name__ == '__main__':
 	import fire